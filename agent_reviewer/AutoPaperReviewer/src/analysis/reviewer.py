@@ -70,8 +70,9 @@ class ReviewAgent:
         """
         logger.info(f"Starting review for: {pdf_path}")
 
-        # 1. 解析 PDF 获取带页码的文本
-        paper_content = self.pdf_processor.parse_pdf(pdf_path)
+        # 1. 解析 PDF 获取带页码的文本 (逐页流式解析，达到字符上限后不再解析剩余页面)
+        max_chars = (self.config.get('processing') or {}).get('max_input_chars')
+        paper_content = self.pdf_processor.parse_pdf(pdf_path, max_chars=max_chars)
         
         content_len = len(paper_content)
         logger.info(f"Parsed content length: {content_len} characters")
@@ -1,10 +1,31 @@
 import fitz  # PyMuPDF
+import io
 import os
 import logging
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Union
 
 # 配置模块级日志
 logger = logging.getLogger(__name__)
 
+
+@dataclass
+class PageRecord:
+    """
+    单页解析结果。
+
+    Attributes:
+        number (int): 页码 (从 1 开始)。
+        text (str): 去除首尾空白后的页面文本。
+        image_refs (List[int]): 页面中图片的 xref (未解码)。
+        total_pages (int): 文档总页数。
+    """
+    number: int
+    text: str
+    image_refs: List[int] = field(default_factory=list)
+    total_pages: int = 0
+
+
 class PDFProcessor:
     """
     PDF 处理核心类。
@@ -14,15 +35,19 @@ class PDFProcessor:
     def __init__(self):
         pass
 
-    def parse_pdf(self, file_path: str) -> str:
+    def iter_pages(self, file_path: str, max_pages: Optional[int] = None) -> Iterator[PageRecord]:
         """
-        解析 PDF 文件内容。
+        逐页解析 PDF，每次产出一页的记录 (页码、文本、图片引用)。
+
+        内存中只保留当前页，调用方可以边解析边处理 (切块、建索引、拼接 Prompt)，
+        也可以随时停止迭代 (break)，剩余页面不会被解析，文档会被正确关闭。
 
         Args:
             file_path (str): PDF 文件的绝对或相对路径。
+            max_pages (Optional[int]): 最多解析的页数，None 表示全部。
 
-        Returns:
-            str: 包含页码标记的完整文本内容。
+        Yields:
+            PageRecord: 单页记录。
 
         Raises:
             FileNotFoundError: 如果文件不存在。
@@ -41,9 +66,7 @@ class PDFProcessor:
             raise ValueError(error_msg)
 
         logger.info(f"Starting to parse PDF: {file_path}")
-        
-        full_text = []
-        
+
         try:
             # 2. 打开文档
             with fitz.open(file_path) as doc:
@@ -52,36 +75,97 @@ class PDFProcessor:
 
                 # 3. 逐页提取
                 for page_num, page in enumerate(doc, start=1):
+                    if max_pages is not None and page_num > max_pages:
+                        logger.info(f"Stopped after {max_pages} pages (max_pages).")
+                        break
                     # 提取纯文本 (flags=0 保持最基础的读取，也可以尝试 "blocks" 做更复杂的布局分析)
                     # 这里选择 "text" 模式，因为它对 LLM 的 Token 消耗最友好且保留了阅读顺序
                     text = page.get_text("text")
-                    
-                    # 清洗文本：去除多余的首尾空白
-                    clean_text = text.strip()
 
-                    # 4. 注入页码锚点 (关键步骤)
-                    # 格式设计为明显的分隔符，方便 LLM 识别
-                    header = f"\n\n=== Page {page_num} ===\n\n"
-                    
-                    if clean_text:
-                        full_text.append(header + clean_text)
-                    else:
-                        # 即使是空页(如图片页)，保留页码标记也是好的，防止幻觉
-                        full_text.append(header + "[Content is empty or image-only]")
+                    # 图片只记录 xref，不解码图片数据
+                    image_refs = [img[0] for img in page.get_images(full=False)]
 
-            logger.info("PDF parsing completed successfully.")
-            return "".join(full_text)
+                    # 清洗文本：去除多余的首尾空白
+                    yield PageRecord(number=page_num, text=text.strip(), image_refs=image_refs, total_pages=total_pages)
 
         except Exception as e:
             logger.error(f"Failed to parse PDF: {e}")
             raise e
 
-    def save_markdown(self, content: str, output_path: str) -> None:
+    @staticmethod
+    def format_page(record: PageRecord) -> str:
+        """
+        将单页记录格式化为带页码锚点的文本片段。
+
+        Args:
+            record (PageRecord): 单页记录。
+
+        Returns:
+            str: 以页码分隔符开头的文本片段。
+        """
+        # 注入页码锚点 (关键步骤)
+        # 格式设计为明显的分隔符，方便 LLM 识别
+        header = f"\n\n=== Page {record.number} ===\n\n"
+        if record.text:
+            return header + record.text
+        # 即使是空页(如图片页)，保留页码标记也是好的，防止幻觉
+        return header + "[Content is empty or image-only]"
+
+    def iter_markdown(self, file_path: str, max_pages: Optional[int] = None,
+                      max_chars: Optional[int] = None) -> Iterator[str]:
+        """
+        逐页产出带页码标记的文本片段，可按字符预算提前停止。
+
+        Args:
+            file_path (str): PDF 文件的绝对或相对路径。
+            max_pages (Optional[int]): 最多解析的页数，None 表示全部。
+            max_chars (Optional[int]): 累计字符数上限，超出后不再解析后续页面 (最后一页按上限截断)。
+
+        Yields:
+            str: 单页文本片段。
+        """
+        used = 0
+        for record in self.iter_pages(file_path, max_pages=max_pages):
+            chunk = self.format_page(record)
+            if max_chars is not None and used + len(chunk) > max_chars:
+                remaining = max_chars - used
+                if remaining > 0:
+                    yield chunk[:remaining]
+                logger.info(f"Stopped at page {record.number}/{record.total_pages}: reached max_chars={max_chars}.")
+                return
+            used += len(chunk)
+            yield chunk
+
+    def parse_pdf(self, file_path: str, max_pages: Optional[int] = None, max_chars: Optional[int] = None) -> str:
+        """
+        解析 PDF 文件内容。
+
+        Args:
+            file_path (str): PDF 文件的绝对或相对路径。
+            max_pages (Optional[int]): 最多解析的页数，None 表示全部。
+            max_chars (Optional[int]): 累计字符数上限，None 表示不限制。
+
+        Returns:
+            str: 包含页码标记的完整文本内容。
+
+        Raises:
+            FileNotFoundError: 如果文件不存在。
+            ValueError: 如果文件不是 PDF 格式。
+            Exception: 其他解析错误。
+        """
+        # 逐页写入缓冲区，不再保留 "页码标记 + 文本" 的中间列表
+        buffer = io.StringIO()
+        for chunk in self.iter_markdown(file_path, max_pages=max_pages, max_chars=max_chars):
+            buffer.write(chunk)
+        logger.info("PDF parsing completed successfully.")
+        return buffer.getvalue()
+
+    def save_markdown(self, content: Union[str, Iterable[str]], output_path: str) -> None:
         """
         将处理后的文本保存为 Markdown 文件。
 
         Args:
-            content (str): 要保存的文本内容。
+            content (Union[str, Iterable[str]]): 要保存的文本内容，或逐页产出的文本片段 (如 iter_markdown 的结果)。
             output_path (str): 输出文件路径。
         """
         try:
@@ -91,7 +175,11 @@ class PDFProcessor:
                 os.makedirs(output_dir)
 
             with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+                if isinstance(content, str):
+                    f.write(content)
+                else:
+                    for chunk in content:
+                        f.write(chunk)
             
             logger.info(f"Content saved to: {output_path}")
 
@@ -0,0 +1,159 @@
+"""
+ResearchAgent 并发会话吞吐基准测试 (离线)。
+
+在本地启动一个 OpenAI 兼容的假服务 (流式返回，可配置首 token 延迟)，
+每个会话一轮对话 = 一次工具调用 (read_file_tool) + 一次最终回复，对比：
+1. 串行：逐个会话调用 chat()；
+2. 线程：每个会话一个线程调用 chat() (与 Streamlit 每个脚本线程阻塞等待的模式相同)；
+3. 异步：单个事件循环中 asyncio.gather 所有会话的 achat()。
+
+运行: python -m benchmarks.bench_async_agent [会话数]
+"""
+import asyncio
+import contextlib
+import io
+import json
+import shutil
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.agent import ResearchAgent
+
+TOKENS = ["Base", " summary", " looks", " consistent", "."]
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """最小的 /chat/completions 流式实现：对话中还没有工具结果时先请求 read_file_tool"""
+
+    protocol_version = "HTTP/1.1"
+    first_token_latency = 0.3
+    token_interval = 0.02
+
+    def log_message(self, *args):
+        pass
+
+    def _send_chunk(self, payload):
+        data = (f"data: {json.dumps(payload)}\n\n" if payload else "data: [DONE]\n\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _delta(self, delta, finish_reason=None):
+        return {
+            "id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        has_tool_result = any(m.get("role") == "tool" for m in body["messages"])
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(self.first_token_latency)
+        if has_tool_result:
+            for token in TOKENS:
+                self._send_chunk(self._delta({"role": "assistant", "content": token}))
+                time.sleep(self.token_interval)
+            self._send_chunk(self._delta({}, "stop"))
+        else:
+            self._send_chunk(self._delta({"role": "assistant", "tool_calls": [{
+                "index": 0, "id": "call_0", "type": "function",
+                "function": {"name": "read_file_tool", "arguments": json.dumps({"file_name": "base.md"})},
+            }]}))
+            self._send_chunk(self._delta({}, "tool_calls"))
+        if body.get("stream_options", {}).get("include_usage"):
+            self._send_chunk({
+                "id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "bench", "choices": [],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(TOKENS), "total_tokens": 100 + len(TOKENS)},
+            })
+        self._send_chunk(None)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class _FakeOpenAIServer(ThreadingHTTPServer):
+    # 默认 listen backlog 只有 5，大量并发建连时 SYN 被丢弃会引入 1s 的重传延迟
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def _make_agents(base_url: str, sessions: int, tag: str):
+    agents = []
+    for i in range(sessions):
+        agent = ResearchAgent(f"_bench_async_{tag}_{i}", "sk-bench", base_url, "bench-model")
+        (agent.session_dir / "base.md").write_text("# Base\n\nbenchmark paper summary\n", encoding="utf-8")
+        agent.update_phase("read")
+        agents.append(agent)
+    return agents
+
+
+def _run_sequential(agents):
+    for agent in agents:
+        agent.chat("check base.md")
+
+
+def _run_threads(agents):
+    threads = [threading.Thread(target=agent.chat, args=("check base.md",)) for agent in agents]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+async def _run_async(agents):
+    await asyncio.gather(*[agent.achat("check base.md") for agent in agents])
+
+
+def _client_threads() -> int:
+    """客户端侧的线程数 (不含假服务为每个请求创建的处理线程)"""
+    return sum(1 for t in threading.enumerate() if "process_request_thread" not in t.name)
+
+
+def _timed(label: str, sessions: int, run):
+    peak_threads = _client_threads()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, _client_threads())
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    t0 = time.perf_counter()
+    # Agent 在终端打印思考过程，基准测试中屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    sampler.join()
+    print(f"{label:<11}: {elapsed:6.2f}s  {sessions / elapsed:6.2f} turns/s  peak threads={peak_threads - 1}")
+
+
+def main(sessions: int = 16):
+    server = _FakeOpenAIServer(("127.0.0.1", 0), _FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    print(f"sessions   : {sessions} (each turn = 1 tool call + 1 answer, "
+          f"first-token latency {_FakeOpenAIHandler.first_token_latency:.2f}s)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        agents = {mode: _make_agents(base_url, sessions, mode) for mode in ("seq", "threads", "async")}
+    try:
+        _timed("sequential", sessions, lambda: _run_sequential(agents["seq"]))
+        _timed("threads", sessions, lambda: _run_threads(agents["threads"]))
+        _timed("async", sessions, lambda: asyncio.run(_run_async(agents["async"])))
+    finally:
+        server.shutdown()
+        for group in agents.values():
+            for agent in group:
+                shutil.rmtree(agent.session_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 16)
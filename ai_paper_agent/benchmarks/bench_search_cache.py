@@ -0,0 +1,61 @@
+"""
+web_search_tool 缓存基准测试 (离线)。
+
+使用 stub 后端模拟真实搜索延迟，对比：
+1. 冷缓存下的串行查询；
+2. 轻微改写的重复查询 (归一化命中)；
+3. 相同查询的并发请求 (in-flight 合并)。
+
+运行: python -m benchmarks.bench_search_cache
+"""
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from src.kvstore import DiskKVStore
+from src.search import StubBackend, WebSearchService
+
+QUERIES = [
+    "federated learning client drift correction",
+    "personalized federated learning prototype",
+    "non-iid label skew aggregation",
+    "differential privacy federated fine-tuning",
+]
+REWORDED = [
+    "Client drift correction, federated learning",
+    "prototype personalized Federated Learning?",
+    "Non-IID label-skew aggregation",
+    "federated fine-tuning differential privacy",
+]
+
+
+def main(latency: float = 0.5):
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = StubBackend(latency=latency)
+        service = WebSearchService(backend, DiskKVStore(Path(tmp) / "bench.sqlite", ttl=3600))
+
+        t0 = time.perf_counter()
+        for q in QUERIES:
+            service.search(q)
+        cold = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for q in REWORDED:
+            service.search(q)
+        warm = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(service.search, ["brand new concurrent query"] * 8))
+        concurrent = time.perf_counter() - t0
+
+        print(f"backend latency      : {latency:.2f}s per call")
+        print(f"cold  ({len(QUERIES)} queries)   : {cold:.3f}s")
+        print(f"warm  ({len(REWORDED)} reworded)  : {warm:.3f}s")
+        print(f"8 concurrent identical: {concurrent:.3f}s")
+        print(f"backend calls        : {backend.calls} (hits={service.hits}, misses={service.misses})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,26 @@
 import streamlit as st
 import os
 import time
-from pathlib import Path
+import threading
+import functools
+import importlib
+from concurrent.futures import wait as wait_futures
 
 # 引入核心模块
-from src.agent import ResearchAgent
+# 注意：LangChain / FAISS / PyMuPDF 较重，首屏不导入 (见 warm_up 与 load_agent)，侧边栏只依赖下面这些轻量模块
 from src.config import (
-    DOCS_DIR, RES_DIR, 
-    FILE_BASE_INFO, FILE_MEMORY, FILE_FINAL,
+    RES_DIR, ensure_dirs, AGENT_CACHE_MAX_ENTRIES, DRAFT_CANDIDATES, DRAFT_MAX_CANDIDATES, READ_MAX_PAPERS,
+    FILE_BASE_INFO, FILE_MEMORY, FILE_FINAL, FILE_TOTAL,
     FILE_INNOV_1, FILE_INNOV_2, FILE_INNOV_3
 )
 from src.prompts import PromptManager
-
-# 引入 Streamlit 官方的回调处理器
-from langchain_community.callbacks import StreamlitCallbackHandler
+from src.phase_state import get_phase_state
+from src.library import paper_library
+from src.paper_index import get_paper_index
+from src.figures import get_figure_store
+from src.turn_pool import get_turn_pool
+from src.checkpoint import SessionCheckpoint
+from src.drafting import draft_candidates, candidate_brief
 
 # =============================================================================
 # 🔴 关键配置：请在这里填入您的服务器 IP
@@ -30,6 +37,35 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# =============================================================================
+# 0.1 进程级资源 (Streamlit 每次交互都会重新执行本脚本，以下内容每个进程只创建一次)
+# =============================================================================
+@st.cache_resource(show_spinner=False)
+def warm_up():
+    """创建根目录，开始同步论文库全文索引，并在后台线程预先导入 Agent 依赖：研究员填写 API Key 期间完成，首屏不必等待"""
+    ensure_dirs()
+    get_paper_index().refresh()
+
+    def preload():
+        importlib.import_module("src.agent")
+        # OpenAI SDK 在客户端首次访问 .chat 时才导入各接口模块 (约 0.4s)，一并提前完成
+        importlib.import_module("openai.resources")
+
+    thread = threading.Thread(target=preload, name="preload-agent", daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource(show_spinner=False, max_entries=AGENT_CACHE_MAX_ENTRIES)
+def load_agent(session_id, api_key, base_url, model):
+    """
+    同一研究员 + 模型配置在进程内只构建一次 Agent (LLM 客户端、工具集、上下文装配器)，
+    刷新页面或新开标签页时直接复用。
+    """
+    from src.agent import ResearchAgent
+    return ResearchAgent(session_id=session_id, api_key=api_key, base_url=base_url, model=model)
+
+warm_up()
+
 # =============================================================================
 # 1. 身份识别与配置
 # =============================================================================
@@ -47,6 +83,13 @@ USER_RES_DIR = RES_DIR / st.session_state.user_session_id
 if not USER_RES_DIR.exists():
     USER_RES_DIR.mkdir(parents=True, exist_ok=True)
 
+# 里程碑状态由写文件工具事件驱动更新，每次 rerun 只取一次快照
+phase_state = get_phase_state(st.session_state.user_session_id)
+if "phase" not in st.session_state:
+    # 新的浏览器会话：研究员可能在笔记本中手动增删过文件，重新扫描一次
+    phase_state.refresh()
+milestones = phase_state.snapshot()
+
 # 笔记本端口映射
 NOTEBOOK_PORTS = {
     "hejinlin": 8002,
@@ -58,7 +101,7 @@ NOTEBOOK_PORTS = {
 # 2. 核心工具函数 (提前定义以便侧边栏调用)
 # =============================================================================
 def check_milestone(filename):
-    return (USER_RES_DIR / filename).exists()
+    return milestones.has(filename)
 
 def read_file_content(filename):
     path = USER_RES_DIR / filename
@@ -69,7 +112,7 @@ def read_file_content(filename):
 
 def clean_project_files(scope="partial"):
     """清理项目文件：partial仅清除创新点，full清除所有"""
-    files_to_remove = [FILE_MEMORY, FILE_INNOV_1, FILE_INNOV_2, FILE_INNOV_3, FILE_FINAL, "total.md"]
+    files_to_remove = [FILE_MEMORY, FILE_INNOV_1, FILE_INNOV_2, FILE_INNOV_3, FILE_FINAL, FILE_TOTAL]
     
     if scope == "full":
         files_to_remove.append(FILE_BASE_INFO)
@@ -86,6 +129,9 @@ def clean_project_files(scope="partial"):
             try:
                 os.remove(path)
             except Exception: pass
+    # 会话检查点随项目一起作废，重新进入创新点阶段时从头开始
+    SessionCheckpoint(USER_RES_DIR).clear()
+    phase_state.refresh()
 
 def merge_final_report():
     target_files = [FILE_INNOV_1, FILE_INNOV_2, FILE_INNOV_3, FILE_FINAL]
@@ -95,14 +141,166 @@ def merge_final_report():
         if content:
             total_content.append(f"\n\n---\n\n") 
             total_content.append(content)
-    with open(USER_RES_DIR / "total.md", 'w', encoding='utf-8') as f:
+    with open(USER_RES_DIR / FILE_TOTAL, 'w', encoding='utf-8') as f:
         f.write("".join(total_content))
+    phase_state.on_file_written(FILE_TOTAL)
+
+# 知识库后台同步状态 (局部定时刷新，不触发整页 rerun)
+@st.fragment(run_every=3)
+def render_sync_status():
+    # 后台 Worker 随 Agent 创建，此前无需加载 sync_worker (及其依赖的 FAISS)
+    if "agent" not in st.session_state:
+        return
+    from src.sync_worker import peek_sync_worker
+    worker = peek_sync_worker(st.session_state.user_session_id)
+    if worker is None:
+        return
+    status = worker.status()
+    if status["state"] == "indexing" and status["total"]:
+        st.progress(status["done"] / status["total"], text=f"索引中 {status['done']}/{status['total']}")
+    elif status["state"] == "pending":
+        st.caption("⏳ 检测到笔记变化，等待同步...")
+    elif status["state"] == "error":
+        st.caption(f"❌ {status['message']}")
+    if status["last_sync"]:
+        st.caption(f"🕒 上次同步: {time.strftime('%H:%M:%S', time.localtime(status['last_sync']))}")
+
+# 把一轮对话提交到 Agent Worker 池并流式渲染，回复写入对话记录
+# use_cache=False：研究员手动输入的交互式轮次不使用补全缓存
+def render_agent_turn(user_text, use_cache=True, runner=None):
+    job = get_turn_pool().submit(st.session_state.agent, user_text, use_cache=use_cache, runner=runner)
+    return follow_turn(job)
+
+# 渲染 Worker 池中的一轮对话：先重放已产生的事件，再跟随后续 token，工具调用以状态框单独展示。
+# 脚本被 rerun / 刷新页面打断时任务仍在 Worker 中继续，下次运行由 "重新接入" 逻辑接着渲染
+def follow_turn(job):
+    tool_box = st.container()
+    res_slot = st.empty()
+    tool_status = {}
+    full_response = ""
+    for event in job.events(idle_timeout=0.5):
+        if event is None:
+            # 等待期间定期刷新占位，Streamlit 借此及时响应研究员的点击
+            res_slot.markdown(full_response + "▌" if job.state != "queued" else "⏳ 等待空闲的 Agent Worker...")
+            continue
+        kind = event["type"]
+        if kind == "llm_start":
+            # 工具调用后模型会重新生成，只保留最后一次生成的文本
+            full_response = ""
+        elif kind == "token":
+            full_response += event["text"]
+            res_slot.markdown(full_response + "▌")
+        elif kind == "tool_start":
+            tool_status[event["run_id"]] = tool_box.status(f"🔧 {event['tool']}", state="running")
+            tool_status[event["run_id"]].code(event["input"], language=None)
+        elif kind in ("tool_end", "tool_error"):
+            status = tool_status.get(event["run_id"])
+            if status:
+                status.code(event["output"], language=None)
+                status.update(state="complete" if kind == "tool_end" else "error")
+        elif kind == "done":
+            full_response = event["output"] or full_response
+        elif kind == "error":
+            get_turn_pool().collect(job)
+            raise RuntimeError(event["text"])
+    res_slot.markdown(full_response)
+    st.session_state.messages.append({"role": "assistant", "content": full_response})
+    get_turn_pool().collect(job)
+    return full_response
+
+# 从 Agent 的对话历史重建界面上的对话记录 (较早轮次已折叠为摘要，只显示最近的窗口)
+def restored_chat_messages():
+    roles = {"human": "user", "ai": "assistant"}
+    return [
+        {"role": roles[m.type], "content": m.content}
+        for m in st.session_state.agent.chat_history.recent_messages()
+        if m.type in roles and isinstance(m.content, str)
+    ]
+
+# 并行起草 K 个候选创新方向 (在 Agent Worker 池中执行)，预检结果并排展示；选中后作为下一轮输入进入常规对话细化
+NOVELTY_LABELS = {"novel": "🟢 未发现高度相似的工作", "overlap": "🟡 与已有工作部分重合", "close": "🔴 存在高度相似的工作"}
+
+def render_candidate_drafts(stage_num):
+    drafts = st.session_state.get("candidate_drafts")
+    if drafts and drafts["phase"] != st.session_state.phase:
+        drafts = st.session_state.candidate_drafts = None
+    with st.expander("🧪 并行起草候选方向", expanded=bool(drafts)):
+        col_k, col_hint = st.columns([0.25, 0.75])
+        k = col_k.number_input("候选数量", min_value=2, max_value=DRAFT_MAX_CANDIDATES, value=DRAFT_CANDIDATES)
+        hint = col_hint.text_input("补充要求 (可选)", placeholder="例如: 侧重通信效率")
+        busy = (drafts is not None and not drafts["future"].done()) \
+            or get_turn_pool().pending(st.session_state.user_session_id) is not None
+        if st.button("🚀 并行起草", disabled=busy, use_container_width=True):
+            drafts = st.session_state.candidate_drafts = {
+                "phase": st.session_state.phase, "k": int(k), "started": time.time(),
+                "future": get_turn_pool().run_in_pool(draft_candidates, st.session_state.agent, int(k), stage_num, hint),
+            }
+    if not drafts:
+        return
+
+    # 等待期间定期刷新提示，Streamlit 借此及时响应点击；任务保存在 session_state 中，rerun 后继续等待
+    waiting = st.empty()
+    while not drafts["future"].done():
+        waiting.info(f"⏳ 正在并行起草 {drafts['k']} 个候选方向... {time.time() - drafts['started']:.0f}s")
+        wait_futures([drafts["future"]], timeout=0.5)
+    waiting.empty()
+    try:
+        candidates = drafts["future"].result()
+    except Exception as e:
+        st.error(f"起草失败: {e}")
+        st.session_state.candidate_drafts = None
+        return
+
+    for index, (column, candidate) in enumerate(zip(st.columns(len(candidates)), candidates)):
+        with column.container(border=True):
+            st.markdown(f"**{candidate.get('title', '')}**")
+            st.caption(candidate["angle"])
+            st.markdown(candidate.get("summary", ""))
+            if candidate.get("method"):
+                st.markdown(f"**技术路线**：{candidate['method']}")
+            if candidate.get("expected_gain"):
+                st.markdown(f"**预期收益**：{candidate['expected_gain']}")
+            novelty, consistency = candidate["novelty"], candidate["consistency"]
+            st.markdown(f"{NOVELTY_LABELS[novelty['verdict']]} (关键词覆盖 {novelty['coverage']:.0%}，比对 {novelty['checked']} 条)")
+            if novelty["closest"]:
+                st.caption(f"最接近：{novelty['closest']['source']}")
+            if consistency["duplicates"]:
+                st.markdown("🔴 与 " + "、".join(f"{d['file']} ({d['overlap']:.0%})" for d in consistency["duplicates"]) + " 重复")
+            elif consistency["grounding"] == 0:
+                st.markdown("🟡 关键词未出现在 base.md 中，与基准论文关联较弱")
+            else:
+                st.markdown("🟢 与前序创新点不重复")
+            if st.button("✅ 选择并细化", key=f"pick_candidate_{index}", use_container_width=True):
+                st.session_state.picked_candidate = candidate_brief(candidate)
+                st.session_state.candidate_drafts = None
+                st.rerun()
+
+# 重置项目时不再接入尚未收取的对话 (已在执行的轮次会跑完，但结果不进入新的对话记录)
+def discard_pending_turn():
+    job = get_turn_pool().pending(st.session_state.user_session_id)
+    if job is not None:
+        get_turn_pool().collect(job)
 
 # 模态弹窗预览文件
 @st.dialog("📄 文件预览")
 def show_file_content(filename, content):
     st.caption(f"File: {filename}")
     st.markdown(content)
+    # 文中引用的论文图片：预览使用缓存的缩略图，原图在引用时按需提取
+    figure_store = get_figure_store(RES_DIR / st.session_state.user_session_id)
+    figures = figure_store.referenced(content)
+    if figures:
+        figure_store.materialize_references(content)
+        thumbs = [(name, figure_store.thumbnail(name)) for name in figures]
+        thumbs = [(name, str(path)) for name, path in thumbs if path]
+        if thumbs:
+            st.image([path for _, path in thumbs], caption=[name for name, _ in thumbs], width=160)
+
+# --- 状态推断与自愈 (在侧边栏渲染前完成，阶段切换无需额外 rerun) ---
+if "phase" not in st.session_state:
+    st.session_state.phase = milestones.phase
+else:
+    st.session_state.phase = milestones.advance(st.session_state.phase)
 
 # =============================================================================
 # 3. 侧边栏：配置、导航与进度管理
@@ -135,6 +333,16 @@ with st.sidebar:
         config_ready = bool(user_api_key and user_base_url and user_model_name)
         if config_ready:
             st.success("✅ 已连接")
+            pool_status = get_turn_pool().status()
+            st.caption(f"Agent Worker: {pool_status['running']}/{pool_status['workers']} 忙碌"
+                       + (f"，{pool_status['queued']} 轮排队" if pool_status["queued"] else ""))
+            # 共享 LLM 调度器 (httpx 随 Agent 加载，这里按需导入)
+            from src.scheduler import llm_scheduler
+            for provider in llm_scheduler.stats():
+                queued = "，".join(f"{name} {count}" for name, count in provider["queued"].items())
+                st.caption(f"LLM {provider['provider']}: {provider['active']}/{provider['concurrency']} 在途"
+                           + (f"，排队 {queued}" if queued else "")
+                           + (f"，限流暂停 {provider['paused_for']:.0f}s" if provider["paused_for"] > 0 else ""))
         else:
             st.warning("⚠️ 需配置 Key")
 
@@ -148,20 +356,18 @@ with st.sidebar:
         st.link_button("📓 打开专属笔记本", final_url, use_container_width=True)
         if st.button("🔄 同步向量记忆", disabled=not config_ready, use_container_width=True):
             if "agent" in st.session_state:
-                with st.spinner("Indexing..."):
-                    res = st.session_state.agent.sync_knowledge_base()
-                    st.toast(res)
+                # 交给后台 Worker 执行，不阻塞当前会话
+                st.session_state.agent.sync_worker.request_sync()
+                st.toast("已加入后台同步队列")
             else:
                 st.error("请先初始化")
-    
+        render_sync_status()
+
     st.divider()
 
     # --- C. 进度可视化 (复原功能) ---
     st.subheader("📊 研究进度")
     
-    # 进度状态推断 (需要在渲染前更新一次 session_state.phase)
-    if "phase" not in st.session_state: st.session_state.phase = "init"
-    
     def render_step_status(label, filename, associated_phases):
         col1, col2 = st.columns([0.8, 0.2])
         is_completed = check_milestone(filename)
@@ -193,11 +399,13 @@ with st.sidebar:
     # --- D. 重置选项 (复原功能) ---
     with st.expander("⚠️ 重置/危险区", expanded=False):
         if st.button("🔙 重置创新点 (保留Base)", use_container_width=True):
+            discard_pending_turn()
             clean_project_files("partial")
             st.session_state.clear()
             st.rerun()
             
         if st.button("🆕 彻底重置 (新课题)", type="primary", use_container_width=True):
+            discard_pending_turn()
             clean_project_files("full")
             st.session_state.clear()
             st.rerun()
@@ -205,14 +413,16 @@ with st.sidebar:
     # --- E. 论文上传 ---
     st.divider()
     uploaded_file = st.file_uploader("📂 上传 PDF", type=["pdf"])
-    if uploaded_file:
-        save_path = DOCS_DIR / uploaded_file.name
-        with open(save_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        st.toast(f"Saved: {uploaded_file.name}")
-
-    pdf_files = list(DOCS_DIR.glob("*.pdf"))
-    pdf_names = [f.name for f in pdf_files]
+    # 文件保持附加状态时每次 rerun 都会返回同一个 file_id，只在第一次处理
+    if uploaded_file and st.session_state.get("last_upload_id") != uploaded_file.file_id:
+        _, is_new = paper_library.add(uploaded_file.name, uploaded_file.getvalue())
+        # 立即在后台解析并加入全文索引，开始深度阅读时直接命中缓存
+        paper_library.prewarm(uploaded_file.name)
+        get_paper_index().refresh()
+        st.session_state.last_upload_id = uploaded_file.file_id
+        st.toast(f"Saved: {uploaded_file.name}" if is_new else f"已存在相同内容，复用: {uploaded_file.name}")
+
+    pdf_names = paper_library.list_names()
     
     if "pdf_selector" not in st.session_state:
         st.session_state.pdf_selector = pdf_names[0] if pdf_names else None
@@ -222,6 +432,28 @@ with st.sidebar:
         key="pdf_selector_ui",
         disabled=not config_ready
     )
+    # 可选的相关论文：与基准论文并发提取，再合并进 base.md (见 src.reading)
+    related_pdfs = st.multiselect(
+        "相关论文 (可选)", [name for name in pdf_names if name != selected_pdf],
+        key="related_pdfs_ui", max_selections=READ_MAX_PAPERS - 1,
+        disabled=not config_ready or st.session_state.phase != "init"
+    )
+    # 尚未开始阅读时预热当前选中的论文 (已缓存或正在解析时为空操作)
+    if selected_pdf and st.session_state.phase == "init":
+        for name in [selected_pdf] + related_pdfs:
+            paper_library.prewarm(name)
+
+    # --- F. 论文库全文检索 ---
+    paper_query = st.text_input("🔎 检索论文库", placeholder="例如: client drift")
+    if paper_query:
+        t0 = time.perf_counter()
+        hits = get_paper_index().search(paper_query)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        index_stats = get_paper_index().stats()
+        st.caption(f"{len(hits)} 条结果 · {elapsed_ms:.0f} ms · 已索引 {index_stats['papers']} 篇"
+                   + (" (索引更新中...)" if index_stats["syncing"] else ""))
+        for hit in hits:
+            st.markdown(f"**{hit['paper']}** · p.{hit['page']}\n\n> {hit['snippet']}")
 
 # =============================================================================
 # 4. 主界面逻辑
@@ -243,13 +475,12 @@ current_agent_config = {
 if "agent" not in st.session_state or st.session_state.get("last_agent_config") != current_agent_config:
     with st.spinner("正在初始化 Agent..."):
         try:
-            st.session_state.agent = ResearchAgent(
-                session_id=st.session_state.user_session_id,
-                api_key=user_api_key,
-                base_url=user_base_url,
-                model=user_model_name
+            st.session_state.agent = load_agent(
+                st.session_state.user_session_id, user_api_key, user_base_url, user_model_name
             )
             st.session_state.last_agent_config = current_agent_config
+            # 启动该用户的笔记目录监听 (进程内每个用户只有一个 Worker，重复调用为空操作)
+            st.session_state.agent.sync_worker.start()
             st.toast("Agent 已在线")
         except Exception as e:
             st.error(f"初始化失败: {str(e)}")
@@ -258,34 +489,26 @@ if "agent" not in st.session_state or st.session_state.get("last_agent_config")
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-# --- 状态推断与自愈 ---
-if "phase" not in st.session_state:
-    file_phase = "init"
-    if check_milestone("total.md"): file_phase = "done" 
-    elif check_milestone(FILE_FINAL): file_phase = "final" 
-    elif check_milestone(FILE_INNOV_3): file_phase = "final"
-    elif check_milestone(FILE_INNOV_2): file_phase = "innov3"
-    elif check_milestone(FILE_INNOV_1): file_phase = "innov2"
-    elif check_milestone(FILE_BASE_INFO): file_phase = "innov1"
-    st.session_state.phase = file_phase
-
-state_changed = False
-if st.session_state.phase == "read" and check_milestone(FILE_BASE_INFO):
-    st.session_state.phase = "innov1"; state_changed = True
-elif st.session_state.phase == "innov1" and check_milestone(FILE_INNOV_1):
-    st.session_state.phase = "innov2"; state_changed = True
-elif st.session_state.phase == "innov2" and check_milestone(FILE_INNOV_2):
-    st.session_state.phase = "innov3"; state_changed = True
-elif st.session_state.phase == "innov3" and check_milestone(FILE_INNOV_3):
-    st.session_state.phase = "final"; state_changed = True
-
-if state_changed: time.sleep(0.1); st.rerun()
-
 # --- 渲染聊天历史 ---
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
+# --- 重新接入尚未收取的对话 (rerun 或刷新页面打断了渲染，任务仍在 Worker 中执行或已结束) ---
+pending_turn = get_turn_pool().pending(st.session_state.user_session_id)
+if pending_turn is not None:
+    if not st.session_state.messages or st.session_state.messages[-1] != {"role": "user", "content": pending_turn.user_text}:
+        # 刷新页面后对话记录为空，补上这一轮的提问
+        st.session_state.messages.append({"role": "user", "content": pending_turn.user_text})
+        with st.chat_message("user"): st.markdown(pending_turn.user_text)
+    with st.chat_message("assistant"):
+        try:
+            follow_turn(pending_turn)
+        except Exception as e:
+            # 不继续分发阶段逻辑，避免同一轮提问被立即重新提交
+            st.error(f"执行错误: {e}"); st.stop()
+    st.rerun()
+
 # --- 业务逻辑 Phase 分发 ---
 
 # Phase: Init
@@ -294,7 +517,7 @@ if st.session_state.phase == "init":
     if not selected_pdf:
         st.info("请先在侧边栏上传或选择 PDF。")
     else:
-        st.success(f"已选中: **{selected_pdf}**")
+        st.success(f"已选中: **{selected_pdf}**" + (f"，相关论文 {len(related_pdfs)} 篇" if related_pdfs else ""))
         if st.button("🚀 开始深度阅读", type="primary", use_container_width=True):
             st.session_state.phase = "read"
             if not (USER_RES_DIR / FILE_MEMORY).exists():
@@ -306,29 +529,28 @@ if st.session_state.phase == "init":
 elif st.session_state.phase == "read":
     if not check_milestone(FILE_BASE_INFO):
         if not st.session_state.messages or st.session_state.messages[-1]["role"] != "user":
-            trigger_msg = f"请读取文件 '{selected_pdf}'，深入分析并建立 '{FILE_BASE_INFO}'。"
+            if related_pdfs:
+                trigger_msg = (f"请读取基准论文 '{selected_pdf}' 及相关论文 {'、'.join(repr(name) for name in related_pdfs)}，"
+                               f"逐篇提取后合并建立 '{FILE_BASE_INFO}'。")
+            else:
+                trigger_msg = f"请读取文件 '{selected_pdf}'，深入分析并建立 '{FILE_BASE_INFO}'。"
             st.session_state.messages.append({"role": "user", "content": trigger_msg})
             st.rerun()
         
         if st.session_state.messages[-1]["role"] == "user":
             st.session_state.agent.update_phase("read")
             with st.chat_message("assistant"):
-                st_callback = StreamlitCallbackHandler(st.container())
-                full_response = ""
                 try:
                     trigger_msg = st.session_state.messages[-1]["content"]
-                    stream = st.session_state.agent.chat_stream(trigger_msg, callbacks=[st_callback])
-                    res_slot = st.empty()
-                    for chunk in stream:
-                        full_response += chunk
-                        res_slot.markdown(full_response + "▌")
-                    res_slot.markdown(full_response)
-                    st.session_state.messages.append({"role": "assistant", "content": full_response})
+                    runner = None
+                    if related_pdfs:
+                        # 多篇论文：并发提取 + 合并，代替常规的 Agent 对话轮次
+                        from src.reading import run_multi_read
+                        runner = functools.partial(run_multi_read, st.session_state.agent, [selected_pdf] + related_pdfs)
+                    render_agent_turn(trigger_msg, runner=runner)
                     st.rerun()
                 except Exception as e:
                     st.error(f"执行错误: {e}")
-    else:
-        st.session_state.phase = "innov1"; st.rerun()
 
 # Phase: Innovations
 elif st.session_state.phase in ["innov1", "innov2", "innov3"]:
@@ -336,29 +558,30 @@ elif st.session_state.phase in ["innov1", "innov2", "innov3"]:
     current_file, stage_num = phase_map[st.session_state.phase]
 
     if f"ready_{st.session_state.phase}" not in st.session_state:
-        context = {"base_summary": read_file_content(FILE_BASE_INFO), "memory_log": read_file_content(FILE_MEMORY)}
-        st.session_state.agent.update_phase(st.session_state.phase, context)
-        st.session_state.agent.clear_short_term_memory()
-        st.session_state.messages.append({"role": "assistant", "content": f"### 💡 创新点挖掘：第 {stage_num} 点\n\n系统就绪。请提出您的初步想法。"})
+        if st.session_state.agent.restore_checkpoint(st.session_state.phase):
+            # 重启 / 刷新后从会话检查点恢复：对话记录按恢复的历史重建
+            st.session_state.messages = restored_chat_messages()
+            st.session_state.messages.append({"role": "assistant", "content": f"### 💡 创新点挖掘：第 {stage_num} 点\n\n已恢复上次的讨论，请继续。"})
+        else:
+            context = st.session_state.agent.phase_context(st.session_state.phase)
+            st.session_state.agent.update_phase(st.session_state.phase, context)
+            st.session_state.agent.clear_short_term_memory()
+            st.session_state.messages.append({"role": "assistant", "content": f"### 💡 创新点挖掘：第 {stage_num} 点\n\n系统就绪。请提出您的初步想法。"})
         st.session_state[f"ready_{st.session_state.phase}"] = True
         st.rerun()
 
-    if prompt := st.chat_input(f"请输入关于创新点 {stage_num} 的想法..."):
+    render_candidate_drafts(stage_num)
+
+    picked_candidate = st.session_state.pop("picked_candidate", None)
+    if prompt := (st.chat_input(f"请输入关于创新点 {stage_num} 的想法...") or picked_candidate):
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"): st.markdown(prompt)
         with st.chat_message("assistant"):
-            st_callback = StreamlitCallbackHandler(st.container())
-            full_response = ""
             try:
-                stream = st.session_state.agent.chat_stream(prompt, callbacks=[st_callback])
-                res_slot = st.empty()
-                for chunk in stream:
-                    full_response += chunk
-                    res_slot.markdown(full_response + "▌")
-                res_slot.markdown(full_response)
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
-                if check_milestone(current_file):
-                    st.success("🎉 创新点已定稿！"); time.sleep(1); st.rerun()
+                render_agent_turn(prompt, use_cache=False)
+                # 本轮对话中写文件工具已推送里程碑事件：刷新后由状态推断进入下一阶段
+                if phase_state.snapshot().has(current_file):
+                    st.toast("🎉 创新点已定稿！"); st.rerun()
             except Exception as e: st.error(f"Error: {e}")
 
 # Phase: Final
@@ -366,7 +589,7 @@ elif st.session_state.phase == "final":
     st.subheader("🔬 最终实验设计")
     if not check_milestone(FILE_FINAL):
         if "final_triggered" not in st.session_state:
-            context = {"base_summary": read_file_content(FILE_BASE_INFO)}
+            context = st.session_state.agent.phase_context("final")
             st.session_state.agent.update_phase("final", context)
             st.session_state.agent.clear_short_term_memory()
             trigger = "所有创新点已配齐。请设计最终实验方案并写入 final_innov.md。"
@@ -376,18 +599,10 @@ elif st.session_state.phase == "final":
 
         if st.session_state.messages[-1]["role"] == "user":
             with st.chat_message("assistant"):
-                st_callback = StreamlitCallbackHandler(st.container())
-                res_slot = st.empty()
-                full_response = ""
                 try:
                     trigger_text = st.session_state.messages[-1]["content"]
-                    stream = st.session_state.agent.chat_stream(trigger_text, callbacks=[st_callback])
-                    for chunk in stream:
-                        full_response += chunk
-                        res_slot.markdown(full_response + "▌")
-                    res_slot.markdown(full_response)
-                    st.session_state.messages.append({"role": "assistant", "content": full_response})
-                    if check_milestone(FILE_FINAL): st.rerun() 
+                    render_agent_turn(trigger_text)
+                    if phase_state.snapshot().has(FILE_FINAL): st.rerun()
                 except Exception as e:
                     st.error(f"Error: {str(e)}"); del st.session_state["final_triggered"]
     else:
@@ -398,8 +613,8 @@ elif st.session_state.phase == "final":
 # Phase: Done
 elif st.session_state.phase == "done":
     st.header("🏆 提案完成")
-    if not check_milestone("total.md"): merge_final_report()
-    content = read_file_content("total.md")
+    if not check_milestone(FILE_TOTAL): merge_final_report()
+    content = read_file_content(FILE_TOTAL)
     
     col1, col2 = st.columns([0.4, 0.6])
     with col1:
@@ -1,27 +1,61 @@
-import sys
 import os
-from typing import Literal, List
+import asyncio
+import queue
+import threading
+import time
+import json
+import hashlib
+import contextvars
+from typing import Literal, List, Optional
 from pathlib import Path
 
-from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain.agents import create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import SystemMessage
 from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
 # 引入历史记录管理
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
-# 引入向量检索相关库 (用于科研笔记持久化)
-from langchain_community.vectorstores import FAISS
-# === 修改点：新增 ChatOpenAI 导入，用于动态初始化 ===
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_text_splitters import CharacterTextSplitter
-
 # === 修改点：不再从 config 导入 llm 和 API KEY，只导入路径 ===
-from src.config import RES_DIR
+from src.config import RES_DIR, PARALLEL_TOOL_CALLS, HISTORY_BUDGETS, FILE_BASE_INFO, FILE_MEMORY
 from src.tools import ToolFactory
+from src.client_pool import client_registry
+from src.context import ContextAssembler
+from src.usage import UsageTracker
+from src.parallel import ParallelAgentExecutor, READ_ONLY_TOOLS
+from src.streaming import EventQueueHandler
+from src.llm_cache import completion_cache_bypass
+from src.scheduler import request_context, Priority
+from src.history import BoundedChatHistory, make_tool_output_trimmer
 from src.prompts import PromptManager
+from src.sync_worker import get_sync_worker
+from src.phase_state import get_phase_state
+from src.vector_cache import vector_cache, current_index_dir
+from src.checkpoint import SessionCheckpoint
+from src.library import paper_library
+from src.prefetch import PhasePrefetcher
+
+# 各阶段递归注入的前序文件 (用于连贯性检查)
+PHASE_DEPENDENCIES = {
+    "innov2": ["innov1.md"],
+    "innov3": ["innov1.md", "innov2.md"],
+    "final":  ["innov1.md", "innov2.md", "innov3.md"]
+}
+
+# 工具的 OpenAI JSON Schema (按 名称 + 描述 区分)。各研究员的工具集定义相同，
+# 转换涉及动态创建 pydantic 模型 (整套约 60ms)，进程内只做一次，切换阶段 / 恢复检查点时直接复用
+_tool_schema_cache = {}
+_tool_schema_lock = threading.Lock()
+
+
+def _tool_schemas(tools) -> list:
+    key = tuple((tool.name, tool.description) for tool in tools)
+    with _tool_schema_lock:
+        if key not in _tool_schema_cache:
+            _tool_schema_cache[key] = [convert_to_openai_tool(tool) for tool in tools]
+        return _tool_schema_cache[key]
 
 class ResearchAgent:
     """
@@ -31,112 +65,92 @@ class ResearchAgent:
     """
     
     # === 修改点：初始化接收用户动态配置 ===
-    def __init__(self, session_id: str, api_key: str, base_url: str, model: str):
+    def __init__(self, session_id: str, api_key: str, base_url: str, model: str,
+                 tool_thread_context=None):
         """
         初始化 Agent 实例。
         :param session_id: 用户的用户名
         :param api_key: 用户提供的 API Key
         :param base_url: 用户提供的 Base URL
         :param model: 用户选择的模型
+        :param tool_thread_context: 可选，并行工具调用时为工作线程绑定调用方上下文 (见 ParallelAgentExecutor)
         """
         self.session_id = session_id
+        self.tool_thread_context = tool_thread_context
         
         # 1. 动态构建研究员专属目录 (res/{username})
         self.session_dir = RES_DIR / self.session_id
         if not self.session_dir.exists():
             self.session_dir.mkdir(parents=True, exist_ok=True)
             
-        # === 修改点：动态构建 LLM ===
-        self.llm = ChatOpenAI(
-            model=model,
-            temperature=0.0, # 科研任务保持严谨
-            api_key=api_key,
-            base_url=base_url,
-            streaming=True
-        )
-        
-        # 2. 初始化嵌入模型 (用于 FAISS)
-        # 注意：这里假设用户提供的 API Key 也支持 Embedding (通常 OpenAI/DeepSeek 格式兼容)
-        self.embeddings = OpenAIEmbeddings(
-            openai_api_key=api_key,
-            openai_api_base=base_url
-        )
+        # === 修改点：LLM 从进程级注册表获取，同一服务商的会话共享 keep-alive 连接池 ===
+        self.llm = client_registry.get_chat_model(api_key, base_url, model, owner=self)
+
+        # 2. 初始化嵌入模型 (用于 FAISS)，同样来自注册表
+        self.embeddings = client_registry.get_embeddings(api_key, base_url, owner=self)
         
-        # 3. 尝试从硬盘加载该用户的 FAISS 索引
+        # 3. 该用户的 FAISS 索引路径 (懒加载：首次检索时才从进程级共享缓存中获取)
         self.vector_store_path = self.session_dir / "faiss_index"
-        self.vector_store = self._load_vector_store()
-        
-        # 4. 使用工厂生成绑定了特定路径的工具集
-        self.tools = ToolFactory(self.session_dir).get_tools()
+
+        # 4. 绑定该用户的后台知识库同步器 (进程内共享，由 GUI 负责 start)
+        self.sync_worker = get_sync_worker(self.session_id)
+        self.sync_worker.bind_embeddings(self.embeddings)
+        client_registry.add_owner(self.embeddings, self.sync_worker)
+
+        # 5. 使用工厂生成绑定了特定路径的工具集；写入里程碑文件时推送到该用户的阶段状态
+        self.phase_state = get_phase_state(self.session_id)
+        self.tool_factory = ToolFactory(self.session_dir, on_file_written=self.phase_state.on_file_written)
+        self.tools = self.tool_factory.get_tools()
         
-        # 5. 初始对话历史
-        self.chat_history = ChatMessageHistory()
+        # 6. 上下文装配器：控制注入 System Prompt 的各分区 token 预算 (摘要缓存在隐藏目录，不会被知识库同步)
+        self.context_assembler = ContextAssembler(self.session_dir / ".cache" / "digests")
+
+        # 7. 按阶段统计 token / 前缀缓存命中 / 延迟
+        self.usage_tracker = UsageTracker(self.session_id)
+
+        # 8. 初始对话历史：有 token 上限，较早的轮次折叠为滚动摘要 (上限随阶段切换)
+        self.chat_history = BoundedChatHistory(HISTORY_BUDGETS["read"])
         self.agent_executor = None
+        # 当前阶段的 Prompt 模板 (System Prompt + 历史 + 输入)，并行起草候选方向时复用同一前缀
+        self.prompt_template = None
 
-    def _load_vector_store(self):
-        """从硬盘加载持久化向量库"""
-        if self.vector_store_path.exists():
-            try:
-                return FAISS.load_local(
-                    str(self.vector_store_path), 
-                    self.embeddings,
-                    allow_dangerous_deserialization=True # 内部使用，确保安全
-                )
-            except Exception as e:
-                print(f"[System] Warning: Failed to load vector store for {self.session_id}: {e}")
-        return None
+        # 9. 会话检查点：每次切换阶段、每轮对话结束后保存，重启后由 restore_checkpoint 恢复 (数据库首次使用时才打开)
+        self.checkpoint = SessionCheckpoint(self.session_dir)
+        self.phase = None
+        self._system_prompt = None
+        self._inputs_key = None
+
+        # 10. 里程碑写入后在后台预取下一阶段的上下文，重置项目时取消
+        self.prefetcher = PhasePrefetcher(self)
+        self.phase_state.subscribe(self.prefetcher.on_phase_event)
+
+    @property
+    def vector_store(self):
+        """该用户的向量库 (进程内共享、只读)，第一次访问时才加载"""
+        return vector_cache.get(self.session_id, self.embeddings)
+
+    def has_knowledge_base(self) -> bool:
+        """仅检查索引文件是否存在，不触发加载"""
+        return current_index_dir(self.vector_store_path) is not None
 
     def sync_knowledge_base(self) -> str:
         """
-        方案A：手动触发同步。扫描用户目录下所有 .md 文件并持久化到 FAISS 硬盘索引。
+        方案A：手动触发同步 (阻塞)。增量扫描用户目录下的 .md 笔记并持久化到 FAISS 硬盘索引。
+        GUI 中请使用 self.sync_worker.request_sync() 交给后台线程执行。
         """
-        all_docs = []
-        # 扫描用户根目录下所有 Markdown 文件
-        md_files = list(self.session_dir.glob("**/*.md"))
-        
-        if not md_files:
-            return "没有找到任何可同步的 Markdown 笔记。"
-
-        try:
-            from langchain_community.document_loaders import TextLoader
-            for md_path in md_files:
-                # === 过滤逻辑：排除系统文件 ===
-                if md_path.name == "memory.md":
-                    continue
-                # 排除以 . 开头的隐藏文件夹 (如 .silverbullet)
-                if any(part.startswith('.') for part in md_path.parts):
-                    continue
-                # 排除 SilverBullet 插件库
-                if "_plug" in md_path.parts or "Library" in md_path.parts:
-                    continue
-                # === 过滤结束 ===
+        return self.sync_worker.sync_now()
 
-                try:
-                    loader = TextLoader(str(md_path), encoding='utf-8')
-                    all_docs.extend(loader.load())
-                except Exception as load_err:
-                    print(f"[Warning] Failed to load {md_path}: {load_err}")
-                    continue
-
-            if not all_docs:
-                return "未找到有效的笔记文件 (已忽略系统文件)。"
-
-            # 文本切片
-            text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-            texts = text_splitter.split_documents(all_docs)
-
-            # 构建并保存索引
-            self.vector_store = FAISS.from_documents(texts, self.embeddings)
-            self.vector_store.save_local(str(self.vector_store_path))
-            
-            return f"同步成功！已索引 {len(all_docs)} 个有效笔记文件，知识库已更新。"
-        except Exception as e:
-            return f"知识库同步失败: {str(e)}"
+    async def async_sync_knowledge_base(self) -> str:
+        """
+        sync_knowledge_base 的异步版本。
+        同步与后台 Worker 共用同一把锁和增量清单，因此在线程池中执行 sync_now，而不是另写一套异步索引逻辑。
+        """
+        return await asyncio.to_thread(self.sync_worker.sync_now)
 
     def _build_agent(self, system_prompt_content: str):
         """构建底层 Agent 执行链"""
         # 如果存在向量库，则在 System Prompt 中注入检索提示
-        if self.vector_store:
+        if self.has_knowledge_base():
             system_prompt_content += "\n\n[Context: 你已连接到研究员的个人知识库，可以参考其过往笔记进行推导。]"
 
         prompt = ChatPromptTemplate.from_messages([
@@ -145,14 +159,19 @@ class ResearchAgent:
             ("user", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ])
+        self.prompt_template = prompt
 
-        agent = create_tool_calling_agent(self.llm, self.tools, prompt)
+        agent = create_tool_calling_agent(self.llm, _tool_schemas(self.tools), prompt)
 
-        executor = AgentExecutor(
-            agent=agent, 
-            tools=self.tools, 
+        # 同一轮内的多个只读工具调用并发执行，写入保持串行；关闭 PARALLEL_TOOL_CALLS 时所有工具串行执行
+        executor = ParallelAgentExecutor(
+            agent=agent,
+            tools=self.tools,
             verbose=True, # 保持 True 以便在终端看到思考过程
-            handle_parsing_errors=True
+            handle_parsing_errors=True,
+            read_only_tools=READ_ONLY_TOOLS if PARALLEL_TOOL_CALLS else frozenset(),
+            thread_context=self.tool_thread_context,
+            trim_intermediate_steps=make_tool_output_trimmer()
         )
 
         self.agent_executor = RunnableWithMessageHistory(
@@ -166,88 +185,291 @@ class ResearchAgent:
         """切换 Agent 的思考阶段，并递归加载前序文件作为上下文"""
         user_prefix = f"[User {self.session_id}]"
         print(f"\n[System] {user_prefix} Switching Agent Brain to Phase: {phase.upper()}...")
-        
-        # --- 递归上下文注入 ---
-        dependencies = {
-            "innov2": ["innov1.md"],
-            "innov3": ["innov1.md", "innov2.md"],
-            "final":  ["innov1.md", "innov2.md", "innov3.md"]
-        }
-        
+        self.usage_tracker.phase = phase
+        self.chat_history.set_budget(HISTORY_BUDGETS[phase.rstrip("123")])
+
+        # 里程碑写入后已在后台预取过该阶段、且输入未变时直接使用 (见 PhasePrefetcher)
+        inputs_key = self.phase_inputs_key(phase, context_data)
+        prepared = self.prefetcher.take(phase, inputs_key)
+        if prepared is not None:
+            prompt_content, breakdown, report = prepared
+            self.context_assembler.breakdown = dict(breakdown)
+            print(f"[System] {user_prefix} Using prefetched context for phase {phase.upper()}.")
+        else:
+            # 每次切换阶段重新统计 token 分布
+            self.context_assembler.reset()
+            if phase in PHASE_DEPENDENCIES:
+                print(f"[System] {user_prefix} Loading previous context for coherence check...")
+            prompt_content = self.assemble_phase_prompt(phase, context_data, self.context_assembler)
+            report = self.context_assembler.report(phase, prompt_content)
+
+        print(f"[System] {user_prefix} {report}")
+        self.phase = phase
+        self._system_prompt = prompt_content
+        self._inputs_key = inputs_key
+        self._build_agent(prompt_content)
+        self.save_checkpoint()
+        print(f"[System] {user_prefix} Agent is ready with new instructions (Context Injected).")
+
+    def phase_context(self, phase: str) -> Optional[dict]:
+        """各阶段注入 System Prompt 的里程碑文件 (GUI、批处理与后台预取使用同一规则)"""
+        if phase.startswith("innov"):
+            return {"base_summary": self._read_text(FILE_BASE_INFO), "memory_log": self._read_text(FILE_MEMORY)}
+        if phase == "final":
+            return {"base_summary": self._read_text(FILE_BASE_INFO)}
+        return None
+
+    def _read_text(self, filename: str) -> Optional[str]:
+        path = self.session_dir / filename
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        return None
+
+    def phase_inputs_key(self, phase: str, context_data: Optional[dict]) -> str:
+        """某阶段 System Prompt 的全部输入 (上下文、前序文件内容、日期) 的哈希，用于判断预取结果是否仍然有效"""
+        digest = hashlib.sha256()
+        digest.update(f"{phase}\n{PromptManager._get_today()}\n".encode("utf-8"))
+        digest.update(json.dumps(context_data or {}, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        for filename in PHASE_DEPENDENCIES.get(phase, []):
+            digest.update(f"\n{filename}\n{self._read_text(filename)}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def assemble_phase_prompt(self, phase: str, context_data: Optional[dict], assembler: ContextAssembler) -> str:
+        """递归加载前序文件，按 assembler 的分区预算装配 phase 阶段的 System Prompt (不修改 context_data)"""
         accumulated_context = ""
-        if phase in dependencies:
-            print(f"[System] {user_prefix} Loading previous context for coherence check...")
-            for filename in dependencies[phase]:
-                # 从用户的 session_dir 读取前序文件
-                file_path = self.session_dir / filename
-                if file_path.exists():
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            accumulated_context += f"\n\n=== [Context: {filename}] (Already Established) ===\n{content}\n"
-                    except Exception as e:
-                        print(f"[Warning] Failed to load context file {filename}: {e}")
-        
-        if context_data is None:
-            context_data = {}
+        for filename in PHASE_DEPENDENCIES.get(phase, []):
+            # 从用户的 session_dir 读取前序文件
+            file_path = self.session_dir / filename
+            if file_path.exists():
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        content = assembler.fit("prev_innovation", f.read(), filename)
+                        accumulated_context += f"\n\n=== [Context: {filename}] (Already Established) ===\n{content}\n"
+                except Exception as e:
+                    print(f"[Warning] Failed to load context file {filename}: {e}")
+
+        context_data = dict(context_data or {})
         context_data["prev_innovations"] = accumulated_context
+        # 超出预算的大文件替换为缓存摘要
+        if context_data.get("base_summary"):
+            context_data["base_summary"] = assembler.fit("base_summary", context_data["base_summary"], "base.md")
+        if context_data.get("memory_log"):
+            context_data["memory_log"] = assembler.fit("memory_log", context_data["memory_log"], "memory.md")
 
-        prompt_content = ""
         if phase == "read":
-            prompt_content = PromptManager.get_phase1_prompt()
-        elif phase in ["innov1", "innov2", "innov3"]:
-            stage_num = int(phase[-1])
-            prompt_content = PromptManager.get_innovation_prompt(stage_num, context_data or {})
-        elif phase == "final":
-            prompt_content = PromptManager.get_final_prompt()
+            return PromptManager.get_phase1_prompt()
+        if phase in ["innov1", "innov2", "innov3"]:
+            return PromptManager.get_innovation_prompt(int(phase[-1]), context_data)
+        if phase == "final":
+            return PromptManager.get_final_prompt()
+        raise ValueError(f"Unknown phase: {phase}")
+
+    def save_checkpoint(self):
+        """保存会话检查点 (见 SessionCheckpoint)；尚未进入任何阶段时不保存"""
+        if self.phase is None:
+            return
+        try:
+            self.checkpoint.save({
+                "phase": self.phase,
+                "system_prompt": self._system_prompt,
+                "inputs_key": self._inputs_key,
+                "context_breakdown": self.context_assembler.breakdown,
+                "history": self.chat_history.dump(),
+                "papers": dict(self.tool_factory.papers_read),
+            })
+        except Exception as e:
+            print(f"[Warning] Failed to save session checkpoint for User {self.session_id}: {e}")
+
+    def restore_checkpoint(self, phase: Literal["read", "innov1", "innov2", "innov3", "final"]) -> bool:
+        """
+        从会话检查点恢复 phase 阶段的对话历史，并重建执行链。
+        保存后前序文件 / 日期等输入未变化 (phase_inputs_key 一致) 时直接使用保存的 System Prompt，不计算摘要、不调用 LLM；
+        输入已变化时保留对话历史，只按当前输入重新装配 System Prompt (update_phase)。
+        没有该阶段的检查点或检查点损坏时返回 False (调用方改用 update_phase 开始新的对话)。
+        """
+        started = time.perf_counter()
+        try:
+            state = self.checkpoint.load()
+        except Exception as e:
+            print(f"[Warning] Failed to load session checkpoint for User {self.session_id}: {e}")
+            return False
+        if not state or state.get("phase") != phase:
+            return False
+        try:
+            self.chat_history.set_budget(HISTORY_BUDGETS[phase.rstrip("123")])
+            self.chat_history.load(state["history"])
+        except Exception as e:
+            print(f"[Warning] Corrupt session checkpoint for User {self.session_id}: {e}")
+            self.chat_history.clear()
+            return False
+
+        # 读过的论文若内容未变，在后台预热解析缓存 (Agent 重新调用 read_paper_tool 时直接命中)
+        for name, sha in state.get("papers", {}).items():
+            self.tool_factory.papers_read[name] = sha
+            if paper_library.content_hash(name) == sha:
+                paper_library.prewarm(name)
+
+        inputs_key = self.phase_inputs_key(phase, self.phase_context(phase))
+        if state.get("inputs_key") == inputs_key and state.get("system_prompt"):
+            self.phase = phase
+            self._system_prompt = state["system_prompt"]
+            self._inputs_key = inputs_key
+            self.usage_tracker.phase = phase
+            self.context_assembler.breakdown = state.get("context_breakdown", {})
+            self._build_agent(self._system_prompt)
         else:
-            raise ValueError(f"Unknown phase: {phase}")
+            print(f"[System] [User {self.session_id}] Inputs of {phase.upper()} changed since the checkpoint, "
+                  f"rebuilding the prompt and keeping the conversation.")
+            self.update_phase(phase, self.phase_context(phase))
+        print(f"[System] [User {self.session_id}] Restored {phase.upper()} from session checkpoint "
+              f"({self.chat_history.stats()['messages']} messages) in {(time.perf_counter() - started) * 1000:.0f} ms.")
+        return True
 
-        self._build_agent(prompt_content)
-        print(f"[System] {user_prefix} Agent is ready with new instructions (Context Injected).")
+    async def aupdate_phase(self, phase: Literal["read", "innov1", "innov2", "innov3", "final"], context_data: dict = None):
+        """update_phase 的异步版本：阶段切换只涉及本地文件读取与摘要计算，放到线程池执行"""
+        await asyncio.to_thread(self.update_phase, phase, context_data)
+
+    def run_turn(self, user_input: str, events, callbacks: list = None, use_cache: bool = True):
+        """
+        在当前线程中执行一轮对话，事件写入 events (任何带 put_nowait 的队列，见 EventQueueHandler)，
+        以 {"type": "done", "output": 最终回复} 或 {"type": "error", "text": ...} 结束。
+        chat_events 与 GUI 的 Worker 池 (src.turn_pool) 都通过它执行。
+        """
+        if not self.agent_executor:
+            events.put_nowait({"type": "error", "text": "System Error during execution: Agent not initialized. Call update_phase() first."})
+            return
+        handler = EventQueueHandler(events)
+        try:
+            # session_id 参数确保对话历史的隔离；本轮的 LLM / Embedding 请求记在该研究员名下，按交互优先级调度
+            with completion_cache_bypass(not use_cache), \
+                    request_context(self.session_id, default_priority=Priority.INTERACTIVE):
+                result = self.agent_executor.invoke(
+                    {"input": user_input},
+                    config={
+                        "configurable": {"session_id": self.session_id},
+                        "callbacks": [self.usage_tracker, handler] + (callbacks or [])
+                    }
+                )
+            # 先保存检查点再通知结束：界面显示完成时，这一轮已经可以在重启后恢复
+            self.save_checkpoint()
+            events.put_nowait({"type": "done", "output": result.get("output", "")})
+        except Exception as e:
+            events.put_nowait({"type": "error", "text": f"System Error during execution: {str(e)}"})
 
-    def chat_stream(self, user_input: str, callbacks: list = None):
+    def chat_events(self, user_input: str, callbacks: list = None, use_cache: bool = True):
         """
-        生成器函数：流式返回 Agent 的最终回复。
+        生成器函数：以事件流的形式返回 Agent 的执行过程 (见 EventQueueHandler)。
+        Agent 在后台线程中运行，LLM token 一生成就被 yield，首个可见 token 的延迟即模型的 TTFT。
+        结束时产生 {"type": "done", "output": 最终回复}，出错时产生 {"type": "error", "text": ...}。
+        use_cache=False 时本轮跳过补全缓存 (见 CachedChatOpenAI)，用于研究员手动输入的交互式对话。
         """
         if not self.agent_executor:
             raise RuntimeError("Agent not initialized. Call update_phase() first.")
 
         print(f"\n[System] LLM Request Started for User {self.session_id}...") 
 
+        events: "queue.Queue[dict]" = queue.Queue()
+
+        worker = threading.Thread(
+            target=contextvars.copy_context().run, args=(self.run_turn, user_input, events, callbacks, use_cache),
+            name=f"agent-turn-{self.session_id}", daemon=True
+        )
+        worker.start()
+
+        while True:
+            event = events.get()
+            yield event
+            if event["type"] == "done":
+                print(f"\n[System] Stream finished for User {self.session_id}.")
+                break
+            if event["type"] == "error":
+                print(f"\n[Error] {event['text']}")
+                break
+
+    def chat_stream(self, user_input: str, callbacks: list = None, use_cache: bool = True):
+        """
+        生成器函数：逐 token 流式返回 Agent 生成的文本 (不含工具调用事件)。
+        """
+        for event in self.chat_events(user_input, callbacks, use_cache):
+            if event["type"] == "token":
+                yield event["text"]
+            elif event["type"] == "error":
+                yield event["text"]
+
+    def chat(self, user_input: str, use_cache: bool = True):
+        """同步聊天接口：返回最终回复"""
+        for event in self.chat_events(user_input, use_cache=use_cache):
+            if event["type"] == "done":
+                return event["output"]
+            if event["type"] == "error":
+                return event["text"]
+        return ""
+
+    # =========================================================================
+    # 异步接口：同一个事件循环可以同时驱动多个研究员的会话，等待网络 I/O 时不占用线程
+    # =========================================================================
+    async def achat_events(self, user_input: str, callbacks: list = None, use_cache: bool = True):
+        """chat_events 的异步版本 (异步生成器)，事件格式相同"""
+        if not self.agent_executor:
+            raise RuntimeError("Agent not initialized. Call update_phase() first.")
+
+        print(f"\n[System] Async LLM Request Started for User {self.session_id}...")
+
+        events: "asyncio.Queue[dict]" = asyncio.Queue()
+        handler = EventQueueHandler(events)
+
+        async def run():
+            try:
+                with completion_cache_bypass(not use_cache), \
+                        request_context(self.session_id, default_priority=Priority.INTERACTIVE):
+                    result = await self.agent_executor.ainvoke(
+                        {"input": user_input},
+                        config={
+                            "configurable": {"session_id": self.session_id},
+                            "callbacks": [self.usage_tracker, handler] + (callbacks or [])
+                        }
+                    )
+                await asyncio.to_thread(self.save_checkpoint)
+                events.put_nowait({"type": "done", "output": result.get("output", "")})
+            except Exception as e:
+                events.put_nowait({"type": "error", "text": f"System Error during execution: {str(e)}"})
+
+        task = asyncio.create_task(run())
         try:
-            # session_id 参数确保对话历史的隔离
-            stream_iterable = self.agent_executor.stream(
-                {"input": user_input},
-                config={
-                    "configurable": {"session_id": self.session_id},
-                    "callbacks": callbacks or [] 
-                }
-            )
-
-            for chunk in stream_iterable:
-                # 只有当包含 "output" 时，才是最终给用户的回复
-                if "output" in chunk:
-                    # 打印一个小点，表示正在接收数据
-                    sys.stdout.write(".") 
-                    sys.stdout.flush()
-                    yield chunk["output"]
-            
-            print(f"\n[System] Stream finished for User {self.session_id}.")
+            while True:
+                event = await events.get()
+                yield event
+                if event["type"] == "done":
+                    print(f"\n[System] Stream finished for User {self.session_id}.")
+                    break
+                if event["type"] == "error":
+                    print(f"\n[Error] {event['text']}")
+                    break
+        finally:
+            # 调用方提前停止消费时取消后台任务，避免继续消耗 token
+            if not task.done():
+                task.cancel()
 
-        except Exception as e:
-            error_msg = f"System Error during execution: {str(e)}"
-            print(f"\n[Error] {error_msg}")
-            yield error_msg
+    async def achat_stream(self, user_input: str, callbacks: list = None, use_cache: bool = True):
+        """chat_stream 的异步版本：逐 token 返回 Agent 生成的文本"""
+        async for event in self.achat_events(user_input, callbacks, use_cache):
+            if event["type"] == "token":
+                yield event["text"]
+            elif event["type"] == "error":
+                yield event["text"]
 
-    def chat(self, user_input: str):
-        """同步聊天接口"""
-        response = []
-        for chunk in self.chat_stream(user_input):
-            response.append(chunk)
-        return "".join(response)
+    async def achat(self, user_input: str, use_cache: bool = True):
+        """异步聊天接口：返回最终回复"""
+        async for event in self.achat_events(user_input, use_cache=use_cache):
+            if event["type"] == "done":
+                return event["output"]
+            if event["type"] == "error":
+                return event["text"]
+        return ""
 
     def clear_short_term_memory(self):
         """清空短期对话缓存"""
         self.chat_history.clear()
+        self.save_checkpoint()
         print(f"[System] Short-term conversation memory cleared for User {self.session_id}.")
\ No newline at end of file
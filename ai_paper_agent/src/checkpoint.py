@@ -0,0 +1,51 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from src.kvstore import DiskKVStore
+
+# 检查点格式变化时提升版本号，旧版本的检查点视为不存在
+CHECKPOINT_VERSION = 1
+_KEY = "session"
+
+
+class SessionCheckpoint:
+    """
+    研究员会话的检查点 (res/{username}/.cache/session.sqlite，隐藏目录，不会被知识库同步)。
+    只保存恢复一个阶段所需的紧凑状态：
+    - 阶段与已装配好的 System Prompt (上下文分区已按预算替换为摘要) 及各分区的 token 统计；
+    - 有界对话历史 (滚动摘要 + 最近的窗口，见 BoundedChatHistory.dump)；
+    - 读过的论文 (显示名 -> 内容哈希)，解析结果在共享缓存中按哈希复用。
+    Streamlit 重启后直接据此重建 Agent，不重新装配上下文，也不调用 LLM。
+    """
+
+    def __init__(self, session_dir: Path):
+        self.path = session_dir / ".cache" / "session.sqlite"
+        self._store: Optional[DiskKVStore] = None
+        self._lock = threading.Lock()
+
+    def _get_store(self, create: bool) -> Optional[DiskKVStore]:
+        """第一次读写时才打开数据库；只读且文件不存在时不创建"""
+        with self._lock:
+            if self._store is None and (create or self.path.exists()):
+                self._store = DiskKVStore(self.path)
+            return self._store
+
+    def save(self, state: dict):
+        record = {"version": CHECKPOINT_VERSION, "saved_at": time.time(), **state}
+        self._get_store(create=True).set(_KEY, json.dumps(record, ensure_ascii=False))
+
+    def load(self) -> Optional[dict]:
+        store = self._get_store(create=False)
+        raw = store.get(_KEY) if store is not None else None
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        return record if record.get("version") == CHECKPOINT_VERSION else None
+
+    def clear(self):
+        store = self._get_store(create=False)
+        if store is not None:
+            store.delete(_KEY)
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from typing import Dict, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from src.usage import instrument_chat_model
+from src.llm_cache import CachedChatOpenAI, get_completion_store
+from src.scheduler import llm_scheduler, ScheduledTransport, AsyncScheduledTransport
+from src.config import (
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, CLIENT_IDLE_TTL, LLM_CACHE_ENABLED
+)
+
+
+def _key_hash(api_key: str) -> str:
+    """注册表键中只保存 API Key 的哈希，避免明文 Key 出现在日志 / 调试输出里"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+# 正在关闭的 AsyncClient 任务 (持有引用，避免任务在完成前被回收)
+_closing_tasks = set()
+
+
+def _close_async_client(client: httpx.AsyncClient):
+    """
+    AsyncClient 只能在事件循环中关闭：当前线程有运行中的循环 (批处理在协程里释放客户端) 时交给该循环，
+    否则临时起一个循环执行 aclose()。
+    """
+    def _report(task: asyncio.Task):
+        _closing_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[Warning] Failed to close async HTTP pool: {task.exception()}")
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    try:
+        if loop is not None:
+            task = loop.create_task(client.aclose())
+            _closing_tasks.add(task)
+            task.add_done_callback(_report)
+        else:
+            asyncio.run(client.aclose())
+    except RuntimeError:
+        # 连接所属的事件循环已结束 (如 asyncio.run 跑完的批处理)：客户端已标记为关闭，套接字随对象回收释放
+        pass
+    except Exception as e:
+        print(f"[Warning] Failed to close async HTTP pool: {e}")
+
+
+class _Entry:
+    """注册表条目：共享的客户端对象 + 使用者 (弱引用) + 最近使用时间"""
+
+    def __init__(self, client, pool_key: Tuple[str, str]):
+        self.client = client
+        self.pool_key = pool_key
+        self.owners = weakref.WeakSet()
+        self.last_used = time.time()
+
+
+class ClientRegistry:
+    """
+    进程级 LLM / Embedding 客户端注册表。
+    - 按 (base_url, api_key 哈希, model) 复用 ChatOpenAI / OpenAIEmbeddings 实例，二者均为线程安全；
+    - 同一服务商 + Key 的所有客户端共用一对 httpx 连接池 (keep-alive，连接数上限可配置)，
+      不同研究员、不同浏览器标签页之间复用 TCP/TLS 连接；
+    - 连接池的请求都经过共享调度器 (src.scheduler)：按服务商限制并发与 token 速率，按优先级与研究员公平排队；
+    - 没有任何 Agent 持有、且空闲超过 CLIENT_IDLE_TTL 秒的客户端会被清理并关闭连接。
+    """
+
+    def __init__(self,
+                 max_connections: int = HTTP_MAX_CONNECTIONS,
+                 max_keepalive: int = HTTP_MAX_KEEPALIVE,
+                 keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+                 idle_ttl: float = CLIENT_IDLE_TTL):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, _Entry] = {}
+        self._http_pools: Dict[Tuple[str, str], Tuple[httpx.Client, httpx.AsyncClient]] = {}
+
+    # -------------------------------------------------------------------------
+    # 连接池
+    # -------------------------------------------------------------------------
+    def _http_pool(self, pool_key: Tuple[str, str]) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        pool = self._http_pools.get(pool_key)
+        if pool is None:
+            # 调度按服务商划分：同一服务商的不同 Key 共用一个调度器
+            scheduler = llm_scheduler.provider(pool_key[0])
+            pool = (
+                httpx.Client(transport=ScheduledTransport(httpx.HTTPTransport(limits=self.limits), scheduler), timeout=None),
+                httpx.AsyncClient(transport=AsyncScheduledTransport(httpx.AsyncHTTPTransport(limits=self.limits), scheduler), timeout=None),
+            )
+            self._http_pools[pool_key] = pool
+        return pool
+
+    def _acquire(self, key: tuple, pool_key: Tuple[str, str], factory, owner) -> object:
+        with self._lock:
+            self._cleanup_locked()
+            entry = self._entries.get(key)
+            if entry is None:
+                http_client, http_async_client = self._http_pool(pool_key)
+                entry = _Entry(factory(http_client, http_async_client), pool_key)
+                self._entries[key] = entry
+            entry.last_used = time.time()
+            if owner is not None:
+                entry.owners.add(owner)
+            return entry.client
+
+    # -------------------------------------------------------------------------
+    # 对外接口
+    # -------------------------------------------------------------------------
+    def get_chat_model(self, api_key: str, base_url: str, model: str, owner=None) -> ChatOpenAI:
+        pool_key = (base_url, _key_hash(api_key))
+        key = ("chat", base_url, pool_key[1], model)
+
+        def factory(http_client, http_async_client):
+            # 开启补全缓存时，相同请求 (重试、重置后重放同一阶段) 直接回放磁盘中的结果
+            extra = {"completion_store": get_completion_store()} if LLM_CACHE_ENABLED else {}
+            llm = (CachedChatOpenAI if LLM_CACHE_ENABLED else ChatOpenAI)(
+                model=model,
+                temperature=0.0,  # 科研任务保持严谨
+                api_key=api_key,
+                base_url=base_url,
+                streaming=True,
+                # 重试由共享连接池的调度 Transport 负责 (见 src.scheduler)，SDK 不再重复重试
+                max_retries=0,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                **extra
+            )
+            # 记录服务商返回的前缀缓存命中 token 数
+            return instrument_chat_model(llm)
+
+        return self._acquire(key, pool_key, factory, owner)
+
+    def get_embeddings(self, api_key: str, base_url: str, owner=None) -> OpenAIEmbeddings:
+        # 注意：这里假设用户提供的 API Key 也支持 Embedding (通常 OpenAI/DeepSeek 格式兼容)
+        pool_key = (base_url, _key_hash(api_key))
+        key = ("embeddings", base_url, pool_key[1], None)
+
+        def factory(http_client, http_async_client):
+            return OpenAIEmbeddings(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=http_client,
+                http_async_client=http_async_client
+            )
+
+        return self._acquire(key, pool_key, factory, owner)
+
+    def add_owner(self, client, owner):
+        """登记额外的使用者 (如后台同步 Worker)，防止其仍在使用的客户端被回收"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.client is client:
+                    entry.owners.add(owner)
+                    entry.last_used = time.time()
+                    return
+
+    def cleanup_idle(self):
+        with self._lock:
+            self._cleanup_locked()
+
+    def _cleanup_locked(self):
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if len(entry.owners) == 0 and now - entry.last_used > self.idle_ttl:
+                del self._entries[key]
+
+        # 已没有任何客户端引用的连接池，关闭其 keep-alive 连接
+        live_pools = {entry.pool_key for entry in self._entries.values()}
+        for pool_key in list(self._http_pools):
+            if pool_key not in live_pools:
+                http_client, async_http_client = self._http_pools.pop(pool_key)
+                http_client.close()
+                _close_async_client(async_http_client)
+                print(f"[System] Closed idle HTTP pool for {pool_key[0]}.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._entries),
+                "http_pools": len(self._http_pools),
+            }
+
+
+# 全局单例：所有 ResearchAgent 构造路径都必须通过它获取客户端
+client_registry = ClientRegistry()
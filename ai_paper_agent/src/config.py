@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -22,10 +23,13 @@ DOCS_DIR = project_root / 'docs'
 # 结构: res/ <username> / files...
 RES_DIR = project_root / 'res'
 
-# 自动创建根目录
-if not DOCS_DIR.exists():
+# CACHE_DIR: 进程级共享缓存 (搜索结果等)，可随时删除
+CACHE_DIR = project_root / '.cache'
+
+
+def ensure_dirs():
+    """创建根目录 (由 GUI / 批处理入口在启动时调用一次，导入本模块本身不做任何文件操作)"""
     DOCS_DIR.mkdir(parents=True, exist_ok=True)
-if not RES_DIR.exists():
     RES_DIR.mkdir(parents=True, exist_ok=True)
 
 # =============================================================================
@@ -38,6 +42,69 @@ FILE_INNOV_1 = "innov1.md"
 FILE_INNOV_2 = "innov2.md"
 FILE_INNOV_3 = "innov3.md"
 FILE_FINAL = "final_innov.md"
+FILE_TOTAL = "total.md"
 
-# Debug Info
-print(f"✅ Config loaded. Root RES_DIR: {RES_DIR}")
\ No newline at end of file
+# =============================================================================
+# 3. 运行参数 (均可通过环境变量覆盖)
+# =============================================================================
+# 知识库后台同步：笔记连续编辑时，静默多少秒后才触发增量索引
+SYNC_DEBOUNCE_SECONDS = float(os.getenv("SYNC_DEBOUNCE_SECONDS", "3"))
+# 进程内 FAISS 索引共享缓存的内存预算 (MB)，超出后按 LRU 淘汰空闲用户的索引
+VECTOR_CACHE_BUDGET_MB = int(os.getenv("VECTOR_CACHE_BUDGET_MB", "512"))
+# LLM / Embedding 共享 HTTP 连接池：每个 (服务商, Key) 的连接上限与 keep-alive 设置
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# 共享 LLM 请求调度 (见 src.scheduler)：每个服务商 (base_url 主机名) 的并发上限与每分钟 token 上限 (0 表示不限)，
+# LLM_PROVIDER_LIMITS 按主机名单独覆盖，如 {"api.deepseek.com": {"concurrency": 16, "tokens_per_minute": 1000000}}
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_PROVIDER_LIMITS = json.loads(os.getenv("LLM_PROVIDER_LIMITS", "{}"))
+# 服务商返回 429 / 503 (或连接失败、5xx 等临时错误) 时调度器内部的重试次数 (SDK 自身不再重试)，
+# 以及没有 Retry-After 时指数退避的上限 (秒)
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "4"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+# 无人持有的客户端空闲多少秒后被回收
+CLIENT_IDLE_TTL = float(os.getenv("CLIENT_IDLE_TTL", "600"))
+# System Prompt 上下文分区的 token 预算，超出时替换为按内容哈希缓存的摘要
+# prev_innovation 为每个前序 innov 文件单独的预算
+CONTEXT_BUDGETS = {
+    "base_summary": int(os.getenv("CONTEXT_BUDGET_BASE", "6000")),
+    "memory_log": int(os.getenv("CONTEXT_BUDGET_MEMORY", "1500")),
+    "prev_innovation": int(os.getenv("CONTEXT_BUDGET_INNOV", "2500")),
+}
+# 网络搜索：后端 (tavily / stub)、磁盘缓存有效期 (秒) 与条目上限
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "tavily")
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(3 * 24 * 3600)))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "5000"))
+# stub 后端：预置结果文件 (JSON: {查询: [{"content", "url"}]}) 与模拟延迟
+SEARCH_STUB_FILE = os.getenv("SEARCH_STUB_FILE", "")
+SEARCH_STUB_LATENCY = float(os.getenv("SEARCH_STUB_LATENCY", "0"))
+# 并行工具调用：允许模型在同一轮发出多个只读工具调用并发执行 (写入操作始终串行)
+PARALLEL_TOOL_CALLS = os.getenv("PARALLEL_TOOL_CALLS", "1") == "1"
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "4"))
+# LLM 补全缓存 (默认关闭)：temperature=0 时相同请求直接回放磁盘中的结果，超出容量 (MB) 按 LRU 淘汰
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "0") == "1"
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+# 短期对话历史 (chat_history) 各阶段的 token 上限，超出后最早的整轮对话折叠进滚动摘要
+HISTORY_BUDGETS = {
+    "read": int(os.getenv("HISTORY_BUDGET_READ", "4000")),
+    "innov": int(os.getenv("HISTORY_BUDGET_INNOV", "8000")),
+    "final": int(os.getenv("HISTORY_BUDGET_FINAL", "8000")),
+}
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "800"))
+# 单轮内的工具输出：超过该 token 数、且已被模型读过的结果替换为简短引用；最近 N 次 LLM 调用的结果始终保留原文
+TOOL_OUTPUT_REF_TOKENS = int(os.getenv("TOOL_OUTPUT_REF_TOKENS", "1000"))
+TOOL_OUTPUT_KEEP_ROUNDS = int(os.getenv("TOOL_OUTPUT_KEEP_ROUNDS", "2"))
+# Agent 对话 Worker 池的线程数：所有研究员的对话轮次由这组线程执行，超出的排队等待
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "4"))
+# 创新点阶段并行起草的候选方向数量 (GUI 中可调整，上限为 DRAFT_MAX_CANDIDATES)
+DRAFT_CANDIDATES = int(os.getenv("DRAFT_CANDIDATES", "3"))
+DRAFT_MAX_CANDIDATES = int(os.getenv("DRAFT_MAX_CANDIDATES", "5"))
+# GUI 进程内缓存的 Agent 实例上限 (按 用户 + 模型配置 区分)，超出后淘汰最早创建的
+AGENT_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "32"))
+# 多论文阅读：一次最多选择的论文数 (基准论文 + 相关论文)，以及逐篇提取时送入 LLM 的正文 token 上限
+READ_MAX_PAPERS = int(os.getenv("READ_MAX_PAPERS", "4"))
+READ_PAPER_MAX_TOKENS = int(os.getenv("READ_PAPER_MAX_TOKENS", "60000"))
+# 论文库全文检索：查询时遇到进行中的索引同步最多等待的秒数 (超时后先返回已建好部分的结果)
+PAPER_INDEX_SEARCH_WAIT = float(os.getenv("PAPER_INDEX_SEARCH_WAIT", "2"))
\ No newline at end of file
@@ -0,0 +1,143 @@
+import hashlib
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional
+
+from src.config import CONTEXT_BUDGETS
+
+
+# =============================================================================
+# Token 计数
+# =============================================================================
+@lru_cache(maxsize=1)
+def _get_encoder():
+    """cl100k_base 对 OpenAI / DeepSeek 系模型都足够接近；离线无法加载词表时返回 None"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"[Warning] tiktoken unavailable, falling back to length estimate: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        # 中英混排的粗略估计：约 2 个字符 / token
+        return len(text) // 2 + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoder = _get_encoder()
+    if encoder is None:
+        return text[: max_tokens * 2]
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens])
+
+
+# =============================================================================
+# 摘要 (Digest)
+# =============================================================================
+_FRONTMATTER_RE = re.compile(r"\A---\s*\n.*?\n---\s*\n", re.S)
+_HEADING_RE = re.compile(r"^#{1,6}\s")
+
+
+def make_digest(text: str, max_tokens: int, source: str = "") -> str:
+    """
+    抽取式摘要：保留全部标题以及每个小节的首段，超出预算时再按 token 截断。
+    不调用 LLM，结果只取决于文件内容，因此可以按内容哈希永久缓存。
+    """
+    body = _FRONTMATTER_RE.sub("", text).strip()
+
+    kept, in_first_paragraph = [], False
+    for line in body.splitlines():
+        if _HEADING_RE.match(line):
+            if kept:
+                kept.append("")
+            kept.append(line)
+            in_first_paragraph = True
+        elif not line.strip():
+            if in_first_paragraph and kept and kept[-1] and not _HEADING_RE.match(kept[-1]):
+                in_first_paragraph = False
+        elif in_first_paragraph:
+            kept.append(line)
+
+    digest = "\n".join(kept) if kept else body
+    note = f"\n\n[Digest: 原文超出上下文预算，仅保留标题与各节首段。完整内容请调用 read_file_tool 读取 {source}]"
+    return truncate_tokens(digest, max(max_tokens - count_tokens(note), 0)) + note
+
+
+class ContextAssembler:
+    """
+    Prompt 上下文装配器。
+    为每个上下文分区 (base_summary / memory_log / 每个前序 innov 文件) 分配 token 预算：
+    未超预算时原文注入；超预算时替换为按内容哈希缓存的摘要，避免每轮重复发送数万 token 的 System Prompt。
+    """
+
+    def __init__(self, cache_dir: Path, budgets: Optional[Dict[str, int]] = None):
+        self.cache_dir = cache_dir
+        self.budgets = budgets or CONTEXT_BUDGETS
+        self._memo: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.breakdown: Dict[str, dict] = {}
+
+    def digest(self, text: str, budget: int, source: str = "") -> str:
+        """获取 (或生成并缓存) 某段内容在给定预算下的摘要"""
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        key = f"{content_hash[:24]}_{budget}"
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+
+        cache_path = self.cache_dir / f"{key}.md"
+        if cache_path.exists():
+            digest = cache_path.read_text(encoding="utf-8")
+        else:
+            digest = make_digest(text, budget, source)
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                cache_path.write_text(digest, encoding="utf-8")
+            except Exception as e:
+                print(f"[Warning] Failed to persist digest cache {cache_path.name}: {e}")
+
+        with self._lock:
+            self._memo[key] = digest
+        return digest
+
+    def fit(self, section: str, text: Optional[str], source: str = "") -> Optional[str]:
+        """按分区预算返回原文或摘要，并记录本分区的 token 统计"""
+        if not text:
+            return text
+        budget = self.budgets.get(section)
+        raw_tokens = count_tokens(text)
+        if budget is None or raw_tokens <= budget:
+            self.breakdown[source or section] = {"tokens": raw_tokens, "budget": budget, "digest": False}
+            return text
+
+        digest = self.digest(text, budget, source)
+        self.breakdown[source or section] = {
+            "tokens": count_tokens(digest), "budget": budget, "digest": True, "raw_tokens": raw_tokens
+        }
+        return digest
+
+    def reset(self):
+        self.breakdown = {}
+
+    def report(self, phase: str, prompt_text: str) -> str:
+        """生成本阶段最终的 token 分布日志"""
+        parts = []
+        for name, info in self.breakdown.items():
+            label = f"{name}={info['tokens']}"
+            if info["digest"]:
+                label += f" (digest of {info['raw_tokens']})"
+            parts.append(label)
+        total = count_tokens(prompt_text)
+        detail = ", ".join(parts) if parts else "no injected context"
+        return f"Context tokens for phase {phase.upper()}: system_prompt={total} | {detail}"
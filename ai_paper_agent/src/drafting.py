@@ -0,0 +1,177 @@
+import contextvars
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from src.config import FILE_BASE_INFO
+from src.paper_index import get_paper_index
+from src.search import get_search_service
+from src.scheduler import request_context, Priority
+
+# 各候选方向的侧重角度 (依次分配，保证 K 个候选彼此错开)
+DRAFT_ANGLES = [
+    "改进基准方法的核心机制",
+    "引入新的理论分析或收敛 / 误差保证",
+    "提升效率 (通信、计算或存储开销)",
+    "拓展到新的场景、任务或数据分布设定",
+    "增强鲁棒性、公平性或隐私保护",
+]
+# 候选与已定稿创新点的文本重合度超过该值时视为重复
+DUPLICATE_THRESHOLD = 0.6
+# 候选关键词被某条已有工作覆盖的比例：达到 NOVELTY_CLOSE 视为高度相似，达到 NOVELTY_OVERLAP 提示部分重合
+NOVELTY_CLOSE = 0.8
+NOVELTY_OVERLAP = 0.5
+
+_JSON_RE = re.compile(r"\{.*\}", re.S)
+_WORD_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def _draft_request(index: int, k: int, angle: str, hint: str) -> str:
+    return (
+        f"[Candidate Drafting Mode] 研究员希望并行比较 {k} 个候选创新方向，你负责第 {index + 1} 个，"
+        f"侧重角度：{angle}。" + (f"研究员的补充要求：{hint}。" if hint else "") +
+        "不要调用工具，不要写入文件。只输出一个 JSON 对象 (不要代码块)，字段如下：\n"
+        '{"title": "一句话标题", "summary": "2-3 句核心思想", "method": "关键技术路线", '
+        '"expected_gain": "预期收益与验证方式", "keywords": ["3-6 个英文检索关键词"]}'
+    )
+
+
+def _parse_candidate(text: str) -> Dict:
+    match = _JSON_RE.search(text)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            if isinstance(data, dict):
+                data["keywords"] = [str(k) for k in data.get("keywords") or [] if str(k).strip()]
+                return data
+        except json.JSONDecodeError:
+            pass
+    # 模型没有按格式输出时保留原文，研究员仍可阅读与选择
+    first_line = text.strip().splitlines()[0] if text.strip() else "(empty draft)"
+    return {"title": first_line[:80], "summary": text.strip(), "method": "", "expected_gain": "", "keywords": []}
+
+
+def _shingles(text: str) -> set:
+    """英文按词、中文按相邻两字切分，用于粗略的文本重合度比较"""
+    text = text.lower()
+    grams = set(_WORD_RE.findall(text))
+    for run in _CJK_RE.findall(text):
+        grams.update(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+    return grams
+
+
+def _candidate_text(candidate: Dict) -> str:
+    return " ".join(str(candidate.get(field, "")) for field in ("title", "summary", "method", "expected_gain"))
+
+
+def _keyword_coverage(keywords: List[str], text: str) -> float:
+    if not keywords:
+        return 0.0
+    text = text.lower()
+    return sum(keyword.lower() in text for keyword in keywords) / len(keywords)
+
+
+def check_novelty(candidate: Dict) -> Dict:
+    """
+    新颖性预检：用候选的关键词检索论文库全文索引与网络搜索 (均有缓存)，
+    按关键词覆盖率找出最接近的已有工作。只做提示，最终判断交给研究员。
+    """
+    keywords = candidate.get("keywords") or []
+    query = " ".join(keywords) or candidate.get("title", "")
+    evidence = []
+    for hit in get_paper_index().search(query, k=3):
+        evidence.append({"source": f"{hit['paper']} p.{hit['page']}", "text": hit["snippet"]})
+    try:
+        for result in get_search_service().search(query)[:3]:
+            evidence.append({"source": result.get("url", "web"), "text": result.get("content", "")})
+    except Exception as e:
+        print(f"[Warning] Novelty pre-check web search failed: {e}")
+
+    scored = sorted(((_keyword_coverage(keywords, item["text"]), item) for item in evidence),
+                    key=lambda pair: pair[0], reverse=True)
+    best_score, best = scored[0] if scored else (0.0, None)
+    if best_score >= NOVELTY_CLOSE:
+        verdict = "close"
+    elif best_score >= NOVELTY_OVERLAP:
+        verdict = "overlap"
+    else:
+        verdict = "novel"
+    return {"verdict": verdict, "coverage": round(best_score, 2), "closest": best, "checked": len(evidence)}
+
+
+def check_consistency(candidate: Dict, session_dir: Path, stage_num: int) -> Dict:
+    """
+    一致性预检 (纯本地、无 LLM)：
+    - 与已定稿的前序创新点 (innov1 .. innov{n-1}) 的文本重合度，过高说明在重复已有方向；
+    - 关键词在基准论文笔记 base.md 中出现的比例，为 0 说明与基准方法关联很弱。
+    """
+    text = _shingles(_candidate_text(candidate))
+    duplicates = []
+    for n in range(1, stage_num):
+        path = session_dir / f"innov{n}.md"
+        if not path.exists() or not text:
+            continue
+        overlap = len(text & _shingles(path.read_text(encoding="utf-8"))) / len(text)
+        if overlap >= DUPLICATE_THRESHOLD:
+            duplicates.append({"file": path.name, "overlap": round(overlap, 2)})
+
+    base_path = session_dir / FILE_BASE_INFO
+    grounding = None
+    if base_path.exists():
+        grounding = round(_keyword_coverage(candidate.get("keywords") or [], base_path.read_text(encoding="utf-8")), 2)
+    return {"ok": not duplicates and grounding != 0, "duplicates": duplicates, "grounding": grounding}
+
+
+def draft_candidates(agent, k: int, stage_num: int, hint: str = "") -> List[Dict]:
+    """
+    并行起草 k 个候选创新方向。
+    所有请求共享 Agent 当前阶段的 System Prompt 与对话历史 (相同前缀，服务商前缀缓存可命中)，
+    只有最后一条指令不同；每个候选生成后立即在同一线程内做新颖性与一致性预检。
+    """
+    if agent.prompt_template is None:
+        raise RuntimeError("Agent not initialized. Call update_phase() first.")
+    history = agent.chat_history.messages
+
+    def draft(index: int) -> Dict:
+        started = time.perf_counter()
+        messages = agent.prompt_template.format_messages(
+            chat_history=history,
+            input=_draft_request(index, k, DRAFT_ANGLES[index % len(DRAFT_ANGLES)], hint),
+            agent_scratchpad=[],
+        )
+        reply = agent.llm.invoke(messages, config={"callbacks": [agent.usage_tracker]})
+        candidate = _parse_candidate(reply.content if isinstance(reply.content, str) else str(reply.content))
+        candidate["angle"] = DRAFT_ANGLES[index % len(DRAFT_ANGLES)]
+        candidate["draft_seconds"] = round(time.perf_counter() - started, 2)
+        candidate["novelty"] = check_novelty(candidate)
+        candidate["consistency"] = check_consistency(candidate, agent.session_dir, stage_num)
+        return candidate
+
+    started = time.perf_counter()
+    # 每个起草线程复制提交时的 context，请求记在该研究员名下并按交互优先级调度
+    with request_context(agent.session_id, default_priority=Priority.INTERACTIVE), \
+            ThreadPoolExecutor(max_workers=k, thread_name_prefix="draft") as pool:
+        futures = [pool.submit(contextvars.copy_context().run, draft, index) for index in range(k)]
+        candidates = [future.result() for future in futures]
+    print(f"[System] [User {agent.session_id}] Drafted {k} candidate directions for innov{stage_num} "
+          f"in {time.perf_counter() - started:.2f}s (slowest single draft "
+          f"{max(c['draft_seconds'] for c in candidates):.2f}s).")
+    return candidates
+
+
+def candidate_brief(candidate: Dict) -> str:
+    """研究员选中某个候选后，作为下一轮对话输入的说明"""
+    lines = [f"我选择候选方向「{candidate.get('title', '')}」。", f"核心思想：{candidate.get('summary', '')}"]
+    if candidate.get("method"):
+        lines.append(f"技术路线：{candidate['method']}")
+    if candidate.get("expected_gain"):
+        lines.append(f"预期收益：{candidate['expected_gain']}")
+    closest = (candidate.get("novelty") or {}).get("closest")
+    if closest:
+        lines.append(f"预检发现的最接近工作：{closest['source']}。请说明我们与它的差异。")
+    lines.append("请在此基础上细化这个方向。")
+    return "\n".join(lines)
@@ -0,0 +1,151 @@
+import json
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import unquote
+
+from src.library import paper_library
+from src.fsutil import match_mode
+
+MANIFEST_FILE = ".manifest.json"
+# 笔记中对图片的 Markdown 引用 ![说明](目标 "标题")：目标可以是 <...> 形式、含空格或一层括号，也可能经过 URL 编码
+_MARKDOWN_IMAGE_RE = re.compile(r'!\[[^\]]*\]\(\s*(<[^>]+>|(?:[^()]|\([^()]*\))+?)(?:\s+"[^"]*")?\s*\)')
+# read_paper_tool 输出中的引用：[Image Reference: Figure available at figures/xxx.png (640x480 px)]
+_TOOL_REFERENCE_RE = re.compile(r"Figure available at figures/(.+?) \(\d+x\d+ px\)")
+_FIGURE_EXTENSIONS = (".png", ".jpeg", ".jpg", ".jpx")
+
+
+def _figure_name(target: str) -> Optional[str]:
+    """链接目标 -> figures 目录下的文件名；不是 figures/ 下的图片时返回 None"""
+    path = unquote(target.strip().strip("<>")).replace("\\", "/")
+    while path.startswith("./"):
+        path = path[2:]
+    if not path.startswith("figures/"):
+        return None
+    name = path[len("figures/"):]
+    if not name or "/" in name or name.startswith(".") or not name.lower().endswith(_FIGURE_EXTENSIONS):
+        return None
+    return name
+
+
+class FigureStore:
+    """
+    研究员专属的 figures 目录。
+    读论文时只登记图片清单 (figures/.manifest.json：文件名 -> 论文哈希、xref、页码、位置、尺寸)，
+    笔记或 GUI 真正引用某张图时才从 PDF 中提取原图写入该目录；预览使用共享缓存的缩略图。
+    """
+
+    def __init__(self, session_dir: Path):
+        self.figures_dir = session_dir / "figures"
+        self.manifest_path = self.figures_dir / MANIFEST_FILE
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def page_entries(paper: str, sha: str, page: dict) -> Dict[str, dict]:
+        """
+        一页图片的清单条目：文件名 -> 条目。
+        文件名沿用原来的 {论文名}_p{页}_img{序号}.{ext}。
+        """
+        stem = Path(paper).stem
+        return {f"{stem}_{image['name']}": {"paper": paper, "sha": sha, **image} for image in page["images"]}
+
+    def register(self, entries: Dict[str, dict]):
+        """把读论文时收集的清单条目写入 figures/.manifest.json (只写入新增的条目)"""
+        with self._lock:
+            manifest = self._load()
+            # 已登记过的条目保留 (可能已补全 bbox)
+            new_entries = {k: v for k, v in entries.items() if manifest.get(k, {}).get("sha") != v["sha"]}
+            if new_entries:
+                manifest.update(new_entries)
+                self._save_locked(manifest)
+
+    def _save_locked(self, manifest: Dict[str, dict]):
+        self.figures_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.figures_dir, prefix=".manifest.", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        match_mode(tmp_path, self.manifest_path)
+        os.replace(tmp_path, self.manifest_path)
+
+    def lookup(self, file_name: str) -> Optional[dict]:
+        with self._lock:
+            return self._load().get(file_name)
+
+    def materialize(self, file_name: str) -> Optional[Path]:
+        """确保原图存在于 figures 目录；不在清单中 (如研究员自己放入的图片) 时返回已有文件或 None"""
+        path = self.figures_dir / file_name
+        if path.exists():
+            return path
+        entry = self.lookup(file_name)
+        if entry is None:
+            return None
+        data = paper_library.extract_image(entry["sha"], entry, name_hint=entry["paper"])
+        fd, tmp_path = tempfile.mkstemp(dir=self.figures_dir, prefix=f".{file_name}.", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        match_mode(tmp_path, path)
+        os.replace(tmp_path, path)
+        if entry.get("bbox") is None:
+            # 解析时无法区分位置的同尺寸图片，提取时顺便补全
+            bbox = paper_library.image_bbox(entry["sha"], entry, name_hint=entry["paper"])
+            with self._lock:
+                manifest = self._load()
+                if file_name in manifest:
+                    manifest[file_name]["bbox"] = bbox
+                    self._save_locked(manifest)
+        return path
+
+    def referenced(self, text: str) -> List[str]:
+        targets = _MARKDOWN_IMAGE_RE.findall(text) + [f"figures/{name}" for name in _TOOL_REFERENCE_RE.findall(text)]
+        names = (_figure_name(target) for target in targets)
+        return list(dict.fromkeys(name for name in names if name))
+
+    def materialize_references(self, text: str) -> int:
+        """提取 text 中引用到、但尚未落盘的图片，返回新提取的数量"""
+        created = 0
+        for file_name in self.referenced(text):
+            if (self.figures_dir / file_name).exists():
+                continue
+            try:
+                if self.materialize(file_name) is not None:
+                    created += 1
+            except Exception as e:
+                print(f"[System] Failed to extract figure {file_name}: {e}")
+        return created
+
+    def thumbnail(self, file_name: str) -> Optional[Path]:
+        entry = self.lookup(file_name)
+        if entry is None:
+            path = self.figures_dir / file_name
+            return path if path.exists() else None
+        try:
+            return paper_library.thumbnail(entry["sha"], entry, name_hint=entry["paper"])
+        except Exception as e:
+            print(f"[System] Failed to render thumbnail {file_name}: {e}")
+            return None
+
+
+# =============================================================================
+# 进程级注册表：同一研究员目录只有一个 FigureStore (Agent 工具与 GUI 预览共用同一把清单锁)
+# =============================================================================
+_stores: Dict[str, FigureStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_figure_store(session_dir: Path) -> FigureStore:
+    key = str(Path(session_dir).resolve())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = FigureStore(Path(session_dir))
+            _stores[key] = store
+        return store
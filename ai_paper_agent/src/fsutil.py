@@ -0,0 +1,21 @@
+import os
+import stat
+from pathlib import Path
+from typing import Union
+
+# 进程的 umask (只能通过设置来读取，因此在导入时读取一次并立即恢复)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def match_mode(tmp_path: Union[str, Path], target_path: Union[str, Path], directory: bool = False):
+    """
+    tempfile.mkstemp / mkdtemp 创建的文件为 0600、目录为 0700，os.replace 后会沿用。
+    替换前把权限改为目标文件原有的权限，新文件则按 umask 取默认权限 (与 open(path, 'w') / mkdir 一致)，
+    否则 SilverBullet 等其他用户运行的进程将无法读取研究员目录中的文件。
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(target_path).st_mode)
+    except FileNotFoundError:
+        mode = (0o777 if directory else 0o666) & ~_UMASK
+    os.chmod(tmp_path, mode)
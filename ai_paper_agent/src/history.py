@@ -0,0 +1,171 @@
+import json
+import threading
+from typing import Callable, List, Sequence, Tuple
+
+from langchain_core.agents import AgentAction
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, messages_from_dict, messages_to_dict
+
+from src.config import HISTORY_SUMMARY_TOKENS, TOOL_OUTPUT_REF_TOKENS, TOOL_OUTPUT_KEEP_ROUNDS
+from src.context import count_tokens, truncate_tokens
+
+# 被折叠进摘要的单条消息最多保留的 token 数
+_SUMMARY_LINE_TOKENS = 120
+# 超出上限时一次性压缩到上限的该比例，避免每一轮都改写历史前缀 (保持服务商前缀缓存命中)
+_COMPACT_RATIO = 0.75
+
+
+def _message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return json.dumps(message.content, ensure_ascii=False)
+
+
+class BoundedChatHistory(BaseChatMessageHistory):
+    """
+    有 token 上限的短期对话历史。
+    最近的若干轮原样保留；超出上限时，最早的整轮对话 (研究员输入 + Agent 回复) 被折叠进滚动摘要，
+    摘要本身也有上限，超出时丢弃最早的条目。摘要为抽取式 (每条消息的开头部分)，不额外调用 LLM。
+    摘要以一问一答的形式放在历史开头：部分 OpenAI 兼容服务商拒绝或忽略不在开头的 system 消息，
+    System Prompt 保持唯一且不随摘要变化 (前缀缓存仍然命中)。
+    """
+
+    def __init__(self, max_tokens: int, summary_tokens: int = HISTORY_SUMMARY_TOKENS):
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self._lock = threading.Lock()
+        self._window: List[BaseMessage] = []
+        self._window_counts: List[int] = []
+        self._summary_lines: List[str] = []
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        with self._lock:
+            if not self._summary_lines:
+                return list(self._window)
+            summary = "\n".join(self._summary_lines)
+            header = [
+                HumanMessage(content=f"[Earlier conversation summary: 较早的对话已压缩为以下摘要]\n{summary}"),
+                AIMessage(content="好的，我会结合以上摘要继续当前的讨论。"),
+            ]
+            return header + self._window
+
+    def recent_messages(self) -> List[BaseMessage]:
+        """原样保留的最近消息 (不含摘要)，GUI 恢复对话记录时使用"""
+        with self._lock:
+            return list(self._window)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        with self._lock:
+            self._window.extend(messages)
+            self._window_counts.extend(count_tokens(_message_text(m)) for m in messages)
+            if self._window_tokens() > self.max_tokens:
+                self._compact_locked()
+
+    def set_budget(self, max_tokens: int):
+        """切换阶段时调整上限 (各阶段上限不同)"""
+        with self._lock:
+            self.max_tokens = max_tokens
+            if self._window_tokens() > self.max_tokens:
+                self._compact_locked()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._window = []
+            self._window_counts = []
+            self._summary_lines = []
+
+    def dump(self) -> dict:
+        """可 JSON 序列化的完整状态 (会话检查点使用)，各条消息的 token 数一并保存，恢复时无需重新分词"""
+        with self._lock:
+            return {
+                "window": messages_to_dict(self._window),
+                "window_counts": list(self._window_counts),
+                "summary_lines": list(self._summary_lines),
+            }
+
+    def load(self, state: dict):
+        """从 dump() 的结果恢复 (上限沿用当前阶段的设置)"""
+        window = messages_from_dict(state["window"])
+        with self._lock:
+            self._window = window
+            self._window_counts = list(state["window_counts"])
+            self._summary_lines = list(state["summary_lines"])
+            if self._window_tokens() > self.max_tokens:
+                self._compact_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "messages": len(self._window),
+                "window_tokens": self._window_tokens(),
+                "summary_tokens": count_tokens("\n".join(self._summary_lines)),
+            }
+
+    def _window_tokens(self) -> int:
+        return sum(self._window_counts)
+
+    def _compact_locked(self):
+        target = int(self.max_tokens * _COMPACT_RATIO)
+        evicted = []
+        # 按整轮淘汰：始终从一条研究员消息开始，直到下一条研究员消息之前；至少保留最后一轮
+        while self._window_tokens() > target:
+            end = next((i for i in range(1, len(self._window)) if isinstance(self._window[i], HumanMessage)), None)
+            if end is None:
+                break
+            evicted.extend(self._window[:end])
+            self._window = self._window[end:]
+            self._window_counts = self._window_counts[end:]
+
+        if not evicted:
+            return
+        for message in evicted:
+            role = "研究员" if isinstance(message, HumanMessage) else "Agent"
+            text = " ".join(_message_text(message).split())
+            snippet = truncate_tokens(text, _SUMMARY_LINE_TOKENS)
+            self._summary_lines.append(f"- {role}: {snippet}{' ...' if snippet != text else ''}")
+        while len(self._summary_lines) > 1 and count_tokens("\n".join(self._summary_lines)) > self.summary_tokens:
+            self._summary_lines.pop(0)
+        print(f"[System] Chat history compacted: folded {len(evicted)} messages into summary "
+              f"(window={self._window_tokens()} tokens, cap={self.max_tokens}).")
+
+
+def _round_key(action: AgentAction):
+    """同一次 LLM 调用产生的多个工具调用共享同一条 AI 消息"""
+    message_log = getattr(action, "message_log", None)
+    return id(message_log[0]) if message_log else id(action)
+
+
+def make_tool_output_trimmer(
+    max_tokens: int = TOOL_OUTPUT_REF_TOKENS,
+    keep_rounds: int = TOOL_OUTPUT_KEEP_ROUNDS,
+) -> Callable[[List[Tuple[AgentAction, str]]], List[Tuple[AgentAction, str]]]:
+    """
+    生成 AgentExecutor.trim_intermediate_steps 使用的函数：
+    最近 keep_rounds 次 LLM 调用产生的工具结果原样保留 (最近一轮模型尚未看到)，
+    更早、且已被模型读过的大段工具输出替换为简短引用，需要时模型可以重新调用该工具。
+    """
+    def trim(steps: List[Tuple[AgentAction, str]]) -> List[Tuple[AgentAction, str]]:
+        rounds = []
+        for action, _ in steps:
+            key = _round_key(action)
+            if not rounds or rounds[-1] != key:
+                rounds.append(key)
+        recent = set(rounds[-keep_rounds:]) if keep_rounds > 0 else set()
+
+        trimmed = []
+        for action, observation in steps:
+            text = str(observation)
+            # 先按字符数粗筛 (1 token 至少 1 个字符)，避免每一步都对所有工具输出重新分词
+            if _round_key(action) not in recent and len(text) > max_tokens and count_tokens(text) > max_tokens:
+                tool_input = json.dumps(action.tool_input, ensure_ascii=False) \
+                    if isinstance(action.tool_input, dict) else str(action.tool_input)
+                observation = (
+                    f"[Consumed tool output omitted: {action.tool}({truncate_tokens(tool_input, 40)}) "
+                    f"returned ~{count_tokens(text)} tokens, already read in an earlier step. "
+                    f"Call the tool again if the original text is needed.]"
+                )
+            trimmed.append((action, observation))
+        return trimmed
+
+    return trim
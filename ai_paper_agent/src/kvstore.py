@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class DiskKVStore:
+    """
+    基于 SQLite 的磁盘 KV 存储 (进程内线程安全)。
+    - TTL：超过 ttl 秒的条目在读取时视为过期并删除；
+    - LRU：每次命中刷新 last_access，超出 max_entries / max_bytes 时优先淘汰最久未访问的条目。
+    供搜索缓存、LLM 补全缓存等共用。
+    """
+
+    def __init__(self, path: Path,
+                 ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_last_access ON kv(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE kv SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict_locked(self):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM kv WHERE created < ?", (time.time() - self.ttl,))
+
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM kv").fetchone()
+        while ((self.max_entries is not None and count > self.max_entries)
+               or (self.max_bytes is not None and total > self.max_bytes)):
+            row = self._conn.execute("SELECT key, size FROM kv ORDER BY last_access ASC LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (row[0],))
+            count -= 1
+            total -= row[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM kv").fetchone()
+        return {"entries": count, "bytes": total}
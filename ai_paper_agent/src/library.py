@@ -0,0 +1,405 @@
+import hashlib
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.config import DOCS_DIR, CACHE_DIR
+from src.fsutil import match_mode
+
+if TYPE_CHECKING:
+    import fitz
+
+# 上传的 PDF 按内容哈希存放，显示名 -> 哈希的映射记录在 index 文件中 (隐藏文件，不出现在论文列表里)
+BLOB_DIR = DOCS_DIR / ".blobs"
+INDEX_FILE = DOCS_DIR / ".library.json"
+# 解析结果 (逐页文本 + 图片清单) 按内容哈希缓存，所有研究员共享；格式变化时提升版本号
+PARSED_DIR = CACHE_DIR / "papers"
+PARSED_FILE = "pages.jsonl"
+PARSE_VERSION = 3
+# 冷启动时解析线程与读取方之间最多缓冲的页数
+PAGE_QUEUE_SIZE = 8
+# 预览缩略图的最长边 (像素)
+THUMBNAIL_MAX_PX = 256
+# PDF 图片流的压缩格式 -> 原样提取时的扩展名 (其余格式由 PyMuPDF 转为 png)
+_FILTER_EXT = {"DCTDecode": "jpeg", "JPXDecode": "jpx"}
+# 解析结束标记
+_DONE = object()
+
+
+def _sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _page_images(page: "fitz.Page", page_number: int) -> List[dict]:
+    """
+    只记录图片清单 (xref、页码、位置、尺寸)，不解码图片数据。
+    编号沿用 get_images 的顺序，与之前逐张提取时的文件名保持一致。
+    位置来自一次 get_image_info() 并按像素尺寸对应到 xref (xrefs=True / get_image_rects 需要解码图片计算摘要，慢一个数量级)；
+    同一页有多张相同尺寸的图片时位置无法区分，记为 None，等该图片被提取时再精确计算 (见 image_bbox)。
+    """
+    image_list = page.get_images(full=True)
+    if not image_list:
+        return []
+    placements: Dict[Tuple[int, int], List[tuple]] = {}
+    for info in page.get_image_info():
+        placements.setdefault((info["width"], info["height"]), []).append(info["bbox"])
+
+    images = []
+    for img_index, (xref, _, width, height, _, _, _, _, image_filter, *_) in enumerate(image_list):
+        candidates = placements.get((width, height), [])
+        bbox = candidates[0] if len(candidates) == 1 else None
+        images.append({
+            "name": f"p{page_number}_img{img_index + 1}.{_FILTER_EXT.get(image_filter, 'png')}",
+            "xref": xref,
+            "page": page_number,
+            "bbox": [round(v, 1) for v in bbox] if bbox else None,
+            "width": width,
+            "height": height,
+        })
+    return images
+
+
+def iter_pdf_pages(pdf_path: Path) -> Iterator[dict]:
+    """
+    逐页解析 PDF，每次产出一页 {"number", "text", "images": [清单条目, ...]}，内存中只保留当前页。
+    图片本身在被引用时才提取 (见 extract_image)。
+    """
+    import fitz  # PyMuPDF (只在解析 / 取图时加载，GUI 渲染论文列表不需要)
+    with fitz.open(pdf_path) as doc:
+        for page_index, page in enumerate(doc):
+            try:
+                images = _page_images(page, page_index + 1)
+            except Exception:
+                images = []
+            yield {"number": page_index + 1, "text": page.get_text("text").strip(), "images": images}
+
+
+def _extract_image(pdf_path: Path, xref: int, ext: str) -> bytes:
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        base_image = doc.extract_image(xref)
+        if base_image and base_image["ext"] == ext:
+            return base_image["image"]
+        # 清单中记录的扩展名与实际格式不一致时统一转为 png
+        pix = fitz.Pixmap(doc, xref)
+        if pix.colorspace and pix.colorspace.n not in (1, 3):
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        return pix.tobytes("png")
+
+
+def _image_bbox(pdf_path: Path, page_number: int, xref: int) -> Optional[List[float]]:
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        rects = doc[page_number - 1].get_image_rects(xref)
+        return [round(v, 1) for v in rects[0]] if rects else None
+
+
+def _render_thumbnail(pdf_path: Path, xref: int, max_px: int) -> bytes:
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        pix = fitz.Pixmap(doc, xref)
+        if pix.colorspace and pix.colorspace.n not in (1, 3):
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        # shrink(n) 每次把宽高缩小为 1/2^n，解码后的像素数据随之释放
+        steps = 0
+        while max(pix.width, pix.height) >> steps > max_px:
+            steps += 1
+        if steps:
+            pix.shrink(steps)
+        return pix.tobytes("png")
+
+
+class PaperLibrary:
+    """
+    共享论文库 (进程级单例)。
+    - 上传去重：PDF 按 sha256 只存一份 (docs/.blobs/{sha}.pdf)，显示名映射到哈希；
+      直接放进 docs/ 的 PDF 仍然可用，以文件名作为显示名。
+    - 论文列表按 docs/ 目录的 mtime 缓存，GUI 每次 rerun 不再 glob。
+    - 解析预热：上传 (或在侧边栏选中) 后立即在后台解析，结果按内容哈希缓存在 .cache/papers/{sha}.v{N}/，
+      read_paper_tool 直接读取缓存；解析尚未完成时加入同一个任务等待，不会重复解析。
+    - 图片只记录清单，原图与缩略图在被引用 / 预览时才提取。
+    PyMuPDF 不保证多线程安全，所有解析与图片提取都在同一个后台线程中串行执行。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="paper-parse")
+        # 进行中的解析任务：sha -> (任务, 是否需要完整解析)
+        self._in_flight: Dict[str, Tuple[Future, threading.Event]] = {}
+        self._index: Dict[str, str] = {}
+        self._index_mtime: Optional[float] = None
+        self._listing: List[str] = []
+        self._listing_key: Optional[Tuple[float, float]] = None
+        # 直接放在 docs/ 下的文件：(路径, 大小, mtime) -> sha256
+        self._file_hashes: Dict[Tuple[str, int, float], str] = {}
+
+    # -------------------------------------------------------------------------
+    # 显示名 -> 内容哈希
+    # -------------------------------------------------------------------------
+    def _load_index_locked(self):
+        mtime = INDEX_FILE.stat().st_mtime if INDEX_FILE.exists() else None
+        if mtime != self._index_mtime:
+            self._index = {}
+            if mtime is not None:
+                with open(INDEX_FILE, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            self._index_mtime = mtime
+
+    def _save_index_locked(self):
+        fd, tmp_path = tempfile.mkstemp(dir=DOCS_DIR, prefix=".library.", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        match_mode(tmp_path, INDEX_FILE)
+        os.replace(tmp_path, INDEX_FILE)
+        self._index_mtime = INDEX_FILE.stat().st_mtime
+
+    def add(self, name: str, data: bytes) -> Tuple[str, bool]:
+        """保存一次上传，返回 (sha256, 是否为新内容)；相同内容只写一次，同名新内容覆盖映射"""
+        name = Path(name).name
+        sha = _sha256_bytes(data)
+        blob_path = BLOB_DIR / f"{sha}.pdf"
+        is_new = not blob_path.exists()
+        if is_new:
+            BLOB_DIR.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=BLOB_DIR, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            match_mode(tmp_path, blob_path)
+            os.replace(tmp_path, blob_path)
+        with self._lock:
+            self._load_index_locked()
+            if self._index.get(name) != sha:
+                self._index[name] = sha
+                self._save_index_locked()
+        return sha, is_new
+
+    def resolve(self, name: str) -> Optional[Path]:
+        """显示名 -> PDF 实际路径；不存在时返回 None"""
+        with self._lock:
+            self._load_index_locked()
+            sha = self._index.get(name)
+        if sha and (BLOB_DIR / f"{sha}.pdf").exists():
+            return BLOB_DIR / f"{sha}.pdf"
+        path = DOCS_DIR / name
+        return path if path.is_file() else None
+
+    def content_hash(self, name: str) -> Optional[str]:
+        with self._lock:
+            self._load_index_locked()
+            sha = self._index.get(name)
+        if sha:
+            return sha
+        path = self.resolve(name)
+        if path is None:
+            return None
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime)
+        with self._lock:
+            sha = self._file_hashes.get(key)
+        if sha is None:
+            sha = _sha256_file(path)
+            with self._lock:
+                self._file_hashes[key] = sha
+        return sha
+
+    def listing_key(self) -> Tuple[float, Optional[float]]:
+        """论文列表的变化标记 (docs/ 目录与 index 的 mtime)：上传、删除或直接放入 PDF 后改变，只需两次 stat"""
+        index_mtime = INDEX_FILE.stat().st_mtime if INDEX_FILE.exists() else None
+        return DOCS_DIR.stat().st_mtime, index_mtime
+
+    def list_names(self) -> List[str]:
+        """论文显示名列表 (上传的 + 直接放在 docs/ 下的)，目录与 index 都未变化时直接返回缓存"""
+        docs_mtime = DOCS_DIR.stat().st_mtime
+        with self._lock:
+            self._load_index_locked()
+            key = (docs_mtime, self._index_mtime)
+            if key != self._listing_key:
+                names = {p.name for p in DOCS_DIR.glob("*.pdf")} | set(self._index)
+                self._listing = sorted(names)
+                self._listing_key = key
+            return list(self._listing)
+
+    # -------------------------------------------------------------------------
+    # 解析缓存与后台预热
+    # -------------------------------------------------------------------------
+    def parsed_dir(self, sha: str) -> Path:
+        return PARSED_DIR / f"{sha}.v{PARSE_VERSION}"
+
+    def path_for_hash(self, sha: str, name_hint: Optional[str] = None) -> Optional[Path]:
+        """内容哈希 -> PDF 路径 (优先使用去重存储，其次按显示名查找内容相同的文件)"""
+        if (BLOB_DIR / f"{sha}.pdf").exists():
+            return BLOB_DIR / f"{sha}.pdf"
+        names = ([name_hint] if name_hint else []) + self.list_names()
+        return next((self.resolve(name) for name in names if self.content_hash(name) == sha), None)
+
+    def _is_cached(self, sha: str) -> bool:
+        return (self.parsed_dir(sha) / PARSED_FILE).exists()
+
+    def _iter_cached(self, sha: str) -> Iterator[dict]:
+        """按行读取缓存 (每行一页)，不把整篇论文载入内存"""
+        with open(self.parsed_dir(sha) / PARSED_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _parse_to_cache(self, sha: str, pdf_path: Path, on_page: Optional[Callable[[dict], bool]] = None,
+                        full: Optional[threading.Event] = None) -> bool:
+        """
+        解析并逐页写入缓存，返回缓存是否已就绪。on_page 不为空时每解析完一页就推送给读取方。
+        读取方提前停止 (on_page 返回 False) 时，若没有其他调用方需要完整结果 (full 未设置) 就立即停止解析、
+        丢弃已解析的部分，不占用解析线程；否则继续解析完剩余页面。
+        """
+        if self._is_cached(sha):
+            return True
+        PARSED_DIR.mkdir(parents=True, exist_ok=True)
+        # 先解析到临时目录再整体改名，读取方不会看到解析了一半的结果
+        tmp_dir = Path(tempfile.mkdtemp(dir=PARSED_DIR, prefix=f".{sha[:12]}."))
+        try:
+            with open(tmp_dir / PARSED_FILE, "w", encoding="utf-8") as f:
+                for page in iter_pdf_pages(pdf_path):
+                    f.write(json.dumps(page, ensure_ascii=False) + "\n")
+                    if on_page is not None and not on_page(page):
+                        on_page = None
+                        if full is None or not full.is_set():
+                            return False
+            match_mode(tmp_dir, self.parsed_dir(sha), directory=True)
+            try:
+                os.replace(tmp_dir, self.parsed_dir(sha))
+            except OSError:
+                # 另一个进程 (如批处理) 已写入同一份结果
+                if not (self.parsed_dir(sha) / PARSED_FILE).exists():
+                    raise
+            return True
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _submit(self, sha: str, pdf_path: Path, on_page=None) -> Tuple[Future, bool]:
+        """
+        提交解析任务；已有进行中的任务时直接返回它。第二个返回值表示 on_page 是否被挂到了新任务上。
+        只有挂上 on_page 的读取方可以提前停止解析；预热或加入已有任务的调用方都需要完整的缓存。
+        """
+        with self._lock:
+            entry = self._in_flight.get(sha)
+            if entry is not None and not entry[0].done():
+                future, full = entry
+                full.set()
+                return future, False
+            full = threading.Event()
+            if on_page is None:
+                full.set()
+            future = self._executor.submit(self._parse_to_cache, sha, pdf_path, on_page, full)
+            self._in_flight[sha] = (future, full)
+            future.add_done_callback(lambda done: self._forget(sha, done))
+            return future, True
+
+    def _forget(self, sha: str, future: Future):
+        with self._lock:
+            if self._in_flight.get(sha, (None,))[0] is future:
+                del self._in_flight[sha]
+
+    def prewarm(self, name: str) -> bool:
+        """在后台解析该论文 (已缓存或正在解析时什么也不做)；返回是否已经就绪"""
+        sha = self.content_hash(name)
+        if sha is None or self._is_cached(sha):
+            return sha is not None
+        self._submit(sha, self.resolve(name))
+        return False
+
+    def iter_pages(self, name: str, max_pages: Optional[int] = None) -> Iterator[dict]:
+        """
+        逐页产出论文内容 {"number", "text", "images"}，调用方可以边读边处理、随时停止 (break / max_pages)。
+        - 已缓存：逐行读取缓存文件；
+        - 正在预热：等待该任务完成后读取缓存；
+        - 未缓存：提交解析任务，每解析完一页立即产出 (有界队列，解析线程最多领先 PAGE_QUEUE_SIZE 页)。
+        """
+        sha = self.content_hash(name)
+        if sha is None:
+            raise FileNotFoundError(name)
+        pages = self._iter_cached(sha) if self._is_cached(sha) else self._iter_parsing(sha, self.resolve(name))
+        for count, page in enumerate(pages, 1):
+            yield page
+            if max_pages is not None and count >= max_pages:
+                break
+
+    def _iter_parsing(self, sha: str, pdf_path: Path) -> Iterator[dict]:
+        pages: queue.Queue = queue.Queue(maxsize=PAGE_QUEUE_SIZE)
+        stopped = threading.Event()
+
+        def on_page(item) -> bool:
+            # 读取方停止后不再推送，解析线程不会阻塞在已满的队列上
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        future, attached = self._submit(sha, pdf_path, on_page)
+        if not attached:
+            # 加入的任务在本调用方加入前已经被其读取方提前停止时没有缓存，重新提交
+            if future.result():
+                yield from self._iter_cached(sha)
+            else:
+                yield from self._iter_parsing(sha, pdf_path)
+            return
+
+        future.add_done_callback(lambda _: on_page(_DONE))
+        try:
+            while True:
+                page = pages.get()
+                if page is _DONE:
+                    break
+                yield page
+            # 解析失败时抛出原始异常
+            future.result()
+        finally:
+            stopped.set()
+
+    def extract_image(self, sha: str, image: dict, name_hint: Optional[str] = None) -> bytes:
+        """按清单条目提取原始图片 (在解析线程中执行)"""
+        pdf_path = self.path_for_hash(sha, name_hint)
+        if pdf_path is None:
+            raise FileNotFoundError(f"paper {sha[:12]} is no longer in the library")
+        ext = image["name"].rsplit(".", 1)[-1]
+        return self._executor.submit(_extract_image, pdf_path, image["xref"], ext).result()
+
+    def image_bbox(self, sha: str, image: dict, name_hint: Optional[str] = None) -> Optional[List[float]]:
+        """精确计算图片在页面上的位置 (解析时无法区分的同尺寸图片)"""
+        pdf_path = self.path_for_hash(sha, name_hint)
+        if pdf_path is None:
+            raise FileNotFoundError(f"paper {sha[:12]} is no longer in the library")
+        return self._executor.submit(_image_bbox, pdf_path, image["page"], image["xref"]).result()
+
+    def thumbnail(self, sha: str, image: dict, name_hint: Optional[str] = None) -> Path:
+        """返回缩略图路径，首次请求时生成并按内容哈希缓存 (所有研究员共享)"""
+        thumb_path = self.parsed_dir(sha) / "thumbs" / f"{image['name'].rsplit('.', 1)[0]}.png"
+        if thumb_path.exists():
+            return thumb_path
+        pdf_path = self.path_for_hash(sha, name_hint)
+        if pdf_path is None:
+            raise FileNotFoundError(f"paper {sha[:12]} is no longer in the library")
+        data = self._executor.submit(_render_thumbnail, pdf_path, image["xref"], THUMBNAIL_MAX_PX).result()
+        thumb_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=thumb_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        match_mode(tmp_path, thumb_path)
+        os.replace(tmp_path, thumb_path)
+        return thumb_path
+
+
+paper_library = PaperLibrary()
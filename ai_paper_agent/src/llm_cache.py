@@ -0,0 +1,141 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import threading
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.outputs.chat_generation import merge_chat_generation_chunks
+from langchain_openai import ChatOpenAI
+
+from src.config import CACHE_DIR, LLM_CACHE_MAX_MB
+from src.kvstore import DiskKVStore
+
+# 写入 generation_info 的标记，UsageTracker 据此按阶段统计命中 / 未命中
+CACHE_MARKER = "completion_cache"
+
+# 为 True 时当前上下文中的 LLM 调用既不读也不写缓存 (交互式对话)
+_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("completion_cache_bypass", default=False)
+
+
+@contextlib.contextmanager
+def completion_cache_bypass(enabled: bool = True):
+    """在 with 块内跳过补全缓存，例如研究员手动输入的对话轮次"""
+    token = _bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+class CachedChatOpenAI(ChatOpenAI):
+    """
+    带磁盘补全缓存的 ChatOpenAI。
+    缓存键为 (base_url, 完整请求体)：模型名、全部消息 (含工具调用与工具结果)、工具 schema 以及采样参数，
+    只有 temperature=0 的请求才会被缓存。
+    LangChain 自带的 cache 参数在 stream() 路径上不生效，而 AgentExecutor 始终走 stream，
+    因此在 _stream / _astream 层实现：命中时回放一次完整的 chunk，未命中时透传并在流结束后写入。
+    """
+
+    completion_store: Optional[DiskKVStore] = None
+
+    def _cache_key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: dict) -> Optional[str]:
+        if self.completion_store is None or _bypass.get():
+            return None
+        params = {k: v for k, v in kwargs.items() if k not in ("stream", "stream_usage", "stream_options")}
+        payload = self._get_request_payload(messages, stop=stop, **params)
+        payload.pop("stream", None)
+        payload.pop("stream_options", None)
+        if payload.get("temperature") != 0:
+            return None
+        raw = json.dumps({"base_url": self.openai_api_base, "payload": payload},
+                         sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[ChatGenerationChunk]:
+        raw = self.completion_store.get(key)
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        message = messages_from_dict([record["message"]])[0]
+        # 回放的结果不消耗 token，也不沿用原始请求的消息 id
+        message.usage_metadata = None
+        message.id = None
+        return ChatGenerationChunk(
+            message=message,
+            generation_info={**(record.get("generation_info") or {}), CACHE_MARKER: "hit"}
+        )
+
+    def _store(self, key: str, chunks: List[ChatGenerationChunk]):
+        generation = merge_chat_generation_chunks(chunks)
+        if generation is None:
+            return
+        generation_info = {k: v for k, v in (generation.generation_info or {}).items() if k != CACHE_MARKER}
+        self.completion_store.set(key, json.dumps({
+            "message": message_to_dict(generation.message),
+            "generation_info": generation_info,
+        }, ensure_ascii=False, default=str))
+
+    @staticmethod
+    def _mark_miss(chunk: ChatGenerationChunk):
+        chunk.generation_info = {**(chunk.generation_info or {}), CACHE_MARKER: "miss"}
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        key = self._cache_key(messages, stop, kwargs)
+        if key is None:
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+
+        cached = self._lookup(key)
+        if cached is not None:
+            if run_manager:
+                run_manager.on_llm_new_token(cached.text, chunk=cached)
+            yield cached
+            return
+
+        chunks = []
+        for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            if not chunks:
+                self._mark_miss(chunk)
+            chunks.append(chunk)
+            yield chunk
+        # 只缓存完整结束的流；调用方中途停止消费时不会走到这里
+        self._store(key, chunks)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._cache_key(messages, stop, kwargs)
+        if key is None:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+
+        cached = self._lookup(key)
+        if cached is not None:
+            if run_manager:
+                await run_manager.on_llm_new_token(cached.text, chunk=cached)
+            yield cached
+            return
+
+        chunks = []
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            if not chunks:
+                self._mark_miss(chunk)
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, chunks)
+
+
+_store: Optional[DiskKVStore] = None
+_store_lock = threading.Lock()
+
+
+def get_completion_store() -> DiskKVStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DiskKVStore(CACHE_DIR / "llm_cache.sqlite", max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024)
+        return _store
@@ -1,171 +1,352 @@
+"""
+无人值守的批处理入口 (Headless batch runner)。
+
+按清单批量运行 (研究员, 论文 PDF, 模型) 任务：每个任务在 res/{session}/ 下执行阅读阶段以及可选的后续阶段，
+多个任务在有界的并发池中同时运行 (基于 ResearchAgent 的异步接口)。
+每个阶段的里程碑文件 (base.md / innov{n}.md / final_innov.md) 写入后立即记录检查点，
+中断后重新运行同一份清单会跳过已完成的阶段，从断点继续。
+
+用法:
+    python -m src.main jobs.json [--workers 4] [--retries 1]
+
+清单格式 (JSON 列表，或 {"defaults": {...}, "jobs": [...]}，或每行一个任务的 .jsonl)：
+    {
+        "user": "alice",                      # 必填，默认作为会话目录 res/alice
+        "pdf": "paper.pdf",                   # 必填，docs/ 下的文件名 (基准论文)
+        "related": ["other.pdf"],             # 可选：相关论文，与基准论文并发提取后合并进 base.md
+        "model": "deepseek-chat",             # 缺省时读取环境变量 MODEL_NAME
+        "phases": ["read", "innov1"],         # 缺省只跑 read；可选 innov1 / innov2 / innov3 / final
+        "ideas": {"innov1": "..."},           # 可选：创新点阶段的初始思路，缺省时由 Agent 自主提出
+        "base_url": "https://...",            # 缺省时读取环境变量 OPENAI_API_BASE
+        "api_key_env": "OPENAI_API_KEY",      # 存放 API Key 的环境变量名
+        "session": "alice-paper2"             # 可选：同一研究员有多个任务时需指定不同的会话目录
+    }
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import statistics
 import sys
 import time
-import os
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Dict, List, Optional
 
-# 引入我们的模块
 from src.agent import ResearchAgent
-from src.config import DOCS_DIR, RES_DIR, FILE_BASE_INFO, FILE_MEMORY, FILE_FINAL
+from src.config import (
+    DOCS_DIR, RES_DIR, ensure_dirs, FILE_BASE_INFO, FILE_MEMORY, FILE_FINAL,
+    FILE_INNOV_1, FILE_INNOV_2, FILE_INNOV_3, READ_MAX_PAPERS
+)
+from src.library import paper_library
+from src.prompts import PromptManager
+from src.reading import run_multi_read
+from src.scheduler import request_context, Priority
 
-# 定义颜色代码，让终端交互更清晰
+# 定义颜色代码，让终端输出更清晰
 GREEN = "\033[92m"
 YELLOW = "\033[93m"
 CYAN = "\033[96m"
 RED = "\033[91m"
 RESET = "\033[0m"
 
+PHASES = ["read", "innov1", "innov2", "innov3", "final"]
+MILESTONES = {
+    "read": FILE_BASE_INFO,
+    "innov1": FILE_INNOV_1,
+    "innov2": FILE_INNOV_2,
+    "innov3": FILE_INNOV_3,
+    "final": FILE_FINAL,
+}
+# 检查点文件 (隐藏文件，不会被知识库同步)
+CHECKPOINT_FILE = ".batch_state.json"
+
+
 def print_system(msg):
     print(f"{GREEN}[System]{RESET} {msg}")
 
-def read_local_file(filename):
-    """辅助函数：读取本地生成的文件内容，用于构建下一阶段的 Context"""
-    path = RES_DIR / filename
-    if path.exists():
-        with open(path, 'r', encoding='utf-8') as f:
-            return f.read()
-    return ""
 
-def check_milestone_completed(filename):
-    """检查是否已经生成了目标文件（标志着当前阶段结束）"""
-    return (RES_DIR / filename).exists()
+# =============================================================================
+# 1. 任务清单
+# =============================================================================
+@dataclass
+class Job:
+    user: str
+    pdf: str
+    model: str
+    phases: List[str] = field(default_factory=lambda: ["read"])
+    related: List[str] = field(default_factory=list)
+    ideas: Dict[str, str] = field(default_factory=dict)
+    base_url: Optional[str] = None
+    api_key_env: str = "OPENAI_API_KEY"
+    session: Optional[str] = None
 
-def main():
-    # 0. 初始化
-    print(f"{CYAN}=========================================================={RESET}")
-    print(f"{CYAN}   AI Research Agent: Top-Tier Paper Innovation Assistant   {RESET}")
-    print(f"{CYAN}=========================================================={RESET}")
-    
-    # 检查 docs 目录下是否有文件
-    pdf_files = list(DOCS_DIR.glob("*.pdf"))
-    if not pdf_files:
-        print(f"{RED}Error: docs/ 目录下没有找到 PDF 文件。请放入论文后重试。{RESET}")
-        return
-
-    # 让用户选择文件（如果有多个）
-    target_pdf = pdf_files[0].name
-    if len(pdf_files) > 1:
-        print(f"发现多个PDF文件:")
-        for idx, f in enumerate(pdf_files):
-            print(f"{idx + 1}. {f.name}")
-        choice = input("请输入序号选择: ")
-        try:
-            target_pdf = pdf_files[int(choice)-1].name
-        except:
-            print("输入无效，默认选择第一个。")
-
-    print_system(f"目标论文: {target_pdf}")
-    print_system("初始化 Agent...")
-    
-    # 初始化记忆文件
-    if not (RES_DIR / FILE_MEMORY).exists():
-        from src.prompts import PromptManager
-        with open(RES_DIR / FILE_MEMORY, 'w', encoding='utf-8') as f:
-            f.write(PromptManager.get_memory_init_content())
-
-    agent = ResearchAgent()
-
-    # =========================================================================
-    # Phase 1: Reading & Base Establishment
-    # =========================================================================
-    if not check_milestone_completed(FILE_BASE_INFO):
-        print_system("进入阶段 1: 论文全量阅读与基准建立 (Base Extraction)")
-        agent.update_phase("read")
-        
-        # 发送指令给 Agent
-        trigger_msg = f"请读取文件 '{target_pdf}'，分析其核心方法和理论，并建立 '{FILE_BASE_INFO}'。"
-        print(f"\n{YELLOW}>> {trigger_msg}{RESET}")
-        
-        response = agent.chat(trigger_msg)
-        print(f"\n{CYAN}[Agent]:{RESET} {response}")
-        
-        # 强制检查：必须生成了 base.md 才能继续
-        if not check_milestone_completed(FILE_BASE_INFO):
-            print_system("警告：Agent 似乎没有成功创建 base.md。请手动检查或重试。")
-            return
-    else:
-        print_system(f"检测到 {FILE_BASE_INFO} 已存在，跳过阅读阶段。")
-
-    # =========================================================================
-    # Phase 2: Innovation Loop (1 -> 2 -> 3)
-    # =========================================================================
-    # 定义三个创新点的文件名
-    innov_files = ["innov1.md", "innov2.md", "innov3.md"]
-    
-    for i, innov_file in enumerate(innov_files):
-        stage_num = i + 1
-        
-        # 如果这个创新点文件已经存在，就跳过（支持断点续传）
-        if check_milestone_completed(innov_file):
-            print_system(f"检测到 {innov_file} 已存在，跳过创新点 {stage_num}。")
-            continue
-            
-        print_system(f"进入阶段 2-{stage_num}: 挖掘第 {stage_num} 个创新点")
-        
-        # 1. 准备上下文：读取 Base 和 之前的创新点
-        context_data = {
-            "base_summary": read_local_file(FILE_BASE_INFO),
-            "memory_log": read_local_file(FILE_MEMORY),
-            # 这里可以扩展：把之前的创新点内容也读进来
-        }
-        
-        # 2. 切换大脑
-        agent.update_phase(f"innov{stage_num}", context_data)
-        agent.clear_short_term_memory() # 清空上一轮的对话缓存
-        
-        # 3. 交互循环
-        print(f"\n{CYAN}>>> 请提出你关于创新点 {stage_num} 的初步思路 (输入 'q' 退出):{RESET}")
-        
-        first_turn = True
-        while not check_milestone_completed(innov_file):
-            if first_turn:
-                user_input = input(f"{YELLOW}(Idea {stage_num}) You: {RESET}")
-                first_turn = False
+    @property
+    def session_id(self) -> str:
+        return self.session or self.user
+
+    @property
+    def label(self) -> str:
+        return f"{self.session_id}:{Path(self.pdf).stem}"
+
+
+def load_manifest(path: Path) -> List[Job]:
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix == ".jsonl":
+            raw, defaults = [json.loads(line) for line in f if line.strip()], {}
+        else:
+            data = json.load(f)
+            raw, defaults = (data, {}) if isinstance(data, list) else (data["jobs"], data.get("defaults", {}))
+
+    jobs, sessions = [], set()
+    for index, entry in enumerate(raw, 1):
+        spec = {**defaults, **entry}
+        spec.setdefault("model", os.getenv("MODEL_NAME"))
+        missing = [key for key in ("user", "pdf", "model") if not spec.get(key)]
+        if missing:
+            raise ValueError(f"Job #{index}: missing {', '.join(missing)}")
+
+        job = Job(**{key: spec[key] for key in Job.__dataclass_fields__ if key in spec})
+        unknown = [p for p in job.phases if p not in PHASES]
+        if unknown:
+            raise ValueError(f"Job #{index} ({job.label}): unknown phases {unknown}, expected a subset of {PHASES}")
+        # 按标准顺序执行，后续阶段依赖前序阶段的里程碑文件
+        job.phases = [p for p in PHASES if p in job.phases]
+        for pdf in [job.pdf] + job.related:
+            if paper_library.resolve(pdf) is None:
+                raise ValueError(f"Job #{index} ({job.label}): {pdf} not found in {DOCS_DIR}")
+        if len(job.related) > READ_MAX_PAPERS - 1:
+            raise ValueError(f"Job #{index} ({job.label}): at most {READ_MAX_PAPERS - 1} related papers (READ_MAX_PAPERS)")
+        # 同一会话目录下的里程碑文件名固定，两个任务共用会互相覆盖
+        if job.session_id in sessions:
+            raise ValueError(f"Job #{index}: session '{job.session_id}' is used by another job; set a distinct 'session'")
+        sessions.add(job.session_id)
+        jobs.append(job)
+    return jobs
+
+
+# =============================================================================
+# 2. 检查点
+# =============================================================================
+def _sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class Checkpoint:
+    """res/{session}/.batch_state.json：记录任务参数与每个阶段的完成情况，原子写入"""
+
+    def __init__(self, session_dir: Path):
+        self.path = session_dir / CHECKPOINT_FILE
+        self.state = {"job": None, "phases": {}}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def bind(self, job: Job):
+        """确认会话目录属于同一篇论文，避免把另一篇论文的 base.md 当作已完成"""
+        recorded = self.state.get("job")
+        if recorded and recorded.get("pdf") != job.pdf:
+            raise RuntimeError(
+                f"session '{job.session_id}' was checkpointed for {recorded.get('pdf')}, not {job.pdf}; "
+                f"use a different 'session' or delete {self.path}"
+            )
+        self.state["job"] = {"user": job.user, "pdf": job.pdf, "related": job.related, "model": job.model}
+        self.save()
+
+    def record(self, phase: str, info: dict):
+        self.state["phases"][phase] = info
+        self.save()
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# =============================================================================
+# 3. 执行
+# =============================================================================
+def _trigger_message(job: Job, phase: str) -> str:
+    if phase == "read":
+        return f"请读取文件 '{job.pdf}'，深入分析并建立 '{FILE_BASE_INFO}'。"
+    if phase == "final":
+        return "所有创新点已配齐。请设计最终实验方案并写入 final_innov.md。"
+    stage_num = int(phase[-1])
+    idea = job.ideas.get(phase) or f"请基于 [[base]] 自主提出第 {stage_num} 个创新点，并调用 web_search_tool 完成查新。"
+    # 无人值守：没有研究员参与讨论，视为方案已确认
+    return (f"{idea}\n\n[Batch Mode] 这是无人值守的批处理任务，没有研究员参与讨论。"
+            f"方案完善后视为研究员已确认，直接写入 {MILESTONES[phase]}，并在 {FILE_MEMORY} 末尾追加记录。")
+
+
+async def run_phase(agent: ResearchAgent, job: Job, phase: str, retries: int) -> dict:
+    milestone = agent.session_dir / MILESTONES[phase]
+
+    await agent.aupdate_phase(phase, agent.phase_context(phase))
+    agent.clear_short_term_memory()
+
+    message, turn_latencies, error = _trigger_message(job, phase), [], None
+    # 批处理的请求排在研究员的交互对话之后 (见 src.scheduler)
+    with request_context(job.session_id, Priority.BATCH):
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            if phase == "read" and job.related:
+                # 多篇论文：并发逐篇提取后合并 (见 src.reading)，不经过 Agent 对话；重试时已提取的笔记直接复用
+                events: "queue.Queue[dict]" = queue.Queue()
+                await asyncio.to_thread(run_multi_read, agent, [job.pdf] + job.related, events)
+                error = next((e["text"] for e in events.queue if e["type"] == "error"), None)
             else:
-                user_input = input(f"{YELLOW}(Discussing {stage_num}) You: {RESET}")
-            
-            if user_input.lower() in ['q', 'quit', 'exit']:
-                print_system("用户终止程序。")
-                sys.exit(0)
-            
-            # Agent 执行
-            response = agent.chat(user_input)
-            print(f"\n{CYAN}[Agent]:{RESET} {response}")
-            
-            # 检查是否完成了任务
-            if check_milestone_completed(innov_file):
-                print(f"\n{GREEN}🎉 恭喜！创新点 {stage_num} 已定稿并归档。{RESET}")
+                await agent.achat(message)
+            turn_latencies.append(time.perf_counter() - started)
+            if milestone.exists():
                 break
-            else:
-                print(f"\n{YELLOW}[提示] 创新点尚未归档。请继续与 Agent 讨论并确认方案，或输入 '确认该方案' 提示 Agent 写文件。{RESET}")
-
-    # =========================================================================
-    # Phase 3: Final Experiment Design
-    # =========================================================================
-    if not check_milestone_completed(FILE_FINAL):
-        print_system("进入阶段 3: 最终实验方案设计 (Final Design)")
-        
-        # 准备所有素材
-        context_data = {
-            "base_summary": read_local_file(FILE_BASE_INFO),
-            # 此时 innov1/2/3 肯定都存在了，agent tool 会自己去读，
-            # 但我们在 Prompt 里并没有强制把全文塞进去，而是让 Agent 自己调用 read_file_tool
-            # 这样可以节省 Context Token
-        }
-        
-        agent.update_phase("final")
-        agent.clear_short_term_memory()
-        
-        trigger_msg = "三个创新点已就绪。请读取所有 innov 文件，设计最终的对比实验和消融实验方案，并写入 final_innov.md。"
-        print(f"\n{YELLOW}>> {trigger_msg}{RESET}")
-        
-        response = agent.chat(trigger_msg)
-        print(f"\n{CYAN}[Agent]:{RESET} {response}")
+            message = f"你还没有写入 {MILESTONES[phase]}。请立即按 output schema 完成并调用工具写入该文件。"
+
+    info = {
+        "status": "done" if milestone.exists() else "failed",
+        "milestone": MILESTONES[phase],
+        "turns": len(turn_latencies),
+        "seconds": round(sum(turn_latencies), 2),
+        "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if milestone.exists():
+        info["sha256"] = _sha256(milestone)
     else:
-        print_system(f"检测到 {FILE_FINAL} 已存在。项目似乎已完成。")
+        info["error"] = error or f"{MILESTONES[phase]} not written after {len(turn_latencies)} turns"
+    return info
+
+
+async def run_job(job: Job, semaphore: asyncio.Semaphore, retries: int) -> dict:
+    result = {"job": job.label, "status": "done", "phases": {}, "usage": {}, "seconds": 0.0}
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            api_key = os.getenv(job.api_key_env)
+            base_url = job.base_url or os.getenv("OPENAI_API_BASE")
+            if not api_key or not base_url:
+                raise RuntimeError(f"missing API key (${job.api_key_env}) or base_url (OPENAI_API_BASE)")
+
+            agent = ResearchAgent(job.session_id, api_key, base_url, job.model)
+            checkpoint = Checkpoint(agent.session_dir)
+            checkpoint.bind(job)
+
+            # 初始化记忆文件
+            memory_path = agent.session_dir / FILE_MEMORY
+            if not memory_path.exists():
+                with open(memory_path, 'w', encoding='utf-8') as f:
+                    f.write(PromptManager.get_memory_init_content())
+
+            for phase in job.phases:
+                milestone = agent.session_dir / MILESTONES[phase]
+                if milestone.exists():
+                    # 断点续传：里程碑文件已存在 (本工具或 GUI 生成) 即视为完成
+                    previous = checkpoint.state["phases"].get(phase, {})
+                    result["phases"][phase] = {**previous, "status": "skipped"}
+                    print_system(f"[{job.label}] {MILESTONES[phase]} already exists, skipping {phase}.")
+                    continue
+
+                prerequisite = PHASES[PHASES.index(phase) - 1] if phase != "read" else None
+                if prerequisite and not (agent.session_dir / MILESTONES[prerequisite]).exists():
+                    info = {"status": "failed", "error": f"prerequisite {MILESTONES[prerequisite]} missing"}
+                else:
+                    print_system(f"[{job.label}] Running phase {phase} ...")
+                    info = await run_phase(agent, job, phase, retries)
+                checkpoint.record(phase, info)
+                result["phases"][phase] = info
+
+                color = GREEN if info["status"] == "done" else RED
+                print(f"{color}[{job.label}] {phase}: {info['status']}{RESET}")
+                if info["status"] != "done":
+                    result["status"] = "failed"
+                    break
+
+            result["usage"] = agent.usage_tracker.summary()
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+            print(f"{RED}[{job.label}] Job failed: {e}{RESET}")
+        result["seconds"] = time.perf_counter() - started
+    return result
+
+
+# =============================================================================
+# 4. 汇总
+# =============================================================================
+def _percentile(values: List[float], q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def print_summary(results: List[dict], wall_seconds: float):
+    done = [r for r in results if r["status"] == "done"]
+    ran = [(phase, info) for r in results for phase, info in r["phases"].items() if info["status"] != "skipped"]
+    skipped = sum(1 for r in results for info in r["phases"].values() if info["status"] == "skipped")
+
+    print(f"\n{CYAN}=========================================================={RESET}")
+    print(f"{CYAN}   Batch Summary{RESET}")
+    print(f"{CYAN}=========================================================={RESET}")
+    print(f"jobs        : {len(results)} total, {len(done)} done, {len(results) - len(done)} failed")
+    print(f"phases      : {len(ran)} run, {sum(1 for _, i in ran if i['status'] == 'done')} done, {skipped} resumed/skipped")
+    print(f"wall time   : {wall_seconds:.1f}s")
+    if wall_seconds > 0:
+        print(f"throughput  : {len(done) / wall_seconds * 3600:.1f} jobs/h, {len(ran) / wall_seconds * 60:.2f} phases/min")
+
+    for phase in PHASES:
+        latencies = [info["seconds"] for p, info in ran if p == phase and "seconds" in info]
+        if latencies:
+            print(f"  {phase:<7} n={len(latencies):<3} p50={_percentile(latencies, 50):7.1f}s "
+                  f"p95={_percentile(latencies, 95):7.1f}s max={max(latencies):7.1f}s")
+
+    totals = {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "completion_hits": 0}
+    for r in results:
+        for stats in r["usage"].values():
+            for key in totals:
+                totals[key] += stats.get(key, 0)
+    print(f"LLM usage   : {totals['calls']} calls, input={totals['input_tokens']} "
+          f"(prefix-cached {totals['cached_tokens']}), output={totals['output_tokens']}, "
+          f"completion cache hits={totals['completion_hits']}")
+
+    for r in results:
+        if r["status"] != "done":
+            reason = r.get("error") or next(
+                (f"{p}: {i.get('error', i['status'])}" for p, i in r["phases"].items() if i["status"] == "failed"), "")
+            print(f"{RED}  FAILED {r['job']}: {reason}{RESET}")
+
+
+async def run_batch(jobs: List[Job], workers: int, retries: int) -> List[dict]:
+    # 需要阅读的论文先全部提交后台解析，排队等待并发名额的任务开始时即可命中缓存
+    for job in jobs:
+        if "read" in job.phases:
+            for pdf in [job.pdf] + job.related:
+                paper_library.prewarm(pdf)
+    semaphore = asyncio.Semaphore(workers)
+    return await asyncio.gather(*[run_job(job, semaphore, retries) for job in jobs])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless, resumable batch runner for ResearchAgent.")
+    parser.add_argument("manifest", type=Path, help="JSON / JSONL job manifest")
+    parser.add_argument("--workers", type=int, default=4, help="max concurrent jobs (default: 4)")
+    parser.add_argument("--retries", type=int, default=1,
+                        help="extra turns per phase when the milestone file was not written (default: 1)")
+    args = parser.parse_args(argv)
+    ensure_dirs()
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"{RED}Error: invalid manifest {args.manifest}: {e}{RESET}")
+        return 2
+
+    print_system(f"{len(jobs)} jobs, {args.workers} workers, results under {RES_DIR}/<session>/")
+    started = time.perf_counter()
+    results = asyncio.run(run_batch(jobs, max(args.workers, 1), max(args.retries, 0)))
+    print_summary(results, time.perf_counter() - started)
+    return 0 if all(r["status"] == "done" for r in results) else 1
 
-    print(f"\n{GREEN}=========================================================={RESET}")
-    print(f"{GREEN}   Mission Complete! 所有文件已保存在 res/ 目录下。        {RESET}")
-    print(f"{GREEN}=========================================================={RESET}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
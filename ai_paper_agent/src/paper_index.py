@@ -0,0 +1,203 @@
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.config import CACHE_DIR, PAPER_INDEX_SEARCH_WAIT
+from src.library import paper_library
+
+# FTS5 匹配前先把查询拆成词，避免 AND / NEAR / 引号等被当作查询语法
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# 中日韩文字：unicode61 分词器会把连续的汉字当成一个词，索引与查询两侧都改写为重叠的二元组
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+# 摘要片段在命中位置前后各保留的字符数
+_SNIPPET_CHARS = 60
+# 索引表结构版本 (存放在 PRAGMA user_version)，不一致时清空重建
+_SCHEMA_VERSION = 2
+
+
+def _cjk_terms(text: str) -> str:
+    """把每段连续的中日韩文字改写为空格分隔的二元组，例如 "联邦学习" -> "联邦 邦学 学习"；其余文字不变"""
+    def bigrams(match):
+        run = match.group(0)
+        return " " + " ".join(run[i:i + 2] for i in range(max(len(run) - 1, 1))) + " "
+    return _CJK_RE.sub(bigrams, text)
+
+
+def _snippet(text: str, tokens: List[str]) -> str:
+    """在原文中截取第一个命中词附近的片段，命中词加粗 (找不到时取页首)"""
+    pattern = re.compile("|".join(re.escape(t) for t in sorted(set(tokens), key=len, reverse=True)), re.IGNORECASE)
+    found = pattern.search(text)
+    center = found.start() if found else 0
+    start, end = max(center - _SNIPPET_CHARS, 0), center + _SNIPPET_CHARS
+    # 相邻的命中词合并为一段加粗
+    window = pattern.sub(lambda m: f"**{m.group(0)}**", text[start:end]).replace("****", "")
+    window = ("… " if start > 0 else "") + window + (" …" if end < len(text) else "")
+    return " ".join(window.split())
+
+
+class PaperIndex:
+    """
+    docs/ 论文库的全文索引 (SQLite FTS5，逐页一行，按 BM25 排序)。
+    - 中日韩文字按二元组分词 (见 _cjk_terms)，查询 "联邦学习" 即可命中 "...联邦学习中的..."；原文另存一列用于摘要片段；
+    - 按内容哈希增量维护：只有新出现的哈希需要解析 (复用 PaperLibrary 的解析缓存)，
+      重命名只更新显示名，不再被任何显示名引用的哈希从索引中删除；
+    - 比较内容哈希与同步都在后台线程进行 (进程启动时由 GUI 预先触发)；查询只在论文列表变化时触发同步，
+      并最多短暂等待进行中的同步，超时后查询已经建好的部分。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="paper-index")
+        self._sync_future: Optional[Future] = None
+        self._synced: Optional[Dict[str, str]] = None
+        self._library_key = None
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        version, = self._conn.execute("PRAGMA user_version").fetchone()
+        if version != _SCHEMA_VERSION:
+            for table in ("pages", "papers", "names"):
+                self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS papers (sha TEXT PRIMARY KEY, pages INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, sha TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5("
+            " terms, text UNINDEXED, sha UNINDEXED, page UNINDEXED,"
+            " tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+        self._conn.commit()
+
+    # -------------------------------------------------------------------------
+    # 增量同步
+    # -------------------------------------------------------------------------
+    def refresh(self) -> Future:
+        """
+        在后台检查论文列表 (显示名 -> 内容哈希)，有变化时同步一次；已在同步时不重复提交，返回正在进行的任务。
+        冷启动时计算全部 PDF 的内容哈希需要读取文件，因此不在调用方线程进行
+        (之后由 PaperLibrary 按文件 stat 缓存，比较不会重新读取 PDF)。
+        """
+        with self._lock:
+            if self._sync_future is None or self._sync_future.done():
+                self._sync_future = self._executor.submit(self._sync)
+            return self._sync_future
+
+    def refresh_if_changed(self) -> Optional[Future]:
+        """
+        论文列表有变化 (上传、删除、直接放入 PDF，见 PaperLibrary.listing_key) 或尚未同步过时提交 refresh；
+        否则只返回进行中的同步 (没有时为 None)，不重新扫描论文库。
+        """
+        key = paper_library.listing_key()
+        with self._lock:
+            changed = key != self._library_key
+            self._library_key = key
+            pending = self._sync_future if self._sync_future is not None and not self._sync_future.done() else None
+        return self.refresh() if changed else pending
+
+    def _sync(self):
+        t0 = time.perf_counter()
+        hashes = {name: paper_library.content_hash(name) for name in paper_library.list_names()}
+        hashes = {name: sha for name, sha in hashes.items() if sha}
+        with self._lock:
+            if hashes == self._synced:
+                return
+            indexed = {row[0] for row in self._conn.execute("SELECT sha FROM papers")}
+        added = 0
+        for name, sha in hashes.items():
+            if sha in indexed:
+                continue
+            # 逐页流式写入，论文解析完成前索引就开始增长；失败时回滚该论文已写入的页面
+            page_count = 0
+            try:
+                for page in paper_library.iter_pages(name):
+                    page_count += 1
+                    if page["text"]:
+                        with self._lock:
+                            self._conn.execute("INSERT INTO pages (terms, text, sha, page) VALUES (?, ?, ?, ?)",
+                                               (_cjk_terms(page["text"]), page["text"], sha, page["number"]))
+            except Exception as e:
+                print(f"[System] Paper index: failed to parse {name}: {e}")
+                with self._lock:
+                    self._conn.rollback()
+                continue
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO papers (sha, pages) VALUES (?, ?)", (sha, page_count))
+                self._conn.commit()
+            indexed.add(sha)
+            added += 1
+
+        with self._lock:
+            self._conn.execute("DELETE FROM names")
+            self._conn.executemany("INSERT INTO names (name, sha) VALUES (?, ?)", hashes.items())
+            stale = indexed - set(hashes.values())
+            for sha in stale:
+                self._conn.execute("DELETE FROM pages WHERE sha = ?", (sha,))
+                self._conn.execute("DELETE FROM papers WHERE sha = ?", (sha,))
+            self._conn.commit()
+            self._synced = hashes
+        if added or stale:
+            print(f"[System] Paper index synced: +{added} / -{len(stale)} papers "
+                  f"({len(hashes)} total) in {time.perf_counter() - t0:.2f}s")
+
+    def wait(self, timeout: Optional[float] = None):
+        """等待进行中的同步完成 (批处理、测试使用)"""
+        self.refresh().result(timeout=timeout)
+
+    # -------------------------------------------------------------------------
+    # 查询
+    # -------------------------------------------------------------------------
+    def search(self, query: str, k: int = 8) -> List[Dict]:
+        """
+        返回按相关度排序的 [{"paper", "page", "snippet"}]。
+        所有词都出现的页面优先；没有这样的页面时退化为任意词匹配。
+        索引仍在同步时最多等待 PAPER_INDEX_SEARCH_WAIT 秒，调用方可通过 stats()["syncing"] 提示结果可能不完整。
+        """
+        pending = self.refresh_if_changed()
+        if pending is not None:
+            wait([pending], timeout=PAPER_INDEX_SEARCH_WAIT)
+        tokens = _TOKEN_RE.findall(query)
+        if not tokens:
+            return []
+        # 每个词作为一个短语匹配 (中文词改写后是连续的二元组)
+        quoted = [f'"{_cjk_terms(token).strip()}"' for token in tokens]
+        hits = self._match(" ".join(quoted), tokens, k)
+        if not hits and len(quoted) > 1:
+            hits = self._match(" OR ".join(quoted), tokens, k)
+        return hits
+
+    def _match(self, expression: str, tokens: List[str], k: int) -> List[Dict]:
+        sql = (
+            "SELECT (SELECT MIN(name) FROM names WHERE names.sha = pages.sha), page, text "
+            "FROM pages WHERE pages MATCH ? ORDER BY rank LIMIT ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, (expression, k)).fetchall()
+        return [
+            {"paper": name, "page": page, "snippet": _snippet(text, tokens)}
+            for name, page, text in rows if name
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            papers, = self._conn.execute("SELECT COUNT(*) FROM papers").fetchone()
+            pages, = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()
+            syncing = self._sync_future is not None and not self._sync_future.done()
+        return {"papers": papers, "pages": pages, "syncing": syncing}
+
+
+_index: Optional[PaperIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_paper_index() -> PaperIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PaperIndex(CACHE_DIR / "paper_index.sqlite")
+        return _index
@@ -0,0 +1,142 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain_core.tools import BaseTool
+
+from src.config import TOOL_MAX_WORKERS
+
+# 只读、相互独立的工具：同一轮中出现多个时可以并发执行
+READ_ONLY_TOOLS = frozenset({
+    "read_paper_tool",
+    "search_papers_tool",
+    "read_file_tool",
+    "web_search_tool",
+})
+
+# 进程级工具线程池，所有 Agent 共用
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="agent-tool")
+# 标记当前线程 / 协程正在规划哪些 executor 的下一步 (此时工具调用只登记、不执行)
+_planning: contextvars.ContextVar[frozenset] = contextvars.ContextVar("planning_executors", default=frozenset())
+
+
+class _DeferredAction(NamedTuple):
+    name_to_tool_map: Dict[str, BaseTool]
+    color_mapping: Dict[str, str]
+    agent_action: AgentAction
+    run_manager: Optional[Union[CallbackManagerForChainRun, AsyncCallbackManagerForChainRun]]
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """
+    支持并行工具调用的 AgentExecutor。
+    模型在同一轮发出的多个只读工具调用 (搜索、读文件、查论文) 会在线程池中并发执行；
+    写入类工具 (write_file_tool 等) 保持串行，并按模型给出的顺序执行。
+    规划、解析错误处理等逻辑完全复用父类，只替换 "逐个执行工具" 这一步。
+    异步接口 (ainvoke) 遵循同样的规则：父类会用 asyncio.gather 并发执行所有调用，这里改为只并发只读调用。
+    """
+
+    read_only_tools: frozenset = READ_ONLY_TOOLS
+    # 在调度线程中调用，返回一个在工作线程中执行的初始化函数 (例如为 Streamlit 绑定 ScriptRunContext)
+    thread_context: Optional[Callable[[], Callable[[], None]]] = None
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        if id(self) in _planning.get():
+            return _DeferredAction(name_to_tool_map, color_mapping, agent_action, run_manager)
+        return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        if id(self) in _planning.get():
+            return _DeferredAction(name_to_tool_map, color_mapping, agent_action, run_manager)
+        return await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+    def _iter_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Iterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        token = _planning.set(_planning.get() | {id(self)})
+        try:
+            outputs = list(super()._iter_next_step(
+                name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+            ))
+        finally:
+            _planning.reset(token)
+
+        deferred = [o for o in outputs if isinstance(o, _DeferredAction)]
+        for output in outputs:
+            if not isinstance(output, _DeferredAction):
+                yield output
+        yield from self._run_deferred(deferred)
+
+    async def _aiter_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AsyncIterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        # 父类 gather 创建的子任务会复制当前 context，因此同样能看到规划标记
+        token = _planning.set(_planning.get() | {id(self)})
+        try:
+            outputs = [o async for o in super()._aiter_next_step(
+                name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+            )]
+        finally:
+            _planning.reset(token)
+
+        deferred = [o for o in outputs if isinstance(o, _DeferredAction)]
+        for output in outputs:
+            if not isinstance(output, _DeferredAction):
+                yield output
+        parent = super()
+        for batch in self._group_deferred(deferred):
+            if len(batch) > 1:
+                steps = await asyncio.gather(*[parent._aperform_agent_action(*item) for item in batch])
+                for step in steps:
+                    yield step
+            else:
+                yield await parent._aperform_agent_action(*batch[0])
+
+    def _group_deferred(self, deferred: List[_DeferredAction]) -> Iterator[List[_DeferredAction]]:
+        """按原顺序分组：连续的只读调用为一组，每个写入调用单独一组"""
+        i = 0
+        while i < len(deferred):
+            j = i
+            while j < len(deferred) and deferred[j].agent_action.tool in self.read_only_tools:
+                j += 1
+            j = max(j, i + 1)
+            yield deferred[i:j]
+            i = j
+
+    def _run_deferred(self, deferred: List[_DeferredAction]) -> Iterator[AgentStep]:
+        """按顺序执行：连续的只读调用为一组并发执行，写入调用单独串行执行"""
+        for batch in self._group_deferred(deferred):
+            if len(batch) > 1:
+                yield from self._run_concurrently(batch)
+            else:
+                yield super()._perform_agent_action(*batch[0])
+
+    def _run_concurrently(self, batch: List[_DeferredAction]) -> Iterator[AgentStep]:
+        init_worker = self.thread_context() if self.thread_context else None
+        parent = super()
+
+        def run(item: _DeferredAction) -> AgentStep:
+            if init_worker:
+                init_worker()
+            return parent._perform_agent_action(*item)
+
+        futures = [
+            _tool_pool.submit(contextvars.copy_context().run, run, item)
+            for item in batch
+        ]
+        for future in futures:
+            yield future.result()
@@ -0,0 +1,146 @@
+import re
+from typing import List, Tuple
+
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+# 定位 hunk 时允许的最大行号偏移 (模型给出的行号常常不准)
+MAX_HUNK_OFFSET = 200
+
+
+class EditConflict(Exception):
+    """编辑无法安全应用 (上下文不匹配、标题不存在或有歧义)，错误信息可直接返回给 Agent"""
+
+
+# =============================================================================
+# Markdown 小节替换
+# =============================================================================
+def _normalize_heading(heading: str) -> str:
+    match = _HEADING_RE.match(heading.strip())
+    text = match.group(2) if match else heading.strip()
+    return " ".join(text.split())
+
+
+def list_headings(text: str) -> List[str]:
+    headings, in_code = [], False
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+            continue
+        if not in_code and _HEADING_RE.match(line):
+            headings.append(line.strip())
+    return headings
+
+
+def replace_section(text: str, heading: str, content: str) -> str:
+    """
+    替换 Markdown 小节的正文：从匹配的标题行之后，到下一个同级或更高级标题之前。
+    标题行本身保留；heading 可以带或不带 '#' 前缀。代码块中的 '#' 行不视为标题。
+    """
+    target = _normalize_heading(heading)
+    lines = text.splitlines(keepends=True)
+
+    matches, in_code = [], False
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+            continue
+        match = None if in_code else _HEADING_RE.match(line.rstrip("\r\n"))
+        if match and " ".join(match.group(2).split()) == target:
+            matches.append((i, len(match.group(1))))
+
+    if not matches:
+        available = ", ".join(list_headings(text)) or "(none)"
+        raise EditConflict(f"Conflict: heading '{heading}' not found. Available headings: {available}")
+    if len(matches) > 1:
+        raise EditConflict(f"Conflict: heading '{heading}' appears {len(matches)} times; use apply_patch_tool instead.")
+
+    start, level = matches[0]
+    end, in_code = len(lines), False
+    for j in range(start + 1, len(lines)):
+        if lines[j].lstrip().startswith("```"):
+            in_code = not in_code
+            continue
+        match = None if in_code else _HEADING_RE.match(lines[j].rstrip("\r\n"))
+        if match and len(match.group(1)) <= level:
+            end = j
+            break
+
+    body = content.strip("\n")
+    new_body = f"{body}\n\n" if end < len(lines) else f"{body}\n"
+    heading_line = lines[start] if lines[start].endswith("\n") else lines[start] + "\n"
+    return "".join(lines[:start]) + heading_line + new_body + "".join(lines[end:])
+
+
+# =============================================================================
+# Unified diff
+# =============================================================================
+def _parse_hunks(patch: str) -> List[Tuple[int, List[str], List[str]]]:
+    """返回 [(原文件起始行号 (1-based), 旧行列表, 新行列表)]，忽略 ---/+++ 文件头"""
+    hunks, current, expected = [], None, (0, 0)
+    for line in patch.splitlines():
+        header = _HUNK_RE.match(line)
+        if header:
+            current = (int(header.group(1)), [], [])
+            hunks.append(current)
+            # 头部记录的旧 / 新行数 (省略时为 1)
+            expected = (int(header.group(2) or 1), int(header.group(4) or 1))
+            continue
+        if current is None or (line.startswith(("--- ", "+++ ")) and not current[1] and not current[2]):
+            continue
+        if line.startswith("\\"):
+            # "\ No newline at end of file"
+            continue
+        if not line and len(current[1]) >= expected[0] and len(current[2]) >= expected[1]:
+            # 空行只在 hunk 尚未达到头部行数时视为空白上下文行；模型输出末尾多出的空行忽略
+            continue
+        tag, body = (line[:1], line[1:]) if line else (" ", "")
+        if tag == " ":
+            current[1].append(body)
+            current[2].append(body)
+        elif tag == "-":
+            current[1].append(body)
+        elif tag == "+":
+            current[2].append(body)
+        else:
+            raise EditConflict(f"Conflict: malformed patch line: {line!r}")
+    if not hunks:
+        raise EditConflict("Conflict: no '@@ -a,b +c,d @@' hunks found in patch.")
+    return hunks
+
+
+def _find_hunk(lines: List[str], old: List[str], expected: int, floor: int) -> int:
+    """在 expected 附近寻找与 old 一致的位置 (不早于 floor)，找不到返回 -1"""
+    if not old:
+        return min(max(expected, floor), len(lines))
+    for offset in range(MAX_HUNK_OFFSET + 1):
+        for pos in (expected - offset, expected + offset) if offset else (expected,):
+            if floor <= pos <= len(lines) - len(old) and lines[pos:pos + len(old)] == old:
+                return pos
+    return -1
+
+
+def apply_unified_diff(text: str, patch: str) -> str:
+    """
+    应用 unified diff。上下文行与删除行必须与当前文件逐字一致 (忽略行尾空白)，
+    任何一个 hunk 无法定位都会抛出 EditConflict，文件保持不变。
+    """
+    original = text.splitlines()
+    lines = [line.rstrip() for line in original]
+    result, cursor, shift = [], 0, 0
+    for index, (start, old, new) in enumerate(_parse_hunks(patch), 1):
+        old = [line.rstrip() for line in old]
+        # 纯插入的 hunk (-a,0) 表示插入到第 a 行之后
+        base = start if not old else max(start - 1, 0)
+        pos = _find_hunk(lines, old, base + shift, cursor)
+        if pos < 0:
+            preview = "\n".join(old[:6]) or "(empty)"
+            raise EditConflict(
+                f"Conflict: hunk #{index} (@@ -{start}) does not match the current file. "
+                f"Expected lines:\n{preview}\nRe-read the file and regenerate the patch."
+            )
+        result.extend(original[cursor:pos])
+        result.extend(new)
+        cursor = pos + len(old)
+        shift = pos - base
+    result.extend(original[cursor:])
+    return "\n".join(result) + "\n"
@@ -0,0 +1,134 @@
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from src.config import (
+    RES_DIR, FILE_BASE_INFO, FILE_MEMORY, FILE_FINAL, FILE_TOTAL,
+    FILE_INNOV_1, FILE_INNOV_2, FILE_INNOV_3
+)
+
+# 里程碑文件与其写入后进入的阶段，按研究流程从后往前排列 (第一个命中的决定当前阶段)
+_PHASE_RULES = [
+    (FILE_TOTAL, "done"),
+    (FILE_FINAL, "final"),
+    (FILE_INNOV_3, "final"),
+    (FILE_INNOV_2, "innov3"),
+    (FILE_INNOV_1, "innov2"),
+    (FILE_BASE_INFO, "innov1"),
+]
+MILESTONE_FILES = frozenset(name for name, _ in _PHASE_RULES)
+# 会话阶段的先后顺序；"read" 由研究员点击开始后进入，不对应任何里程碑文件
+PHASE_ORDER = ["init", "read", "innov1", "innov2", "innov3", "final", "done"]
+
+
+@dataclass(frozen=True)
+class PhaseSnapshot:
+    """某一时刻的里程碑状态 (不可变)，GUI 每次 rerun 只取一次"""
+    version: int
+    milestones: FrozenSet[str]
+
+    def has(self, filename: str) -> bool:
+        return filename in self.milestones
+
+    @property
+    def phase(self) -> str:
+        """仅由里程碑文件推断出的阶段 (新会话恢复进度时使用)"""
+        return next((phase for name, phase in _PHASE_RULES if name in self.milestones), "init")
+
+    def advance(self, current: str) -> str:
+        """
+        阅读与创新点阶段在对应里程碑写入后自动进入下一阶段；
+        final -> done 需要研究员手动生成汇总报告，不自动推进
+        """
+        if current not in ("read", "innov1", "innov2", "innov3"):
+            return current
+        target = self.phase
+        return target if PHASE_ORDER.index(target) > PHASE_ORDER.index(current) else current
+
+
+class PhaseStateStore:
+    """
+    每个研究员一份的阶段状态：记录哪些里程碑文件已经写入。
+    创建时扫描一次目录，之后由写文件工具 (以及 GUI 自己的写入 / 清理操作) 推送更新，
+    读取方不再反复 stat 文件。每次变化 version 加一，调用方据此判断一轮对话中是否写入了里程碑。
+    subscribe 注册的监听器在每次变化后被调用 (在写入方的线程中)，参数为新的快照与写入的里程碑文件名；
+    重新扫描目录导致的变化 (重置项目等) 文件名为 None。
+    memory.md 不是里程碑，但下一阶段的 System Prompt 依赖它：写入后也通知监听器 (快照与 version 不变)。
+    """
+
+    def __init__(self, session_id: str):
+        self.session_dir = RES_DIR / session_id
+        self._lock = threading.Lock()
+        self._version = 0
+        self._milestones: FrozenSet[str] = frozenset()
+        self._listeners: List[Callable[[], Optional[Callable]]] = []
+        self.refresh()
+
+    def subscribe(self, listener: Callable[[PhaseSnapshot, Optional[str]], None]):
+        """注册监听器；绑定方法只保存弱引用，不会因为订阅而延长所属对象 (如缓存淘汰的 Agent) 的生命周期"""
+        if hasattr(listener, "__self__"):
+            ref = weakref.WeakMethod(listener)
+        else:
+            ref = lambda: listener
+        with self._lock:
+            self._listeners.append(ref)
+
+    def _notify(self, snapshot: "PhaseSnapshot", rel_path: Optional[str]):
+        with self._lock:
+            self._listeners = [ref for ref in self._listeners if ref() is not None]
+            listeners = [ref() for ref in self._listeners]
+        for listener in listeners:
+            if listener is None:
+                continue
+            try:
+                listener(snapshot, rel_path)
+            except Exception as e:
+                print(f"[Warning] Phase state listener failed: {e}")
+
+    def refresh(self):
+        """重新扫描目录 (重置项目、或研究员在笔记本中手动删改文件后调用)"""
+        found = frozenset(name for name in MILESTONE_FILES if (self.session_dir / name).exists())
+        with self._lock:
+            if found == self._milestones:
+                return
+            self._milestones = found
+            self._version += 1
+            snapshot = PhaseSnapshot(self._version, self._milestones)
+        self._notify(snapshot, None)
+
+    def on_file_written(self, rel_path: str):
+        """写文件工具的回调：rel_path 为相对于会话目录的路径"""
+        if rel_path == FILE_MEMORY:
+            self._notify(self.snapshot(), rel_path)
+            return
+        if rel_path not in MILESTONE_FILES:
+            return
+        with self._lock:
+            # 里程碑被修订也算一次变化，调用方需要知道这一轮写过它
+            self._milestones = self._milestones | {rel_path}
+            self._version += 1
+            snapshot = PhaseSnapshot(self._version, self._milestones)
+        self._notify(snapshot, rel_path)
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def snapshot(self) -> PhaseSnapshot:
+        with self._lock:
+            return PhaseSnapshot(self._version, self._milestones)
+
+
+_stores: Dict[str, PhaseStateStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_phase_state(session_id: str) -> PhaseStateStore:
+    with _stores_lock:
+        store = _stores.get(session_id)
+        if store is None:
+            store = PhaseStateStore(session_id)
+            _stores[session_id] = store
+        return store
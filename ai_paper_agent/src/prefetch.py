@@ -0,0 +1,112 @@
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from src.config import FILE_MEMORY
+from src.context import ContextAssembler
+from src.library import paper_library
+from src.paper_index import get_paper_index
+
+# 会自动进入、且 System Prompt 依赖里程碑文件的阶段
+_PREFETCH_PHASES = ("innov1", "innov2", "innov3", "final")
+# 所有研究员共用的预取线程 (预取只做本地文件读取与摘要，不调用 LLM)
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="phase-prefetch")
+
+
+class PhasePrefetcher:
+    """
+    推测式预取：里程碑文件一写入 (见 PhaseStateStore.subscribe)，就在后台为即将进入的下一阶段做准备：
+    - 装配该阶段的 System Prompt (读取前序文件、按预算生成并缓存摘要、统计 token)，
+      update_phase 时输入未变即直接使用 (take)，否则照常重新装配；
+      里程碑写入后 Agent 通常紧接着在 memory.md 追加记录，此时按新的输入重新装配一次；
+    - 预热本会话读过的论文的解析缓存，并同步论文库全文索引。
+    目录被重新扫描 (重置项目等) 时取消尚未执行的预取，并丢弃已准备好的结果。
+    笔记检索与网络搜索不做推测：查询由模型在下一阶段生成，预先猜测的查询几乎无法命中。
+    """
+
+    def __init__(self, agent):
+        # 只保存弱引用：Agent 被 GUI 缓存淘汰后预取自然失效
+        self._agent = weakref.ref(agent)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._futures: List[Future] = []
+        self._prepared: Dict[str, Tuple[str, str, dict, str]] = {}
+
+    def on_phase_event(self, snapshot, rel_path: Optional[str]):
+        if rel_path is None:
+            self.cancel()
+            return
+        next_phase = snapshot.phase
+        if next_phase not in _PREFETCH_PHASES:
+            return
+        if rel_path == FILE_MEMORY:
+            # 只有 System Prompt 的输入变化了
+            self.schedule(next_phase, steps=(self._prepare_prompt,))
+        else:
+            self.schedule(next_phase)
+
+    def schedule(self, phase: str, steps: Optional[tuple] = None):
+        with self._lock:
+            generation = self._generation
+            self._futures = [f for f in self._futures if not f.done()]
+            for step in steps or (self._prepare_prompt, self._warm_papers):
+                self._futures.append(_executor.submit(self._run, step, phase, generation))
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            for future in self._futures:
+                future.cancel()
+            self._futures = []
+            self._prepared.clear()
+
+    def take(self, phase: str, inputs_key: str) -> Optional[Tuple[str, dict, str]]:
+        """取出预取好的 (System Prompt, token 统计, 日志)；输入已变化时返回 None"""
+        with self._lock:
+            prepared = self._prepared.pop(phase, None)
+        if prepared is None or prepared[0] != inputs_key:
+            return None
+        return prepared[1:]
+
+    def wait(self, timeout: Optional[float] = None):
+        """等待已提交的预取完成 (测试、批处理使用)"""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            if not future.cancelled():
+                future.result(timeout=timeout)
+
+    def _run(self, step, phase: str, generation: int):
+        agent = self._agent()
+        if agent is None or generation != self._generation:
+            return
+        started = time.perf_counter()
+        try:
+            step(agent, phase, generation)
+        except Exception as e:
+            print(f"[Warning] Prefetch {step.__name__} for User {agent.session_id} failed: {e}")
+            return
+        print(f"[System] [User {agent.session_id}] Prefetched {step.__name__.lstrip('_')} for phase "
+              f"{phase.upper()} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    def _prepare_prompt(self, agent, phase: str, generation: int):
+        context_data = agent.phase_context(phase)
+        inputs_key = agent.phase_inputs_key(phase, context_data)
+        # 独立的装配器 (共享磁盘摘要缓存)，不干扰 Agent 当前阶段的 token 统计
+        assembler = ContextAssembler(agent.context_assembler.cache_dir)
+        prompt = agent.assemble_phase_prompt(phase, context_data, assembler)
+        report = assembler.report(phase, prompt)
+        # 装配期间输入又变化了 (如 memory.md 刚被追加)：结果交给随之提交的新一次预取
+        if agent.phase_inputs_key(phase, agent.phase_context(phase)) != inputs_key:
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._prepared[phase] = (inputs_key, prompt, assembler.breakdown, report)
+
+    def _warm_papers(self, agent, phase: str, generation: int):
+        for name, sha in list(agent.tool_factory.papers_read.items()):
+            if paper_library.content_hash(name) == sha:
+                paper_library.prewarm(name)
+        get_paper_index().refresh_if_changed()
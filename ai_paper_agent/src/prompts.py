@@ -1,11 +1,16 @@
 import textwrap
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict
+
+from src.config import PARALLEL_TOOL_CALLS
 
 class PromptManager:
     """
     提示词管理器：采用结构化 Prompt Engineering 设计。
     优化版 v2：适配 SilverBullet (S.B.) 知识库格式，增加 Frontmatter 和 WikiLink 支持。
+    优化版 v3：前缀缓存友好布局 —— 按 "核心宪法 -> 基准论文 -> 已确定创新点 -> 阶段任务 -> 易变信息" 排列，
+              日期、项目记忆等每轮都可能变化的内容统一放在末尾的 <session_info>，
+              使服务商侧 (OpenAI / DeepSeek) 的前缀缓存可以跨轮次、跨阶段命中。
     """
 
     # =============================================================================
@@ -30,7 +35,7 @@ class PromptManager:
            ---
            tags: #research #agent_generated
            status: draft
-           created: {date}
+           created: YYYY-MM-DD (取 <session_info> 中的 today)
            ---
            ```
            (请根据文件内容自动调整 tags，例如 #innovation, #experiment, #summary)
@@ -50,11 +55,20 @@ class PromptManager:
         </fundamental_constraints>
 
         <tool_protocol> ⚠️ CRITICAL INSTRUCTION FOR TOOL USAGE ⚠️
-        NO PATH PREFIX: When calling write_file_tool, DO NOT include "res/" in the filename. Just provide the filename (e.g., "base.md", NOT "res/base.md").
-        ATOMIC ACTION: You must execute ONLY ONE tool call per turn. 
+        NO PATH PREFIX: When calling file tools, DO NOT include "res/" in the filename. Just provide the filename (e.g., "base.md", NOT "res/base.md").
+        EDIT, DON'T REWRITE: write_file_tool is for creating a file. To change an existing file, use append_to_file_tool (e.g., new entries in memory.md), replace_section_tool (rewrite one section) or apply_patch_tool (small unified-diff edits). If an edit tool reports a conflict, re-read the file and retry.
+        {tool_concurrency_rule}
         </tool_protocol>
     """).strip()
 
+    # 工具调用并发规则 (由 PARALLEL_TOOL_CALLS 决定，进程内固定，不影响前缀缓存)
+    TOOL_RULE_SEQUENTIAL = "ATOMIC ACTION: You must execute ONLY ONE tool call per turn."
+    TOOL_RULE_PARALLEL = (
+        "PARALLEL READS: Independent read-only tool calls (web_search_tool, read_file_tool, read_paper_tool, "
+        "search_papers_tool) SHOULD be issued together in ONE turn; they run concurrently. "
+        "ATOMIC WRITES: Issue at most ONE write tool call per turn, and never batch a call that depends on another call's result."
+    )
+
     # =============================================================================
     # 辅助函数
     # =============================================================================
@@ -75,8 +89,20 @@ class PromptManager:
 
     @staticmethod
     def _get_system_context() -> str:
-        """获取并格式化核心 System Context"""
-        return PromptManager.CORE_SYSTEM_CONTEXT.format(date=PromptManager._get_today())
+        """获取核心 System Context (字节级稳定，不含任何日期等易变字段)"""
+        rule = PromptManager.TOOL_RULE_PARALLEL if PARALLEL_TOOL_CALLS else PromptManager.TOOL_RULE_SEQUENTIAL
+        return PromptManager.CORE_SYSTEM_CONTEXT.format(tool_concurrency_rule=rule)
+
+    @staticmethod
+    def _get_session_info(memory_log: str = "") -> str:
+        """
+        易变信息块：必须位于 Prompt 末尾，避免破坏前缀缓存。
+        memory_log 需事先经过 _sanitize 处理。
+        """
+        lines = [f"today: {PromptManager._get_today()}"]
+        if memory_log:
+            lines.append(f"项目记忆 (memory.md):\n{memory_log}")
+        return "<session_info>\n" + "\n".join(lines) + "\n</session_info>"
 
     # =============================================================================
     # 1. Phase 1: 论文全量阅读 (Base Extraction)
@@ -84,10 +110,9 @@ class PromptManager:
     @staticmethod
     def get_phase1_prompt() -> str:
         sys_ctx = PromptManager._get_system_context()
-        today = PromptManager._get_today()
         
         # 使用 dedent 保持代码整洁
-        mission_prompt = textwrap.dedent(f"""
+        mission_prompt = textwrap.dedent("""
             <current_mission> 用户上传了一篇论文PDF。你的任务是构建科研基准（Base Baseline）。 你需要提取论文的"骨架"，而非简单的摘要。重点关注其数学定义和不足之处。 </current_mission>
 
             <workflow>
@@ -105,7 +130,7 @@ class PromptManager:
             tags: #baseline #paper_reading
             status: finished
             type: literature_review
-            created: {today}
+            created: YYYY-MM-DD (取 <session_info> 中的 today)
             ---
             ```
             Markdown Body:
@@ -120,7 +145,62 @@ class PromptManager:
             <execution_trigger> 请开始执行读取并写入操作。完成后向用户汇报："[[base]] 已建立，请提出您的第一个创新点思路。" </execution_trigger>
         """).strip()
 
-        return f"{sys_ctx}\n\n{mission_prompt}"
+        return f"{sys_ctx}\n\n{mission_prompt}\n\n{PromptManager._get_session_info()}"
+
+    # -----------------------------------------------------------------------------
+    # 1b. 多论文阅读 (Map: 逐篇提取 -> Reduce: 合并为 base.md)，由 src.reading 直接调用 LLM，不经过工具
+    # -----------------------------------------------------------------------------
+    @staticmethod
+    def get_paper_extraction_prompt(role: str) -> str:
+        """单篇论文的提取 Prompt；role 为 "baseline" (基准论文) 或 "related" (相关论文)"""
+        sys_ctx = PromptManager._get_system_context()
+        if role == "baseline":
+            focus = "这是本项目的基准论文，后续所有创新点都建立在它之上：数学定义、算法流程与理论结论必须完整、精确。"
+        else:
+            focus = "这是一篇相关论文：重点提取它与同领域方法的差异、可借鉴的技术，以及它解决或遗留的问题。"
+
+        mission_prompt = textwrap.dedent(f"""
+            <current_mission> 研究员同时阅读多篇论文，你负责其中一篇的提取。论文全文在用户消息中给出，不需要调用任何工具。 {focus} </current_mission>
+
+            <output_schema>
+            只输出 Markdown 正文 (不要 YAML Frontmatter，不要代码块包裹)，第一行为 "# 论文标题"，随后依次为：
+            1. Problem Definition
+            2. Core Methodology (Use LaTeX for math)
+            3. Theoretical Results (If any)
+            4. Experimental Setup (Datasets, Baselines, Metrics)
+            5. Limitations & Gaps
+            </output_schema>
+        """).strip()
+
+        return f"{sys_ctx}\n\n{mission_prompt}\n\n{PromptManager._get_session_info()}"
+
+    @staticmethod
+    def get_paper_merge_prompt() -> str:
+        """把逐篇提取的笔记合并为结构化 base.md 的 Prompt"""
+        sys_ctx = PromptManager._get_system_context()
+
+        mission_prompt = textwrap.dedent("""
+            <current_mission> 用户消息中给出了每篇论文的提取笔记 (已分别保存为 papers/ 下的文件)。请将它们合并为项目的科研基准 base.md。 只能使用笔记中的内容，不要补充笔记中没有的公式或结论。 </current_mission>
+
+            <output_schema_for_file> 直接输出 base.md 的完整内容 (不要代码块包裹)。 YAML Head:
+            ```yaml
+            ---
+            tags: #baseline #paper_reading
+            status: finished
+            type: literature_review
+            created: YYYY-MM-DD (取 <session_info> 中的 today)
+            ---
+            ```
+            Markdown Body:
+            Title (Research Baseline Overview)
+            1. Baseline Paper: 基准论文的完整骨架 (Problem / Core Methodology / Theory / Experimental Setup / Implementation)，小节标题后附其笔记链接，如 [[papers/xxx]]
+            2. Related Papers: 每篇相关论文一个小节 (核心思想、与基准论文的关系)，同样附笔记链接
+            3. Comparative Analysis: 各论文在问题设定、方法与实验上的对比表
+            4. Open Gaps: 综合各论文后仍未解决的问题 (后续创新点的切入口)
+            </output_schema_for_file>
+        """).strip()
+
+        return f"{sys_ctx}\n\n{mission_prompt}\n\n{PromptManager._get_session_info()}"
 
     # =============================================================================
     # 2. Phase 2: 创新点迭代 (Innovation Loop)
@@ -131,27 +211,32 @@ class PromptManager:
         动态生成创新点挖掘的 Prompt。
         """
         sys_ctx = PromptManager._get_system_context()
-        today = PromptManager._get_today()
 
         # 提取并清洗上下文
-        raw_base = context_files.get('base_summary', '未读取')
-        raw_memory = context_files.get('memory_log', '无记录')
-        raw_prev_innovs = context_files.get('prev_innovations', '无前序创新点 (这是第一个点)')
+        raw_base = context_files.get('base_summary') or '未读取'
+        raw_memory = context_files.get('memory_log') or '无记录'
+        raw_prev_innovs = context_files.get('prev_innovations') or '无前序创新点 (这是第一个点)'
 
         base_summary = PromptManager._sanitize(raw_base)
         memory_log = PromptManager._sanitize(raw_memory)
         prev_innovs = PromptManager._sanitize(raw_prev_innovs)
 
-        mission_prompt = textwrap.dedent(f"""
-            <project_status> 当前阶段: 挖掘第 {stage_num} 个创新点 (Innovation {stage_num}) 项目记忆: {memory_log} </project_status>
+        # 稳定前缀：基准论文 + 已确定的创新点。innov2 / innov3 的前缀分别是上一阶段前缀的延伸。
+        # (外部内容不参与 dedent，否则其无缩进的行会让 dedent 失效)
+        stable_context = (
+            "<context_knowledge>\n"
+            f"基准论文 (Base Baseline):\n{base_summary}\n\n"
+            f"已确定的前序创新点:\n{prev_innovs}\n"
+            "</context_knowledge>"
+        )
 
-            <context_knowledge>
-            基准论文 (Base Baseline): {base_summary}
+        mission_prompt = textwrap.dedent(f"""
+            <project_status> 当前阶段: 挖掘第 {stage_num} 个创新点 (Innovation {stage_num}) </project_status>
 
-            已确定的前序创新点: {prev_innovs} 
+            <compatibility_constraint>
             CONSTRAINT: 你的新方案必须与前序创新点（如 [[innov1]]） 兼容 (Compatible)。 
             例如：如果 [[innov1]] 修改了 Loss Function，Innov {stage_num} 在引用 Loss 时必须使用修改后的版本。 
-            </context_knowledge>
+            </compatibility_constraint>
 
             <novelty_constraint> 为了降低“同质化”和“臆想”风险，请遵守：
             - No Generic Plugins: 严禁直接建议“加一个 Attention”，除非能证明其必要性。
@@ -165,7 +250,8 @@ class PromptManager:
             CASE B: 用户明确表示"确认"、"同意"、"就这样定稿" -> 你的行为: 
                1. STEP 1: 调用 write_file_tool 将定稿内容写入 innov{stage_num}.md。 
                2. Wait for confirmation. 
-               3. STEP 2: 调用 write_file_tool 更新 memory.md。 
+               3. STEP 2: 调用 append_to_file_tool 在 memory.md 末尾追加本阶段的记录。 
+            用户对已定稿的 innov{stage_num}.md 提出修改意见时，用 replace_section_tool / apply_patch_tool 只修改相关部分，不要重写整个文件。
             </decision_logic>
 
             <output_schema_for_innov_file> 目标文件: innov{stage_num}.md YAML Head:
@@ -174,7 +260,7 @@ class PromptManager:
             tags: #innovation #phase2
             status: draft
             priority: high
-            created: {today}
+            created: YYYY-MM-DD (取 <session_info> 中的 today)
             ---
             ```
             Markdown Body:
@@ -187,7 +273,8 @@ class PromptManager:
             </output_schema_for_innov_file>
         """).strip()
 
-        return f"{sys_ctx}\n\n{mission_prompt}"
+        session_info = PromptManager._get_session_info(memory_log)
+        return f"{sys_ctx}\n\n{stable_context}\n\n{mission_prompt}\n\n{session_info}"
 
     # =============================================================================
     # 3. Phase 3: 最终实验设计 (Final Experiment)
@@ -195,9 +282,8 @@ class PromptManager:
     @staticmethod
     def get_final_prompt() -> str:
         sys_ctx = PromptManager._get_system_context()
-        today = PromptManager._get_today()
 
-        mission_prompt = textwrap.dedent(f"""
+        mission_prompt = textwrap.dedent("""
             <current_mission> 所有三个创新点均已锁定。现在的任务是设计一份能够冲击顶会(Top-Tier Conference)的实验方案。 你需要将 [[base]] 和 [[innov1]], [[innov2]], [[innov3]] 融合为一个有机的整体框架。 </current_mission>
 
             <workflow>
@@ -210,7 +296,7 @@ class PromptManager:
               - Ablation Study: 必须设计消融实验，证明 Innov 1, 2, 3 缺一不可。
             
             WRITE: 将完整方案写入 final_innov.md。
-            CLOSE: 更新 memory.md 标记 PROJECT_COMPLETED。 
+            CLOSE: 调用 append_to_file_tool 在 memory.md 中追加 PROJECT_COMPLETED 标记。 
             </workflow>
 
             <output_schema_for_final_file> 目标文件: final_innov.md 
@@ -220,7 +306,7 @@ class PromptManager:
             tags: #experiment #final_plan
             status: ready_for_coding
             deadline: TBD
-            created: {today}
+            created: YYYY-MM-DD (取 <session_info> 中的 today)
             ---
             ```
             Markdown Body:
@@ -233,7 +319,7 @@ class PromptManager:
             </output_schema_for_final_file>
         """).strip()
 
-        return f"{sys_ctx}\n\n{mission_prompt}"
+        return f"{sys_ctx}\n\n{mission_prompt}\n\n{PromptManager._get_session_info()}"
 
     # =============================================================================
     # 4. 辅助工具：初始化记忆
@@ -0,0 +1,145 @@
+import contextvars
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.config import FILE_BASE_INFO, READ_PAPER_MAX_TOKENS
+from src.context import count_tokens, truncate_tokens
+from src.library import paper_library
+from src.prompts import PromptManager
+from src.scheduler import request_context, Priority
+from src.streaming import EventQueueHandler
+
+# 逐篇提取的笔记保存在研究员目录的 papers/ 下，base.md 通过 WikiLink 引用
+PAPER_NOTES_DIR = "papers"
+ROLE_LABELS = {"baseline": "基准论文", "related": "相关论文"}
+
+_SLUG_RE = re.compile(r"[^\w.-]+", re.UNICODE)
+_SOURCE_SHA_RE = re.compile(r"^source_sha: (\w+)\s*$", re.M)
+_FRONTMATTER_RE = re.compile(r"\A---\s*\n.*?\n---\s*\n", re.S)
+_FENCE_RE = re.compile(r"\A```(?:markdown|md)?\s*\n(.*)\n```\s*\Z", re.S)
+
+
+def paper_note_name(pdf_filename: str) -> str:
+    """论文对应的笔记文件 (相对研究员目录)，如 papers/FedAvg.md"""
+    slug = _SLUG_RE.sub("_", Path(pdf_filename).stem).strip("_") or "paper"
+    return f"{PAPER_NOTES_DIR}/{slug}.md"
+
+
+def _strip_fence(text: str) -> str:
+    text = text.strip()
+    match = _FENCE_RE.match(text)
+    return match.group(1).strip() if match else text
+
+
+def _cached_note(session_dir: Path, note_name: str, sha: str) -> Optional[str]:
+    """笔记已存在且记录的内容哈希与论文一致时直接复用 (重新进入阅读阶段、只新增了论文时无需重新提取)"""
+    path = session_dir / note_name
+    if not path.exists():
+        return None
+    text = path.read_text(encoding="utf-8")
+    match = _SOURCE_SHA_RE.search(text)
+    return text if match and match.group(1) == sha else None
+
+
+def extract_paper(agent, pdf_filename: str, role: str, events) -> Dict:
+    """
+    Map：读取一篇论文 (复用解析缓存) 并调用一次 LLM 提取结构化笔记，写入 papers/{slug}.md。
+    进度以 tool_start / tool_end 事件写入 events，界面按工具调用展示；各篇的 token 不写入事件，避免交错。
+    """
+    run_id = f"extract:{pdf_filename}"
+    note_name = paper_note_name(pdf_filename)
+    events.put_nowait({"type": "tool_start", "tool": "extract_paper", "input": f"{pdf_filename} ({ROLE_LABELS[role]})", "run_id": run_id})
+    started = time.perf_counter()
+    try:
+        sha = paper_library.content_hash(pdf_filename)
+        if sha is None:
+            raise FileNotFoundError(f"{pdf_filename} not found in the docs library")
+        note = _cached_note(agent.session_dir, note_name, sha)
+        reused = note is not None
+        if reused:
+            agent.tool_factory.papers_read[pdf_filename] = sha
+        else:
+            text, pages, _ = agent.tool_factory.read_paper_text(pdf_filename)
+            messages = [
+                SystemMessage(PromptManager.get_paper_extraction_prompt(role)),
+                HumanMessage(f"论文文件: {pdf_filename} ({pages} 页)\n\n{truncate_tokens(text, READ_PAPER_MAX_TOKENS)}"),
+            ]
+            reply = agent.llm.invoke(messages, config={"callbacks": [agent.usage_tracker]})
+            body = _strip_fence(reply.content if isinstance(reply.content, str) else str(reply.content))
+            note = (
+                "---\n"
+                f"tags: #paper_note #{role}\n"
+                f"source: {pdf_filename}\n"
+                f"source_sha: {sha}\n"
+                f"created: {datetime.now().strftime('%Y-%m-%d')}\n"
+                "---\n\n" + _FRONTMATTER_RE.sub("", body).strip() + "\n"
+            )
+            agent.tool_factory.write_note(note_name, note)
+    except Exception as e:
+        events.put_nowait({"type": "tool_error", "tool": "extract_paper", "output": str(e), "run_id": run_id})
+        raise
+
+    seconds = time.perf_counter() - started
+    events.put_nowait({
+        "type": "tool_end",
+        "tool": "extract_paper",
+        "output": f"{note_name} ({'reused, content unchanged' if reused else f'extracted in {seconds:.1f}s'}, {count_tokens(note)} tokens)",
+        "run_id": run_id,
+    })
+    return {"pdf": pdf_filename, "role": role, "note": note_name, "content": note, "reused": reused, "seconds": seconds}
+
+
+def merge_paper_notes(agent, extractions: List[Dict], events) -> str:
+    """Reduce：把各篇笔记合并为 base.md 的完整内容，token 以流式事件写入 events"""
+    sections = []
+    for item in extractions:
+        link = item["note"][:-len(".md")]
+        body = _FRONTMATTER_RE.sub("", item["content"]).strip()
+        sections.append(f"=== [[{link}]] ({ROLE_LABELS[item['role']]}, 源文件: {item['pdf']}) ===\n{body}")
+    messages = [
+        SystemMessage(PromptManager.get_paper_merge_prompt()),
+        HumanMessage("\n\n".join(sections)),
+    ]
+    reply = agent.llm.invoke(messages, config={"callbacks": [agent.usage_tracker, EventQueueHandler(events)]})
+    return _strip_fence(reply.content if isinstance(reply.content, str) else str(reply.content)) + "\n"
+
+
+def run_multi_read(agent, papers: List[str], events):
+    """
+    多论文阅读阶段 (第一篇为基准论文，其余为相关论文)，以 ResearchAgent.run_turn 的事件格式写入 events：
+    1. Map：每篇论文一个线程，并发读取与提取 (PDF 解析由论文库的解析线程串行完成，通常已在选择时预热)；
+    2. Reduce：一次 LLM 调用把各篇笔记合并为 base.md，写入后照常触发里程碑事件。
+    总耗时约为最慢的一篇提取 + 合并，而不是逐篇相加；内容未变的论文直接复用已有笔记。
+    """
+    started = time.perf_counter()
+    try:
+        roles = ["baseline"] + ["related"] * (len(papers) - 1)
+        # 提取线程复制提交时的 context：GUI 中按交互优先级调度，批处理中保持 BATCH
+        with request_context(agent.session_id, default_priority=Priority.INTERACTIVE):
+            with ThreadPoolExecutor(max_workers=len(papers), thread_name_prefix="paper-extract") as pool:
+                futures = [pool.submit(contextvars.copy_context().run, extract_paper, agent, pdf, role, events)
+                           for pdf, role in zip(papers, roles)]
+                extractions = [future.result() for future in futures]
+            map_seconds = time.perf_counter() - started
+
+            content = merge_paper_notes(agent, extractions, events)
+        agent.tool_factory.write_note(FILE_BASE_INFO, content)
+        total_seconds = time.perf_counter() - started
+        print(f"[System] [User {agent.session_id}] Read {len(papers)} papers in {total_seconds:.2f}s "
+              f"(extraction {map_seconds:.2f}s, slowest paper {max(e['seconds'] for e in extractions):.2f}s, "
+              f"merge {total_seconds - map_seconds:.2f}s).")
+
+        links = "、".join(f"[[{e['note'][:-len('.md')]}]]" for e in extractions)
+        events.put_nowait({
+            "type": "done",
+            "output": f"已合并 {len(papers)} 篇论文的笔记 ({links})，耗时 {total_seconds:.1f}s。\n\n"
+                      "[[base]] 已建立，请提出您的第一个创新点思路。",
+        })
+    except Exception as e:
+        events.put_nowait({"type": "error", "text": f"System Error during execution: {str(e)}"})
@@ -0,0 +1,436 @@
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+
+import httpx
+
+from src.config import (
+    LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE, LLM_PROVIDER_LIMITS,
+    LLM_RATE_LIMIT_RETRIES, LLM_BACKOFF_MAX_SECONDS
+)
+
+
+class Priority:
+    """请求的优先级类别：数值越小越先派发，同一类别内按研究员轮转"""
+    INTERACTIVE = 0     # 研究员正在等待的对话轮次 (GUI)
+    BATCH = 1           # 无人值守的批处理任务 (src.main)
+    BACKGROUND = 2      # 知识库索引等后台任务
+
+
+PRIORITY_NAMES = {Priority.INTERACTIVE: "interactive", Priority.BATCH: "batch", Priority.BACKGROUND: "background"}
+
+# 发起请求的研究员与优先级，由调用方通过 request_context 设置 (contextvars 随 Worker / 工具线程的 context 复制传递)
+_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_request_user", default=None)
+_priority: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("llm_request_priority", default=None)
+
+# 限流状态码：按 Retry-After 暂停向该服务商派发所有请求后重试
+_RETRY_STATUS = (429, 503)
+# 其他临时错误：只重试当前请求 (与 OpenAI SDK 自带重试的范围一致；共享连接池上的客户端已关闭 SDK 重试)
+_TRANSIENT_STATUS = (408, 409, 500, 502, 504)
+
+
+@contextlib.contextmanager
+def request_context(user: Optional[str] = None, priority: Optional[int] = None, default_priority: Optional[int] = None):
+    """
+    with 块内发出的 LLM / Embedding 请求归属于 user，并按 priority 排队；参数为 None 时沿用外层设置。
+    default_priority 只在外层没有设置优先级时生效 (如批处理中调用的 Agent 接口保持 BATCH)。
+    """
+    if priority is None and _priority.get() is None:
+        priority = default_priority
+    tokens = []
+    if user is not None:
+        tokens.append((_user, _user.set(user)))
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    """解析 retry-after-ms / Retry-After (秒数或 HTTP 日期)；没有或无法解析时返回 None"""
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Ticket:
+    """一个排队中 / 已获准执行的请求"""
+    __slots__ = ("user", "priority", "cost", "grant", "granted", "released", "enqueued_at")
+
+    def __init__(self, user: str, priority: int, cost: int, grant: Callable[[], None]):
+        self.user = user
+        self.priority = priority
+        self.cost = cost
+        self.grant = grant
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+
+
+class ProviderScheduler:
+    """
+    单个服务商的请求调度：
+    - 并发上限：同时在途的请求 (含流式响应的整个读取过程) 不超过 concurrency；
+    - token 速率：令牌桶按 tokens_per_minute 匀速补充，请求按估算的输入 token 数扣减 (0 表示不限)；
+    - 优先级 + 公平排队：先派发高优先级类别；同一类别内每个研究员一个 FIFO 队列，研究员之间轮转，
+      某个研究员的大量请求 (如笔记批量向量化) 不会排在其他人前面；
+    - 退避：收到 429 / 503 后按 Retry-After 暂停向该服务商派发新请求，所有研究员共同遵守。
+    """
+
+    def __init__(self, name: str, concurrency: int, tokens_per_minute: int):
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.tokens_per_minute = max(tokens_per_minute, 0)
+        self._lock = threading.Lock()
+        self._queues: Dict[int, "OrderedDict[str, deque[_Ticket]]"] = {}
+        self._active = 0
+        self._tokens = float(self.tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._timer_at = 0.0
+        self._stats = {"granted": 0, "rate_limited": 0, "wait_seconds": 0.0}
+
+    # -------------------------------------------------------------------------
+    # 排队与派发
+    # -------------------------------------------------------------------------
+    def _ticket(self, user: str, priority: int, cost: int, grant) -> _Ticket:
+        # 超过桶容量的请求按满桶计，否则永远无法派发
+        if self.tokens_per_minute:
+            cost = min(cost, self.tokens_per_minute)
+        ticket = _Ticket(user, priority, cost, grant)
+        with self._lock:
+            self._queues.setdefault(priority, OrderedDict()).setdefault(user, deque()).append(ticket)
+            self._dispatch_locked()
+        return ticket
+
+    def acquire(self, user: str, priority: int, cost: int) -> _Ticket:
+        """阻塞直到请求获准执行；执行结束后必须调用 release"""
+        granted = threading.Event()
+        ticket = self._ticket(user, priority, cost, granted.set)
+        granted.wait()
+        return ticket
+
+    async def aacquire(self, user: str, priority: int, cost: int) -> _Ticket:
+        """acquire 的异步版本：排队期间不占用事件循环与线程"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = self._ticket(user, priority, cost, grant)
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket):
+        with self._lock:
+            if not ticket.granted or ticket.released:
+                return
+            ticket.released = True
+            self._active -= 1
+            self._dispatch_locked()
+
+    def backoff(self, delay: float):
+        """服务商限流：delay 秒内不再派发新请求 (已在途的请求不受影响)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._stats["rate_limited"] += 1
+        print(f"[System] LLM provider {self.name} rate limited, pausing dispatch for {delay:.1f}s.")
+
+    def _abandon(self, ticket: _Ticket):
+        """等待中的调用方被取消：还在排队则移出队列，已获准则归还名额"""
+        with self._lock:
+            if not ticket.granted:
+                users = self._queues.get(ticket.priority, {})
+                queue = users.get(ticket.user)
+                if queue and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del users[ticket.user]
+                return
+        self.release(ticket)
+
+    def _dispatch_locked(self):
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            elapsed = now - self._refilled_at
+            self._tokens = min(float(self.tokens_per_minute), self._tokens + elapsed * self.tokens_per_minute / 60)
+        self._refilled_at = now
+
+        while self._active < self.concurrency:
+            ticket = self._peek_locked()
+            if ticket is None:
+                return
+            if now < self._paused_until:
+                self._wake_at_locked(self._paused_until)
+                return
+            if self.tokens_per_minute and ticket.cost > self._tokens:
+                # 队首等待令牌补足 (不跳过队首，避免大请求一直被小请求插队)
+                self._wake_at_locked(now + (ticket.cost - self._tokens) * 60 / self.tokens_per_minute)
+                return
+            self._pop_locked(ticket)
+            if self.tokens_per_minute:
+                self._tokens -= ticket.cost
+            self._active += 1
+            ticket.granted = True
+            self._stats["granted"] += 1
+            self._stats["wait_seconds"] += now - ticket.enqueued_at
+            ticket.grant()
+
+    def _peek_locked(self) -> Optional[_Ticket]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                return next(iter(users.values()))[0]
+        return None
+
+    def _pop_locked(self, ticket: _Ticket):
+        users = self._queues[ticket.priority]
+        queue = users[ticket.user]
+        queue.popleft()
+        if queue:
+            # 轮转：该研究员的下一个请求排到同一类别中其他研究员之后
+            users.move_to_end(ticket.user)
+        else:
+            del users[ticket.user]
+
+    def _wake_at_locked(self, when: float):
+        """在 when (monotonic) 时重新尝试派发；已有更早的定时器时不重复创建"""
+        if self._timer is not None and self._timer_at <= when:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(when - time.monotonic(), 0.0), self._on_timer)
+        self._timer.daemon = True
+        self._timer_at = when
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            if self._timer is threading.current_thread():
+                self._timer = None
+            self._dispatch_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = {PRIORITY_NAMES[p]: sum(len(q) for q in users.values()) for p, users in self._queues.items() if users}
+            return {
+                "provider": self.name,
+                "active": self._active,
+                "concurrency": self.concurrency,
+                "queued": queued,
+                "paused_for": max(self._paused_until - time.monotonic(), 0.0),
+                **self._stats,
+            }
+
+
+class LLMScheduler:
+    """进程级调度器：按服务商 (base_url 主机名) 维护 ProviderScheduler，所有研究员共享"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers: Dict[str, ProviderScheduler] = {}
+
+    def provider(self, base_url: str) -> ProviderScheduler:
+        name = httpx.URL(base_url).host or base_url
+        with self._lock:
+            scheduler = self._providers.get(name)
+            if scheduler is None:
+                limits = LLM_PROVIDER_LIMITS.get(name, {})
+                scheduler = ProviderScheduler(
+                    name,
+                    concurrency=int(limits.get("concurrency", LLM_MAX_CONCURRENCY)),
+                    tokens_per_minute=int(limits.get("tokens_per_minute", LLM_TOKENS_PER_MINUTE)),
+                )
+                self._providers[name] = scheduler
+            return scheduler
+
+    def stats(self) -> list:
+        with self._lock:
+            providers = list(self._providers.values())
+        return [scheduler.stats() for scheduler in providers]
+
+
+# =============================================================================
+# httpx Transport：ClientRegistry 的共享连接池经由它发出所有 LLM / Embedding 请求
+# =============================================================================
+def _request_info(request: httpx.Request):
+    user = _user.get() or "-"
+    priority = _priority.get()
+    if priority is None:
+        # 未标注的请求：Embedding 视为后台任务，其余视为交互请求
+        priority = Priority.BACKGROUND if request.url.path.endswith("/embeddings") else Priority.INTERACTIVE
+    try:
+        # 粗略估计输入 token：JSON 请求体约 3 字节 / token (中文 UTF-8 约 1 字 / token，英文约 4 字符 / token)
+        cost = len(request.content) // 3
+    except httpx.RequestNotRead:
+        cost = 0
+    return user, priority, cost
+
+
+def _retry_delay(response: Optional[httpx.Response], attempt: int) -> Optional[float]:
+    """
+    需要重试时返回等待秒数 (response 为 None 表示连接失败)；不需要重试或次数用完时返回 None，把响应交给 SDK。
+    请求只在这里重试：ClientRegistry 创建的客户端设置了 max_retries=0，避免与 SDK 的重试叠加。
+    """
+    if attempt >= LLM_RATE_LIMIT_RETRIES:
+        return None
+    if response is not None and response.status_code not in _RETRY_STATUS + _TRANSIENT_STATUS:
+        return None
+    delay = retry_after_seconds(response.headers) if response is not None else None
+    if delay is None:
+        delay = min(2.0 ** attempt, LLM_BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0)
+    return min(delay, LLM_BACKOFF_MAX_SECONDS)
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """响应体读完 / 关闭时才归还并发名额 (流式生成期间请求一直在途)"""
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, scheduler: ProviderScheduler):
+        self._transport = transport
+        self.scheduler = scheduler
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        user, priority, cost = _request_info(request)
+        attempt = 0
+        while True:
+            ticket = self.scheduler.acquire(user, priority, cost)
+            try:
+                response = self._transport.handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                self.scheduler.release(ticket)
+                delay = _retry_delay(None, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.scheduler.release(ticket)
+                raise
+            delay = _retry_delay(response, attempt)
+            if delay is None:
+                if response.is_closed:
+                    # 响应体已在 Transport 内读完 (无需等待调用方读取)
+                    self.scheduler.release(ticket)
+                else:
+                    response.stream = _ReleasingStream(response.stream, lambda: self.scheduler.release(ticket))
+                return response
+            response.close()
+            if response.status_code in _RETRY_STATUS:
+                # 先暂停派发再归还名额，排队中的请求不会立即撞上同一个限流窗口
+                self.scheduler.backoff(delay)
+                self.scheduler.release(ticket)
+            else:
+                self.scheduler.release(ticket)
+                time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncScheduledTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, scheduler: ProviderScheduler):
+        self._transport = transport
+        self.scheduler = scheduler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        user, priority, cost = _request_info(request)
+        attempt = 0
+        while True:
+            ticket = await self.scheduler.aacquire(user, priority, cost)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                self.scheduler.release(ticket)
+                delay = _retry_delay(None, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.scheduler.release(ticket)
+                raise
+            delay = _retry_delay(response, attempt)
+            if delay is None:
+                if response.is_closed:
+                    self.scheduler.release(ticket)
+                else:
+                    response.stream = _AsyncReleasingStream(response.stream, lambda: self.scheduler.release(ticket))
+                return response
+            await response.aclose()
+            if response.status_code in _RETRY_STATUS:
+                self.scheduler.backoff(delay)
+                self.scheduler.release(ticket)
+            else:
+                self.scheduler.release(ticket)
+                await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# 全局单例
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.config import (
+    CACHE_DIR, SEARCH_BACKEND, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES,
+    SEARCH_STUB_FILE, SEARCH_STUB_LATENCY
+)
+from src.kvstore import DiskKVStore
+
+# 查询首尾的句读符号 (不含 + # 等可能属于术语的符号，如 C++、C#)
+_EDGE_PUNCT = ".,;:!?。，；：！？、…\"'“”‘’"
+
+
+def normalize_query(query: str) -> str:
+    """
+    查询归一化：只忽略大小写、多余空白与首尾的句读符号。
+    词序与符号保持不变 ("graph to sequence" 与 "sequence to graph"、"C++" 与 "C#" 是不同的查询)。
+    """
+    return " ".join(query.casefold().split()).strip(_EDGE_PUNCT + " ")
+
+
+# =============================================================================
+# 搜索后端 (可插拔)
+# =============================================================================
+class SearchBackendError(Exception):
+    """后端不可用 (如缺少 API Key)，错误信息可直接返回给 Agent"""
+
+
+class TavilyBackend:
+    """Tavily 在线搜索。按 API Key 复用同一个客户端，而不是每次调用都重新构建。"""
+
+    name = "tavily"
+
+    def __init__(self, max_results: int = 5):
+        self.max_results = max_results
+        self._clients: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _client(self, api_key: str):
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                from langchain_community.tools.tavily_search import TavilySearchResults
+                # 限制 max_results 以节省 token 和保持响应速度
+                client = TavilySearchResults(tavily_api_key=api_key, max_results=self.max_results)
+                self._clients[api_key] = client
+            return client
+
+    def search(self, query: str) -> List[dict]:
+        api_key = os.getenv("T_SEARCH_API")
+        if not api_key:
+            raise SearchBackendError("System Error: 'T_SEARCH_API' not found in environment variables.")
+        return self._check(self._client(api_key).invoke({"query": query}))
+
+    async def asearch(self, query: str) -> List[dict]:
+        api_key = os.getenv("T_SEARCH_API")
+        if not api_key:
+            raise SearchBackendError("System Error: 'T_SEARCH_API' not found in environment variables.")
+        return self._check(await self._client(api_key).ainvoke({"query": query}))
+
+    @staticmethod
+    def _check(results) -> List[dict]:
+        # Tavily 出错时返回字符串而不是列表
+        if isinstance(results, str):
+            raise SearchBackendError(f"Search execution failed: {results}")
+        return results or []
+
+
+class StubBackend:
+    """
+    本地离线搜索桩：从 JSON 文件 ({归一化查询: [结果...]}) 返回预置结果，未命中时生成确定性的占位结果。
+    用于在无网络环境下跑通搜索链路与基准测试，可通过 latency 模拟真实后端耗时。
+    """
+
+    name = "stub"
+
+    def __init__(self, stub_file: Optional[Path] = None, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.canned: Dict[str, List[dict]] = {}
+        if stub_file and Path(stub_file).exists():
+            with open(stub_file, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            self.canned = {normalize_query(k): v for k, v in raw.items()}
+
+    def search(self, query: str) -> List[dict]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._lookup(query)
+
+    async def asearch(self, query: str) -> List[dict]:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._lookup(query)
+
+    def _lookup(self, query: str) -> List[dict]:
+        key = normalize_query(query)
+        if key in self.canned:
+            return self.canned[key]
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+        return [{
+            "content": f"[stub] No canned result for '{query}'.",
+            "url": f"https://stub.local/search/{digest}",
+        }]
+
+
+def build_backend(name: str = SEARCH_BACKEND):
+    if name == "stub":
+        return StubBackend(SEARCH_STUB_FILE, SEARCH_STUB_LATENCY)
+    if name == "tavily":
+        return TavilyBackend()
+    raise ValueError(f"Unknown search backend: {name}")
+
+
+# =============================================================================
+# 带缓存的搜索服务
+# =============================================================================
+class WebSearchService:
+    """
+    进程级搜索服务：
+    - 归一化查询 -> 磁盘缓存 (TTL + LRU)，跨轮次、跨阶段、跨研究员复用；
+    - 同一查询的并发请求合并为一次后端调用 (in-flight 去重)，同步 / 异步调用方共享同一份 in-flight 表。
+    """
+
+    def __init__(self, backend, store: DiskKVStore):
+        self.backend = backend
+        self.store = store
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_key(self, normalized: str) -> str:
+        return f"{self.backend.name}:{normalized}"
+
+    def _begin(self, query: str):
+        """
+        返回 (key, cached, future, is_leader)：
+        命中缓存时 cached 非空；否则 is_leader 表示由本次调用请求后端，其余调用等待 future。
+        """
+        key = self._cache_key(normalize_query(query))
+
+        # 查缓存与登记 in-flight 在同一临界区内：先写缓存、后移除 in-flight (见 _finish)，
+        # 因此并发的相同查询要么命中缓存，要么等待进行中的请求，不会重复调用后端
+        with self._lock:
+            cached = self.store.get(key)
+            if cached is not None:
+                self.hits += 1
+                return key, json.loads(cached), None, False
+
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                # 相同查询正在进行中，直接等待其结果
+                self.hits += 1
+        return key, None, future, is_leader
+
+    def _finish(self, key: str, future: Future, results: List[dict] = None, error: Exception = None):
+        try:
+            if error is not None:
+                future.set_exception(error)
+                return
+            # 空结果不缓存，留给下次重试
+            if results:
+                self.store.set(key, json.dumps(results, ensure_ascii=False))
+            future.set_result(results)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def search(self, query: str) -> List[dict]:
+        key, cached, future, is_leader = self._begin(query)
+        if cached is not None:
+            return cached
+        if not is_leader:
+            return future.result()
+
+        try:
+            results = self.backend.search(query)
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, results)
+        return results
+
+    async def asearch(self, query: str) -> List[dict]:
+        """异步版本：后端没有原生异步接口时放到线程池执行，不阻塞事件循环"""
+        key, cached, future, is_leader = self._begin(query)
+        if cached is not None:
+            return cached
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            if hasattr(self.backend, "asearch"):
+                results = await self.backend.asearch(query)
+            else:
+                results = await asyncio.to_thread(self.backend.search, query)
+        except BaseException as e:
+            # 包括任务被取消：必须释放 in-flight 条目，否则等待同一查询的调用方会一直挂起
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, results)
+        return results
+
+
+_service: Optional[WebSearchService] = None
+_service_lock = threading.Lock()
+
+
+def get_search_service() -> WebSearchService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            store = DiskKVStore(
+                CACHE_DIR / "search_cache.sqlite",
+                ttl=SEARCH_CACHE_TTL,
+                max_entries=SEARCH_CACHE_MAX_ENTRIES
+            )
+            _service = WebSearchService(build_backend(), store)
+        return _service
@@ -0,0 +1,56 @@
+from typing import Any, Dict
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 工具输出在事件中的最大展示长度 (完整结果仍会交给 LLM)
+TOOL_OUTPUT_PREVIEW_CHARS = 500
+
+
+class EventQueueHandler(BaseCallbackHandler):
+    """
+    把 Agent 执行过程转换为事件流写入队列，供 (异步) 生成器消费。
+    同步接口使用 queue.Queue (跨线程)，异步接口使用 asyncio.Queue (回调均在事件循环线程内执行)：
+    - llm_start : 新一次 LLM 调用开始 (工具调用之后模型会重新生成)
+    - token     : LLM 生成的文本 token (工具调用参数的 chunk 不会产生 token 事件)
+    - tool_start / tool_end / tool_error : 工具调用事件，与 token 分开
+    """
+
+    # 工具可能在线程池中并发执行，回调直接在调用线程内执行即可 (队列本身线程安全)
+    run_inline = True
+
+    def __init__(self, events: Any):
+        # queue.Queue 或 asyncio.Queue，只调用 put_nowait
+        self.events = events
+        self._tool_names: Dict[UUID, str] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any):
+        self.events.put_nowait({"type": "llm_start", "run_id": str(run_id)})
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        if token:
+            self.events.put_nowait({"type": "token", "text": token, "run_id": str(run_id)})
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any):
+        name = (serialized or {}).get("name", "tool")
+        self._tool_names[run_id] = name
+        self.events.put_nowait({"type": "tool_start", "tool": name, "input": input_str, "run_id": str(run_id)})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        text = str(getattr(output, "content", output))
+        if len(text) > TOOL_OUTPUT_PREVIEW_CHARS:
+            text = text[:TOOL_OUTPUT_PREVIEW_CHARS] + " ..."
+        self.events.put_nowait({
+            "type": "tool_end",
+            "tool": self._tool_names.pop(run_id, "tool"),
+            "output": text,
+            "run_id": str(run_id),
+        })
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self.events.put_nowait({
+            "type": "tool_error",
+            "tool": self._tool_names.pop(run_id, "tool"),
+            "output": str(error),
+            "run_id": str(run_id),
+        })
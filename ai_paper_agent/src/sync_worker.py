@@ -0,0 +1,371 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_text_splitters import CharacterTextSplitter
+
+from src.config import RES_DIR, FILE_MEMORY, SYNC_DEBOUNCE_SECONDS
+from src.fsutil import match_mode
+from src.vector_cache import vector_cache, index_size_bytes, current_index_dir, CURRENT_FILE
+from src.scheduler import request_context, Priority
+
+# FAISS 索引目录名 (位于 res/{username}/ 下)
+INDEX_DIR_NAME = "faiss_index"
+# 增量同步清单：记录每个笔记文件的内容哈希与其在索引中的向量 ID
+MANIFEST_NAME = "manifest.json"
+# 索引版本子目录的前缀 (faiss_index/v*/index.faiss + index.pkl)
+VERSION_PREFIX = "v"
+
+
+def is_note_file(md_path: Path, session_dir: Path) -> bool:
+    """
+    判断一个路径是否是需要索引的研究笔记。
+    排除系统文件 (memory.md)、隐藏目录 (如 .silverbullet) 以及 SilverBullet 插件库。
+    """
+    if md_path.suffix != ".md":
+        return False
+    if md_path.name == FILE_MEMORY:
+        return False
+    try:
+        parts = md_path.relative_to(session_dir).parts
+    except ValueError:
+        return False
+    if any(part.startswith('.') for part in parts):
+        return False
+    if "_plug" in parts or "Library" in parts:
+        return False
+    return True
+
+
+class _NoteEventHandler(FileSystemEventHandler):
+    """watchdog 事件回调：只关心笔记文件的增删改，其余事件直接忽略"""
+
+    def __init__(self, worker: "KnowledgeSyncWorker"):
+        super().__init__()
+        self.worker = worker
+
+    # 只响应会改变内容的事件；读取文件产生的 opened / closed_no_write 事件需要忽略，否则同步自身会触发同步
+    MUTATING_EVENTS = {"created", "modified", "deleted", "moved", "closed"}
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in self.MUTATING_EVENTS:
+            return
+        paths = [getattr(event, "src_path", None), getattr(event, "dest_path", None)]
+        for raw in paths:
+            if raw and is_note_file(Path(raw), self.worker.session_dir):
+                self.worker.request_sync()
+                return
+
+
+class KnowledgeSyncWorker:
+    """
+    研究员专属的知识库后台同步器。
+    - 通过 watchdog 监听 res/{username} (SilverBullet 实时编辑的目录)；
+    - 对连续的编辑做去抖 (debounce)，静默一段时间后才触发同步；
+    - 基于内容哈希增量更新 FAISS：只对新增/修改的笔记调用 Embedding，删除的笔记从索引中移除；
+    - 通过 status() 向侧边栏报告进度与上次同步时间，全程不阻塞 Streamlit 的 rerun。
+    """
+
+    def __init__(self, session_id: str, debounce_seconds: float = SYNC_DEBOUNCE_SECONDS):
+        self.session_id = session_id
+        self.session_dir = (RES_DIR / session_id).resolve()
+        self.index_path = self.session_dir / INDEX_DIR_NAME
+        self.manifest_path = self.index_path / MANIFEST_NAME
+        self.debounce_seconds = debounce_seconds
+
+        self.embeddings = None
+
+        self._lock = threading.Lock()          # 保护状态字段
+        self._sync_lock = threading.Lock()     # 保证同一时间只有一个同步在执行
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._last_event_at = 0.0
+        self._pending = False
+        self._thread: Optional[threading.Thread] = None
+        self._observer: Optional[Observer] = None
+
+        self._status = {
+            "state": "idle",      # idle / pending / indexing / error / stopped
+            "done": 0,
+            "total": 0,
+            "last_sync": None,    # time.time() 时间戳
+            "message": "",
+        }
+
+    # -------------------------------------------------------------------------
+    # 生命周期
+    # -------------------------------------------------------------------------
+    def bind_embeddings(self, embeddings):
+        """绑定 (或更新) 用于向量化的 Embedding 客户端，用户切换 API 配置时会被重新调用"""
+        with self._lock:
+            self.embeddings = embeddings
+            pending = self._pending
+        # 绑定前请求的同步 (如启动时的对账) 一直保留着，现在执行
+        if pending:
+            self._wakeup.set()
+
+    def start(self):
+        """启动目录监听与后台线程 (幂等)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+
+            self._observer = Observer()
+            self._observer.schedule(_NoteEventHandler(self), str(self.session_dir), recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+
+            self._thread = threading.Thread(
+                target=self._run, name=f"kb-sync-{self.session_id}", daemon=True
+            )
+            self._thread.start()
+        # 启动时做一次对账，补上离线期间的笔记变化
+        self.request_sync()
+        print(f"[System] Knowledge sync worker started for User {self.session_id}.")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._observer:
+            self._observer.stop()
+        self._set_status(state="stopped")
+
+    def request_sync(self):
+        """标记需要同步 (非阻塞)。实际同步会在去抖窗口结束后由后台线程执行。"""
+        with self._lock:
+            self._pending = True
+            self._last_event_at = time.time()
+            if self._status["state"] != "indexing":
+                self._status["state"] = "pending"
+        self._wakeup.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            return dict(self._status)
+
+    # -------------------------------------------------------------------------
+    # 后台循环
+    # -------------------------------------------------------------------------
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            if self._stopped.is_set():
+                break
+            # 去抖：等待编辑 "安静" 下来再同步
+            while True:
+                with self._lock:
+                    quiet_for = time.time() - self._last_event_at
+                if quiet_for >= self.debounce_seconds or self._stopped.is_set():
+                    break
+                time.sleep(self.debounce_seconds - quiet_for)
+
+            with self._lock:
+                self._wakeup.clear()
+                if self.embeddings is None:
+                    # 保留待同步标记，bind_embeddings 时再唤醒
+                    self._status.update(state="pending", message="等待 Agent 初始化后再同步。")
+                    continue
+                self._pending = False
+            self.sync_now()
+
+    def _set_status(self, **fields):
+        with self._lock:
+            self._status.update(fields)
+
+    # -------------------------------------------------------------------------
+    # 增量同步核心逻辑
+    # -------------------------------------------------------------------------
+    def _load_manifest(self) -> Dict[str, dict]:
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"[Warning] Corrupted sync manifest for {self.session_id}, rebuilding: {e}")
+        return {}
+
+    def _save_manifest(self, manifest: Dict[str, dict]):
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _save_index(self, store: FAISS) -> Path:
+        """
+        把索引写入新的版本子目录，再原子替换 CURRENT 指针，返回新版本目录。
+        两个文件同属一个版本，读取方 (见 vector_cache.current_index_dir) 不会读到新旧混合的一对；
+        其他会话以 mmap 方式映射着的旧文件也不会被原地覆盖。
+        """
+        self.index_path.mkdir(parents=True, exist_ok=True)
+        previous = current_index_dir(self.index_path)
+        version_dir = Path(tempfile.mkdtemp(dir=self.index_path, prefix=VERSION_PREFIX))
+        try:
+            match_mode(version_dir, self.index_path, directory=True)
+            store.save_local(str(version_dir))
+            pointer = self.index_path / CURRENT_FILE
+            fd, tmp_path = tempfile.mkstemp(dir=self.index_path, prefix=f".{CURRENT_FILE}.", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(version_dir.name)
+            match_mode(tmp_path, pointer)
+            os.replace(tmp_path, pointer)
+        except Exception:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            raise
+        self._prune_versions(keep={version_dir, previous})
+        return version_dir
+
+    def _prune_versions(self, keep: set):
+        """
+        删除更早的版本 (保留上一版本，供刚解析完指针、尚未打开文件的读取方使用)，以及旧布局下直接位于
+        faiss_index/ 的索引文件。仍被映射而无法删除的文件 (Windows) 留到下次同步再清理。
+        """
+        for child in self.index_path.iterdir():
+            if child.is_dir() and child.name.startswith(VERSION_PREFIX) and child not in keep:
+                shutil.rmtree(child, ignore_errors=True)
+        if self.index_path not in keep:
+            for name in ("index.faiss", "index.pkl"):
+                try:
+                    (self.index_path / name).unlink()
+                except OSError:
+                    pass
+
+    def _scan_notes(self) -> Dict[str, Path]:
+        notes = {}
+        for md_path in self.session_dir.glob("**/*.md"):
+            if is_note_file(md_path, self.session_dir):
+                notes[md_path.relative_to(self.session_dir).as_posix()] = md_path
+        return notes
+
+    def _current_store(self, manifest: Dict[str, dict]):
+        """
+        从硬盘加载一份可写的向量库 (共享缓存中的是只读 mmap 版本，不能原地修改)。
+        旧版 (无清单) 的全量索引无法增量维护，直接丢弃重建。
+        """
+        index_dir = current_index_dir(self.index_path)
+        if manifest and index_dir is not None:
+            try:
+                return FAISS.load_local(
+                    str(index_dir),
+                    self.embeddings,
+                    allow_dangerous_deserialization=True
+                )
+            except Exception as e:
+                print(f"[Warning] Failed to load vector store for {self.session_id}, rebuilding: {e}")
+                manifest.clear()
+        else:
+            manifest.clear()
+        return None
+
+    def sync_now(self) -> str:
+        """
+        立即执行一次增量同步 (阻塞)，返回可展示给用户的结果描述。
+        后台线程与手动调用共用此方法。
+        """
+        if self.embeddings is None:
+            return "知识库同步失败: Embedding 客户端未初始化。"
+
+        # 批量向量化按后台优先级排队，不挤占研究员的交互对话
+        with self._sync_lock, request_context(self.session_id, Priority.BACKGROUND):
+            self._set_status(state="indexing", done=0, total=0, message="扫描笔记变化...")
+            try:
+                result = self._sync_incremental()
+                self._set_status(state="idle", last_sync=time.time(), message=result)
+            except Exception as e:
+                result = f"知识库同步失败: {str(e)}"
+                self._set_status(state="error", message=result)
+            print(f"[System] User {self.session_id}: {result}")
+            return result
+
+    def _sync_incremental(self) -> str:
+        manifest = self._load_manifest()
+        store = self._current_store(manifest)
+        notes = self._scan_notes()
+
+        if not notes and not manifest:
+            return "没有找到任何可同步的 Markdown 笔记。"
+
+        # 1. 对比内容哈希，找出新增/修改/删除的笔记
+        changed: List[tuple] = []
+        for rel_path, md_path in notes.items():
+            try:
+                text = md_path.read_text(encoding='utf-8')
+            except Exception as load_err:
+                print(f"[Warning] Failed to load {md_path}: {load_err}")
+                continue
+            digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            if manifest.get(rel_path, {}).get("hash") != digest:
+                changed.append((rel_path, md_path, text, digest))
+
+        removed = [rel for rel in manifest if rel not in notes]
+        stale_ids = []
+        for rel_path in removed + [c[0] for c in changed]:
+            stale_ids.extend(manifest.get(rel_path, {}).get("ids", []))
+
+        if not changed and not removed:
+            return f"知识库已是最新 ({len(manifest)} 个笔记)。"
+
+        # 2. 删除过期向量
+        if store is not None and stale_ids:
+            store.delete(stale_ids)
+        for rel_path in removed:
+            manifest.pop(rel_path, None)
+
+        # 3. 逐文件向量化新增/修改的笔记，便于报告进度
+        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        self._set_status(total=len(changed), message=f"正在索引 {len(changed)} 个笔记...")
+        for done, (rel_path, md_path, text, digest) in enumerate(changed, 1):
+            chunks = text_splitter.split_documents(
+                [Document(page_content=text, metadata={"source": str(md_path)})]
+            )
+            ids = [f"{rel_path}::{digest[:12]}::{i}" for i in range(len(chunks))]
+            if chunks:
+                if store is None:
+                    store = FAISS.from_documents(chunks, self.embeddings, ids=ids)
+                else:
+                    store.add_documents(chunks, ids=ids)
+            manifest[rel_path] = {"hash": digest, "ids": ids}
+            self._set_status(done=done)
+
+        # 4. 持久化索引与清单，并把新版本发布到进程级共享缓存
+        if store is not None:
+            index_dir = self._save_index(store)
+            self._save_manifest(manifest)
+            vector_cache.put(self.session_id, store, index_size_bytes(index_dir))
+
+        return (f"同步成功！更新 {len(changed)} 个、移除 {len(removed)} 个笔记，"
+                f"知识库共 {len(manifest)} 个有效笔记文件。")
+
+
+# =============================================================================
+# 进程级注册表：每位研究员一个 Worker，所有浏览器标签页共享
+# =============================================================================
+_workers: Dict[str, KnowledgeSyncWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def get_sync_worker(session_id: str) -> KnowledgeSyncWorker:
+    with _workers_lock:
+        worker = _workers.get(session_id)
+        if worker is None:
+            worker = KnowledgeSyncWorker(session_id)
+            _workers[session_id] = worker
+        return worker
+
+
+def peek_sync_worker(session_id: str) -> Optional[KnowledgeSyncWorker]:
+    """仅查询，不创建 (用于侧边栏在 Agent 初始化前渲染)"""
+    with _workers_lock:
+        return _workers.get(session_id)
@@ -1,19 +1,44 @@
 import os
-import fitz  # PyMuPDF
+import io
+import asyncio
+import functools
+import tempfile
+import threading
 from pathlib import Path
+from typing import Dict, Tuple
 from langchain.tools import StructuredTool
-from src.config import DOCS_DIR
-from langchain_community.tools.tavily_search import TavilySearchResults
+from src.library import paper_library
+from src.fsutil import match_mode
+from src.paper_index import get_paper_index
+from src.figures import get_figure_store
+from src.search import get_search_service, SearchBackendError
+from src.patching import EditConflict, apply_unified_diff, replace_section
+
+
+def _in_thread(func):
+    """把阻塞的工具函数 (文件 I/O、PDF 解析) 包装为协程，在线程池中执行，不阻塞事件循环"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
 
 class ToolFactory:
     """
     工具工厂：为每个会话（研究员）动态生成绑定了特定目录的工具集。
     实现多用户环境下的文件读写隔离、资源保护及路径安全。
     """
-    def __init__(self, session_dir: Path):
+    def __init__(self, session_dir: Path, on_file_written=None):
         # 此时 session_dir 已经被 gui.py 锁定为 res/{username}
         self.session_dir = session_dir.resolve()
+        # 文件写入成功后的回调 (相对路径)，用于推送里程碑事件 (见 PhaseStateStore)
+        self.on_file_written = on_file_written
+        # 只读工具可能被并发执行，写入操作必须串行
+        self._write_lock = threading.Lock()
         self.figures_dir = self.session_dir / "figures"
+        self.figures = get_figure_store(self.session_dir)
+        # 本会话读过的论文：显示名 -> 内容哈希 (写入会话检查点，恢复时据此预热解析缓存)
+        self.papers_read: Dict[str, str] = {}
         
         # 确保当前研究员的专属图片存储目录存在
         if not self.figures_dir.exists():
@@ -40,9 +65,89 @@ class ToolFactory:
         
         return target_path
 
+    def _atomic_write(self, file_path: Path, content: str, expected_mtime: float = None):
+        """
+        先写入同目录下的隐藏临时文件再 os.replace，读者 (GUI、同步 Worker) 不会看到写了一半的文件。
+        expected_mtime 不为空时，若文件在读取后被外部 (如 SilverBullet) 修改过，则报告冲突而不覆盖。
+        """
+        if not file_path.parent.exists():
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            if expected_mtime is not None and file_path.exists() and file_path.stat().st_mtime != expected_mtime:
+                raise EditConflict(f"Conflict: {file_path.name} was modified by someone else while editing. Re-read it and retry.")
+            match_mode(tmp_path, file_path)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # 笔记引用到的论文图片此时才从 PDF 中提取 (供笔记本 / GUI 预览)
+        if file_path.suffix == ".md":
+            self.figures.materialize_references(content)
+        if self.on_file_written:
+            self.on_file_written(os.path.relpath(file_path, self.session_dir))
+
+    def _edit_file(self, file_name: str, transform, create: bool = False) -> str:
+        """读取 -> 变换 -> 原子写回，整个过程持有写锁；返回相对路径"""
+        file_path = self._validate_path(file_name)
+        with self._write_lock:
+            if file_path.exists():
+                mtime = file_path.stat().st_mtime
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    original = f.read()
+            elif create:
+                mtime, original = None, ""
+            else:
+                raise EditConflict(f"Conflict: {file_name} does not exist. Use write_file_tool to create it.")
+            self._atomic_write(file_path, transform(original), expected_mtime=mtime)
+        return os.path.relpath(file_path, self.session_dir)
+
+    def read_paper_text(self, pdf_filename: str) -> Tuple[str, int, int]:
+        """
+        逐页读取论文正文，返回 (正文, 页数, 登记的图片数)；read_paper_tool 与多论文阅读流水线 (src.reading) 共用。
+        图片只登记到当前研究员的 res/{username}/figures 清单中，笔记引用到某张图时才提取原图。
+        """
+        sha = paper_library.content_hash(pdf_filename)
+        if sha is None:
+            raise FileNotFoundError(pdf_filename)
+        # 逐页流式读取 (冷启动时解析完一页就处理一页)，正文直接写入缓冲区
+        body = io.StringIO()
+        figure_entries = {}
+        total_pages = 0
+
+        for page in paper_library.iter_pages(pdf_filename):
+            entries = self.figures.page_entries(pdf_filename, sha, page)
+            figure_entries.update(entries)
+            # 返回相对路径（相对于用户 session 根目录），笔记中引用该路径时原图自动落盘
+            page_image_notes = [
+                f"\n[Image Reference: Figure available at figures/{file_name} ({entry['width']}x{entry['height']} px)]"
+                for file_name, entry in entries.items()
+            ]
+            if total_pages:
+                body.write("\n")
+            body.write(f"\n--- Page {page['number']} ---\n{page['text']}\n" + "\n".join(page_image_notes))
+            total_pages += 1
+
+        self.figures.register(figure_entries)
+        self.papers_read[pdf_filename] = sha
+        return body.getvalue(), total_pages, len(figure_entries)
+
+    def write_note(self, file_name: str, content: str) -> str:
+        """在研究员目录内原子写入一个文件 (与 write_file_tool 相同的路径校验与写入事件)；返回相对路径"""
+        file_path = self._validate_path(file_name)
+        with self._write_lock:
+            self._atomic_write(file_path, content)
+        return os.path.relpath(file_path, self.session_dir)
+
     def get_tools(self):
         """
         返回绑定了当前用户专属目录 (session_dir) 的 LangChain 工具列表。
+        每个工具同时提供同步实现与异步实现 (coroutine)，供 invoke / ainvoke 两条路径使用。
         """
 
         # --- 1. 定义具体的工具函数逻辑 (闭包封装) ---
@@ -51,62 +156,19 @@ class ToolFactory:
             """
             读取论文 PDF 内容。
             逻辑：
-            1. 从全局公共 docs 目录读取原始 PDF 文件。
-            2. 提取全文文本内容。
-            3. 将提取的图片保存到当前研究员的专属 res/{username}/figures 目录，实现资源物理隔离。
-            """
-            # 默认去全局公共 DOCS_DIR 找文件
-            pdf_path = DOCS_DIR / pdf_filename
-            
-            if not pdf_path.exists():
+            1. 从全局公共论文库 (docs 目录，上传的论文按内容哈希去重存放) 定位原始 PDF 文件。
+            2. 取出逐页文本：上传后已在后台预解析的直接命中缓存，否则现在解析 (结果同样缓存)。
+            3. 图片只登记到当前研究员的 res/{username}/figures 清单中，笔记引用到某张图时才提取原图。
+            """
+            if paper_library.resolve(pdf_filename) is None:
                 return f"Error: 文件 {pdf_filename} 在公共 docs 目录下未找到。"
 
             try:
-                full_text = []
-                image_counter = 0
-                pdf_name_stem = pdf_path.stem
-
-                with fitz.open(pdf_path) as doc:
-                    total_pages = len(doc)
-                    for page_index, page in enumerate(doc):
-                        page_image_notes = []
-                        
-                        # --- 图片提取逻辑 (完全保留原版细节) ---
-                        try:
-                            image_list = page.get_images(full=True)
-                            if image_list:
-                                for img_index, img in enumerate(image_list):
-                                    try:
-                                        xref = img[0]
-                                        base_image = doc.extract_image(xref)
-                                        image_bytes = base_image["image"]
-                                        image_ext = base_image["ext"]
-                                        
-                                        # 构造唯一文件名并保存到【当前研究员的】figures 目录
-                                        image_filename = f"{pdf_name_stem}_p{page_index + 1}_img{img_index + 1}.{image_ext}"
-                                        image_save_path = self.figures_dir / image_filename
-                                        
-                                        with open(image_save_path, "wb") as f:
-                                            f.write(image_bytes)
-                                        
-                                        image_counter += 1
-                                        # 返回相对路径（相对于用户 session 根目录），方便 Markdown 进行本地预览
-                                        rel_path = os.path.relpath(image_save_path, self.session_dir)
-                                        page_image_notes.append(f"\n[Image Reference: Figure saved at {rel_path}]")
-                                    except Exception: 
-                                        continue
-                        except Exception:
-                            pass
-                        
-                        # --- 文本提取逻辑 ---
-                        text = page.get_text("text")
-                        clean_text = text.strip()
-                        page_content = f"\n--- Page {page_index + 1} ---\n{clean_text}\n" + "\n".join(page_image_notes)
-                        full_text.append(page_content)
-
-                # 构造并返回包含图片提取信息的摘要摘要
-                summary_info = f"[System Note: Successfully read {total_pages} pages. Extracted {image_counter} images to your user directory: {self.figures_dir}.]\n\n"
-                return summary_info + "\n".join(full_text)
+                body, total_pages, figure_count = self.read_paper_text(pdf_filename)
+                # 构造并返回包含图片信息的摘要
+                summary_info = (f"[System Note: Successfully read {total_pages} pages. Indexed {figure_count} images; "
+                                f"an image is extracted to your user directory ({self.figures_dir}) when a note references its path.]\n\n")
+                return summary_info + body
             except Exception as e:
                 return f"Critical Error processing PDF '{pdf_filename}': {str(e)}"
 
@@ -115,22 +177,53 @@ class ToolFactory:
             将内容写入 Markdown 文件，严格限制在当前用户的会话目录内。
             """
             try:
-                # 执行路径安全校验
-                file_path = self._validate_path(file_name)
-                
-                # 确保父目录存在（如果是子路径）
-                if not file_path.parent.exists():
-                    file_path.parent.mkdir(parents=True, exist_ok=True)
-
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                
-                # 返回相对路径给 Agent 确认
-                rel_path = os.path.relpath(file_path, self.session_dir)
+                # 执行路径安全校验并原子写入，返回相对路径给 Agent 确认
+                rel_path = self.write_note(file_name, content)
                 return f"Successfully wrote content to {rel_path}"
             except Exception as e:
                 return f"Error writing file: {str(e)}"
 
+        def append_to_file_func(file_name: str, content: str) -> str:
+            """
+            在文件末尾追加内容 (文件不存在时创建)，适合 memory.md 这类日志式文件。
+            """
+            def transform(original: str) -> str:
+                if original and not original.endswith("\n"):
+                    original += "\n"
+                return original + content + ("" if content.endswith("\n") else "\n")
+
+            try:
+                rel_path = self._edit_file(file_name, transform, create=True)
+                return f"Successfully appended {len(content)} characters to {rel_path}"
+            except EditConflict as e:
+                return str(e)
+            except Exception as e:
+                return f"Error appending to file: {str(e)}"
+
+        def replace_section_func(file_name: str, heading: str, content: str) -> str:
+            """
+            替换 Markdown 文件中某个标题下的正文 (到下一个同级或更高级标题为止)，标题行保持不变。
+            """
+            try:
+                rel_path = self._edit_file(file_name, lambda original: replace_section(original, heading, content))
+                return f"Successfully replaced section '{heading}' in {rel_path}"
+            except EditConflict as e:
+                return str(e)
+            except Exception as e:
+                return f"Error replacing section: {str(e)}"
+
+        def apply_patch_func(file_name: str, patch: str) -> str:
+            """
+            对文件应用 unified diff。任一 hunk 与当前内容不匹配时报告冲突，文件保持不变。
+            """
+            try:
+                rel_path = self._edit_file(file_name, lambda original: apply_unified_diff(original, patch), create=True)
+                return f"Successfully applied patch to {rel_path}"
+            except EditConflict as e:
+                return str(e)
+            except Exception as e:
+                return f"Error applying patch: {str(e)}"
+
         def read_file_func(file_name: str) -> str:
             """
             从当前用户的专属会话目录读取文件。
@@ -147,50 +240,102 @@ class ToolFactory:
 
         def web_search_func(query: str) -> str:
             """
-            使用 Tavily API 进行网络搜索，查新学术热点或寻找理论引用。
+            进行网络搜索，查新学术热点或寻找理论引用。
+            结果经过进程级磁盘缓存，相同 (或仅轻微改写) 的查询不会重复请求后端。
             """
-            api_key = os.getenv("T_SEARCH_API")
-            if not api_key: 
-                return "System Error: 'T_SEARCH_API' not found in environment variables."
-            
             try:
-                # 限制 max_results 以节省 token 和保持响应速度
-                tool = TavilySearchResults(tavily_api_key=api_key, max_results=5)
-                results = tool.invoke({"query": query})
-                
-                if not results:
-                    return f"No results found for query: {query}"
-                
-                # 保留原有的搜索结果格式化逻辑
-                formatted_output = [f"Search Results for '{query}':\n"]
-                for idx, res in enumerate(results, 1):
-                    content = res.get('content', 'No content')
-                    url = res.get('url', 'No URL')
-                    formatted_output.append(f"Source {idx}: {content}\n(Link: {url})\n")
-                
-                return "\n".join(formatted_output)
+                return format_search_results(query, get_search_service().search(query))
+            except SearchBackendError as e:
+                return str(e)
             except Exception as e:
                 return f"Search execution failed: {str(e)}"
 
+        async def web_search_coro(query: str) -> str:
+            try:
+                return format_search_results(query, await get_search_service().asearch(query))
+            except SearchBackendError as e:
+                return str(e)
+            except Exception as e:
+                return f"Search execution failed: {str(e)}"
+
+        def format_search_results(query: str, results: list) -> str:
+            if not results:
+                return f"No results found for query: {query}"
+
+            # 保留原有的搜索结果格式化逻辑
+            formatted_output = [f"Search Results for '{query}':\n"]
+            for idx, res in enumerate(results, 1):
+                content = res.get('content', 'No content')
+                url = res.get('url', 'No URL')
+                formatted_output.append(f"Source {idx}: {content}\n(Link: {url})\n")
+
+            return "\n".join(formatted_output)
+
+        def search_papers_func(query: str) -> str:
+            """
+            在公共论文库 (docs 目录下的全部 PDF) 中做全文检索，返回按相关度排序的 (论文, 页码, 片段)。
+            """
+            try:
+                hits = get_paper_index().search(query)
+            except Exception as e:
+                return f"Paper search failed: {str(e)}"
+            if not hits:
+                if get_paper_index().stats()["syncing"]:
+                    return f"No papers found for query: {query} (the paper index is still being built, retry later)"
+                return f"No papers found for query: {query}"
+
+            formatted_output = [f"Paper Search Results for '{query}':\n"]
+            for idx, hit in enumerate(hits, 1):
+                formatted_output.append(f"Hit {idx}: {hit['paper']} (page {hit['page']})\n{hit['snippet']}\n")
+            return "\n".join(formatted_output)
+
         # --- 2. 包装并返回 StructuredTool 列表 ---
         return [
             StructuredTool.from_function(
                 func=read_paper_func,
+                coroutine=_in_thread(read_paper_func),
                 name="read_paper_tool",
                 description="Useful for reading the content of a research paper PDF file. Input should be the filename of the pdf (e.g., 'paper.pdf') located in the docs directory."
             ),
+            StructuredTool.from_function(
+                func=search_papers_func,
+                coroutine=_in_thread(search_papers_func),
+                name="search_papers_tool",
+                description="Full-text search over every paper PDF in the shared docs library. Input should be keywords (e.g., 'client drift'). Returns ranked (paper, page, snippet) hits; use read_paper_tool to read a hit in full."
+            ),
             StructuredTool.from_function(
                 func=write_file_func,
+                coroutine=_in_thread(write_file_func),
                 name="write_file_tool",
-                description="Useful for writing content to a markdown file in the resource directory. Input should be the file_name (e.g., 'base.md', 'innov1.md') and the full content string."
+                description="Useful for writing content to a markdown file in the resource directory. Input should be the file_name (e.g., 'base.md', 'innov1.md') and the full content string. Use it to create new files; prefer the edit tools below to change existing ones."
+            ),
+            StructuredTool.from_function(
+                func=append_to_file_func,
+                coroutine=_in_thread(append_to_file_func),
+                name="append_to_file_tool",
+                description="Append content to the end of a markdown file (created if missing). Use it for log-style updates such as new entries in memory.md instead of rewriting the whole file."
+            ),
+            StructuredTool.from_function(
+                func=replace_section_func,
+                coroutine=_in_thread(replace_section_func),
+                name="replace_section_tool",
+                description="Replace the body of one markdown section in an existing file. Input: file_name, heading (the exact heading text, with or without '#'), and the new section body (without the heading line). The section ends at the next heading of the same or higher level."
+            ),
+            StructuredTool.from_function(
+                func=apply_patch_func,
+                coroutine=_in_thread(apply_patch_func),
+                name="apply_patch_tool",
+                description="Apply a unified diff (with '@@ -a,b +c,d @@' hunks and a few lines of context) to a file. Use it for small revisions of an existing file. Reports a conflict and leaves the file unchanged if the context does not match."
             ),
             StructuredTool.from_function(
                 func=read_file_func,
+                coroutine=_in_thread(read_file_func),
                 name="read_file_tool",
                 description="Useful for reading existing markdown files from the resource directory."
             ),
             StructuredTool.from_function(
                 func=web_search_func,
+                coroutine=web_search_coro,
                 name="web_search_tool",
                 description="Useful for searching the internet to check if an idea already exists (Novelty Check) or to find theoretical references."
             )
@@ -0,0 +1,160 @@
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+from src.config import AGENT_WORKERS
+
+
+class TurnJob:
+    """
+    一轮 Agent 对话任务 (在 TurnPool 的 Worker 线程中执行，与 Streamlit 脚本线程无关)。
+    事件格式同 ResearchAgent.chat_events，按顺序追加到任务日志中；订阅方可以从头重放再继续跟随，
+    因此 GUI rerun、刷新页面后都能重新接入同一轮对话，已生成的内容不会丢失。
+    """
+
+    def __init__(self, session_id: str, user_text: str):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.user_text = user_text
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.state = "queued"     # queued / running / done / error
+        self.output = ""
+        # GUI 已把结果写入对话记录 (见 TurnPool.collect)
+        self.collected = False
+        self._events: List[dict] = []
+        self._cond = threading.Condition()
+
+    # 作为 EventQueueHandler 的事件队列 (Agent 回调可能来自多个工具线程)
+    def put_nowait(self, event: dict):
+        with self._cond:
+            self._events.append(event)
+            if event["type"] == "done":
+                self.state, self.output = "done", event["output"]
+                self.finished_at = time.time()
+            elif event["type"] == "error":
+                self.state, self.output = "error", event["text"]
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    put = put_nowait
+
+    def _mark_running(self):
+        with self._cond:
+            self.state = "running"
+            self._cond.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "error")
+
+    def events(self, start: int = 0, idle_timeout: Optional[float] = None) -> Iterator[Optional[dict]]:
+        """
+        从第 start 个事件开始产出，任务结束后停止。
+        idle_timeout 秒内没有新事件时产出 None，调用方可借此刷新界面 (Streamlit 只在渲染元素时响应中断)。
+        """
+        index = start
+        while True:
+            with self._cond:
+                if index >= len(self._events) and not self.finished:
+                    self._cond.wait(idle_timeout)
+                batch = self._events[index:]
+                finished = self.finished
+            if not batch and not finished:
+                yield None
+                continue
+            yield from batch
+            index += len(batch)
+            if finished and index >= len(self._events):
+                return
+
+
+class TurnPool:
+    """
+    进程级的 Agent 对话 Worker 池：固定数量的线程为所有研究员执行对话轮次，超出的任务排队。
+    每个研究员同一时间只有一轮对话在执行 (同一 Agent 共享对话历史)，并保留最近一轮任务供 GUI 重新接入。
+    """
+
+    def __init__(self, max_workers: int = AGENT_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-turn")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, TurnJob] = {}
+        self._latest: Dict[str, str] = {}     # session_id -> 最近一轮的 job_id
+
+    def submit(self, agent, user_text: str, use_cache: bool = True,
+               runner: Optional[Callable[[TurnJob], None]] = None) -> TurnJob:
+        """
+        提交一轮对话；runner 不为空时由它代替 agent.run_turn 执行这一轮 (如多论文阅读流水线)，
+        它需要按相同的事件格式写入 job 并以 done / error 结束。
+        """
+        with self._lock:
+            current = self._latest_locked(agent.session_id)
+            if current is not None and not current.finished:
+                raise RuntimeError(f"User {agent.session_id} already has a running turn ({current.job_id})")
+            # 同一研究员更早的任务不会再被接入，只保留最近一轮
+            if current is not None:
+                del self._jobs[current.job_id]
+            job = TurnJob(agent.session_id, user_text)
+            self._jobs[job.job_id] = job
+            self._latest[agent.session_id] = job.job_id
+        # 沿用提交方的上下文 (如补全缓存开关)，与 chat_events 的后台线程一致
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, agent, job, use_cache, runner)
+        return job
+
+    def run_in_pool(self, fn, *args, **kwargs) -> Future:
+        """在同一组 Worker 上执行其他 Agent 任务 (如并行起草候选方向)，与对话轮次共享并发上限"""
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, fn, *args, **kwargs)
+
+    @staticmethod
+    def _run(agent, job: TurnJob, use_cache: bool, runner=None):
+        job._mark_running()
+        print(f"\n[System] LLM Request Started for User {job.session_id} (job {job.job_id})...")
+        if runner is not None:
+            runner(job)
+        else:
+            agent.run_turn(job.user_text, job, use_cache=use_cache)
+        print(f"\n[System] Turn {job.job_id} for User {job.session_id} finished: {job.state}.")
+
+    def _latest_locked(self, session_id: str) -> Optional[TurnJob]:
+        job_id = self._latest.get(session_id)
+        return self._jobs.get(job_id) if job_id else None
+
+    def get(self, job_id: str) -> Optional[TurnJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending(self, session_id: str) -> Optional[TurnJob]:
+        """该研究员尚未被 GUI 收取结果的最近一轮 (运行中、排队中或已结束)"""
+        with self._lock:
+            job = self._latest_locked(session_id)
+        return job if job is not None and not job.collected else None
+
+    def collect(self, job: TurnJob):
+        job.collected = True
+
+    def status(self) -> Dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "workers": self.max_workers,
+            "running": sum(job.state == "running" for job in jobs),
+            "queued": sum(job.state == "queued" for job in jobs),
+        }
+
+
+_pool: Optional[TurnPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_turn_pool() -> TurnPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = TurnPool()
+        return _pool
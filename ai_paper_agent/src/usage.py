@@ -0,0 +1,185 @@
+import contextvars
+import threading
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+import openai
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from src.llm_cache import CACHE_MARKER
+
+# 最近一次请求的服务商原始 usage (dict)。
+# langchain-openai 在流式模式下只保留 input/output/total，会丢掉缓存命中字段，因此在 OpenAI 客户端层截获。
+_last_raw_usage: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("last_raw_usage", default=None)
+
+
+def extract_cached_tokens(usage: Optional[dict]) -> int:
+    """兼容不同服务商的前缀缓存命中字段"""
+    if not usage:
+        return 0
+    # OpenAI / Aihubmix 等兼容端点
+    details = usage.get("prompt_tokens_details") or {}
+    if details.get("cached_tokens"):
+        return int(details["cached_tokens"])
+    # DeepSeek
+    if usage.get("prompt_cache_hit_tokens"):
+        return int(usage["prompt_cache_hit_tokens"])
+    return 0
+
+
+class _UsageCapturingStream:
+    """包装 openai.Stream / AsyncStream：透传每个 chunk，并记录其中携带的 usage"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __iter__(self):
+        for chunk in self._stream:
+            if getattr(chunk, "usage", None):
+                _last_raw_usage.set(chunk.usage.model_dump())
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            if getattr(chunk, "usage", None):
+                _last_raw_usage.set(chunk.usage.model_dump())
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self._stream.__exit__(*exc)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._stream.__aexit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _UsageCapturingCompletions:
+    """代理 client.chat.completions，仅拦截 create()，其余属性原样转发"""
+
+    def __init__(self, completions, is_async: bool):
+        self._completions = completions
+        self._is_async = is_async
+
+    def create(self, **payload):
+        if self._is_async:
+            return self._acreate(**payload)
+        response = self._completions.create(**payload)
+        return self._wrap(response)
+
+    async def _acreate(self, **payload):
+        response = await self._completions.create(**payload)
+        return self._wrap(response)
+
+    def _wrap(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            _last_raw_usage.set(usage.model_dump())
+            return response
+        if isinstance(response, (openai.Stream, openai.AsyncStream)):
+            return _UsageCapturingStream(response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+def instrument_chat_model(llm):
+    """让 ChatOpenAI 在流式输出时也请求 usage，并截获服务商原始 usage 字段"""
+    llm.stream_usage = True
+    llm.client = _UsageCapturingCompletions(llm.client, is_async=False)
+    llm.async_client = _UsageCapturingCompletions(llm.async_client, is_async=True)
+    return llm
+
+
+class UsageTracker(BaseCallbackHandler):
+    """
+    按阶段统计 LLM 调用：输入 / 缓存命中 / 输出 token 与耗时，
+    用于观察前缀缓存在各阶段带来的延迟与成本收益。
+    同时统计本地补全缓存 (CachedChatOpenAI) 的命中 / 未命中次数，命中的调用不计入 token 与耗时。
+    """
+
+    # 同步执行回调，保证能读到同一上下文中截获的原始 usage
+    run_inline = True
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.phase = "init"
+        self._lock = threading.Lock()
+        self._starts: Dict[UUID, float] = {}
+        self.stats: Dict[str, dict] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any):
+        _last_raw_usage.set(None)
+        with self._lock:
+            self._starts[run_id] = time.time()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            started = self._starts.pop(run_id, None)
+        latency = time.time() - started if started else 0.0
+
+        completion_cache = None
+        for gens in response.generations:
+            for gen in gens:
+                completion_cache = (gen.generation_info or {}).get(CACHE_MARKER) or completion_cache
+        if completion_cache == "hit":
+            with self._lock:
+                self._phase_stats()["completion_hits"] += 1
+            print(f"[System] [User {self.session_id}] LLM usage ({self.phase}): completion cache hit "
+                  f"latency={latency:.2f}s")
+            return
+
+        raw_usage = _last_raw_usage.get() or (response.llm_output or {}).get("token_usage") or {}
+        input_tokens = raw_usage.get("prompt_tokens", 0)
+        output_tokens = raw_usage.get("completion_tokens", 0)
+        if not raw_usage:
+            # 回退：从消息的 usage_metadata 读取 (不含缓存字段)
+            for gens in response.generations:
+                for gen in gens:
+                    meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                    input_tokens += meta.get("input_tokens", 0)
+                    output_tokens += meta.get("output_tokens", 0)
+        cached_tokens = extract_cached_tokens(raw_usage)
+
+        with self._lock:
+            phase_stats = self._phase_stats()
+            if completion_cache == "miss":
+                phase_stats["completion_misses"] += 1
+            phase_stats["calls"] += 1
+            phase_stats["input_tokens"] += input_tokens
+            phase_stats["cached_tokens"] += cached_tokens
+            phase_stats["output_tokens"] += output_tokens
+            phase_stats["latency"] += latency
+
+        hit_rate = cached_tokens / input_tokens if input_tokens else 0.0
+        print(f"[System] [User {self.session_id}] LLM usage ({self.phase}): input={input_tokens} "
+              f"cached={cached_tokens} ({hit_rate:.0%}) output={output_tokens} latency={latency:.2f}s")
+
+    def _phase_stats(self) -> dict:
+        return self.stats.setdefault(self.phase, {
+            "calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "latency": 0.0,
+            "completion_hits": 0, "completion_misses": 0,
+        })
+
+    def summary(self) -> Dict[str, dict]:
+        """各阶段汇总，附带缓存命中率与平均延迟"""
+        with self._lock:
+            result = {}
+            for phase, s in self.stats.items():
+                result[phase] = dict(
+                    s,
+                    cache_hit_rate=s["cached_tokens"] / s["input_tokens"] if s["input_tokens"] else 0.0,
+                    avg_latency=s["latency"] / s["calls"] if s["calls"] else 0.0,
+                )
+            return result
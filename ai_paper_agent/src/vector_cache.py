@@ -0,0 +1,145 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from src.config import RES_DIR, VECTOR_CACHE_BUDGET_MB
+
+# 指向当前版本索引子目录的指针文件 (位于 faiss_index/ 下)
+CURRENT_FILE = "CURRENT"
+
+
+def current_index_dir(index_path: Path) -> Optional[Path]:
+    """
+    当前版本的索引目录；还没有索引时返回 None。
+    同步每次把 index.faiss / index.pkl 写进新的版本子目录，再原子替换 CURRENT 指针 (见 KnowledgeSyncWorker)，
+    读取方先解析指针、再从同一目录读取两个文件，不会把新的向量索引与旧的 docstore 配对。
+    没有指针时兼容旧布局 (两个文件直接位于 index_path 下)。
+    """
+    try:
+        version = (index_path / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        version = ""
+    index_dir = index_path / version if version else index_path
+    return index_dir if (index_dir / "index.faiss").exists() else None
+
+
+def index_size_bytes(index_dir: Path) -> int:
+    """以磁盘文件大小估算索引常驻内存 (FAISS 向量 + docstore)"""
+    return sum(p.stat().st_size for p in index_dir.glob("index.*") if p.is_file())
+
+
+def _load_readonly(index_dir: Path, embeddings) -> FAISS:
+    """
+    以只读 mmap 方式加载 FAISS 索引，向量数据由操作系统按需换页，多个会话共享同一份物理内存。
+    当前 faiss 构建不支持 mmap 时回退到常规加载。
+    """
+    try:
+        index = faiss.read_index(
+            str(index_dir / "index.faiss"),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+    except Exception:
+        index = faiss.read_index(str(index_dir / "index.faiss"))
+
+    with open(index_dir / "index.pkl", "rb") as f:
+        # 与 FAISS.load_local(allow_dangerous_deserialization=True) 相同，仅加载本服务自己写出的文件
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id
+    )
+
+
+class VectorStoreCache:
+    """
+    进程级 FAISS 索引缓存。
+    - 懒加载：第一次检索时才读盘，Agent 构造不再有 I/O；
+    - 共享：同一用户的所有浏览器标签页 / Agent 实例共用一份只读索引；
+    - LRU 淘汰：总占用超出内存预算时，优先释放最久未被访问的用户索引。
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # session_id -> threading.Lock，避免同一索引被并发重复加载 (加载结束后移除)
+
+    def get(self, session_id: str, embeddings) -> Optional[FAISS]:
+        index_path = RES_DIR / session_id / "faiss_index"
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                self._entries.move_to_end(session_id)
+                return entry["store"]
+            load_lock = self._loading.setdefault(session_id, threading.Lock())
+
+        with load_lock:
+            try:
+                return self._load(session_id, index_path, embeddings)
+            finally:
+                with self._lock:
+                    if self._loading.get(session_id) is load_lock:
+                        del self._loading[session_id]
+
+    def _load(self, session_id: str, index_path: Path, embeddings) -> Optional[FAISS]:
+        # 等锁期间可能已被其他会话加载完成
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+                return entry["store"]
+
+        index_dir = current_index_dir(index_path)
+        if index_dir is None:
+            return None
+        try:
+            store = _load_readonly(index_dir, embeddings)
+        except Exception as e:
+            print(f"[System] Warning: Failed to load vector store for {session_id}: {e}")
+            return None
+        print(f"[System] Vector store for {session_id} loaded into shared cache.")
+        self.put(session_id, store, index_size_bytes(index_dir))
+        return store
+
+    def put(self, session_id: str, store: FAISS, size_bytes: int):
+        """放入 (或替换) 某用户的索引，例如后台同步刚写完新版本时"""
+        with self._lock:
+            self._entries[session_id] = {
+                "store": store,
+                "size": size_bytes,
+                "last_used": time.time(),
+            }
+            self._entries.move_to_end(session_id)
+            self._evict_locked(keep=session_id)
+
+    def _evict_locked(self, keep: str):
+        total = sum(e["size"] for e in self._entries.values())
+        while total > self.budget_bytes and len(self._entries) > 1:
+            victim, entry = next(iter(self._entries.items()))
+            if victim == keep:
+                break
+            self._entries.pop(victim)
+            total -= entry["size"]
+            print(f"[System] Evicted idle vector store of {victim} from shared cache.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": list(self._entries.keys()),
+                "bytes": sum(e["size"] for e in self._entries.values()),
+                "budget_bytes": self.budget_bytes,
+            }
+
+
+# 全局单例：Streamlit 进程内所有会话共享
+vector_cache = VectorStoreCache(budget_bytes=VECTOR_CACHE_BUDGET_MB * 1024 * 1024)